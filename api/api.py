@@ -1,184 +1,556 @@
 from __future__ import annotations
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 from pathlib import Path
-import pandas as pd
 import numpy as np
-import requests, json, datetime, time
-import lightgbm as lgb
+import datetime, functools, os, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from velib_ml.config import FREQ_MIN, LAG_STEPS, ROLL_STEPS, DELTA_STEPS, EMA_ALPHAS
+from velib_ml.forecast_table import ForecastRebuilder, ForecastTable, build_forecast_table
+from velib_ml.live_weather import WeatherRefresher
+from velib_ml.metrics import Metrics, REQUEST_BOUNDS, SIZE_BOUNDS, prometheus_lines
+from velib_ml.online import StationStateStore, feature_matrix, occupancy
+from velib_ml.registry import ModelRegistry, ModelVersion, booster_loader
+from velib_ml.responses import encode_chunks, forecast_columns, negotiate
 
 app = FastAPI(title="Velib Forecast API")
 
-# ==== Artifacts ====
-ARTIF = Path("artifacts/v0_2_weather")
-FEAT_COLS = json.load(open(ARTIF / "feat_cols_delta.json"))
-CONFIG = {}
-cfg_path = ARTIF / "config.json"
-if cfg_path.exists():
+# ==== Instrumentation (GET /metrics, Prometheus text format) ====
+# Per endpoint: total latency, and per stage: parse_validate (body read + pydantic, up to the
+# handler), weather, features, predict (per horizon), format (response objects) and serialize
+# (after the handler: encoding + send). VELIB_METRICS=0 turns it off. VELIB_PROFILE_DIR enables
+# the slow-request sampling profiler (velib_ml.profiling): handlers slower than
+# VELIB_PROFILE_SLOW_MS get collapsed stacks written there, for VELIB_PROFILE_SAMPLE of requests.
+INSTRUMENT = os.environ.get("VELIB_METRICS", "1") == "1"
+METRICS = Metrics()
+METRICS.histogram("request_seconds", "Request latency, first byte received to last byte sent", REQUEST_BOUNDS)
+METRICS.histogram("stage_seconds", "Time spent per request stage", REQUEST_BOUNDS)
+METRICS.histogram("batch_rows", "Rows per request", SIZE_BOUNDS)
+METRICS.counter("requests_total", "Requests by endpoint and status code")
+
+PROFILER = None
+if os.environ.get("VELIB_PROFILE_DIR"):
+    from velib_ml.profiling import SlowRequestProfiler
+    PROFILER = SlowRequestProfiler(os.environ["VELIB_PROFILE_DIR"],
+                                   slow_s=float(os.environ.get("VELIB_PROFILE_SLOW_MS", 250)) / 1e3,
+                                   sample_rate=float(os.environ.get("VELIB_PROFILE_SAMPLE", 1.0)))
+
+class _RequestTimer:
+    __slots__ = ("t0", "start", "end", "stages", "rows")
+
+    def __init__(self):
+        self.t0, self.start, self.end, self.stages, self.rows = time.perf_counter(), None, None, [], None
+
+_TIMER: ContextVar[Optional[_RequestTimer]] = ContextVar("velib_request_timer", default=None)
+
+@contextmanager
+def _stage(name: str, horizon: Optional[int] = None):
+    t0 = time.perf_counter()
     try:
-        CONFIG = json.load(open(cfg_path))
-    except Exception:
-        CONFIG = {}
-
-TARGET_KIND = CONFIG.get("target_kind", "delta_occ")     # "delta_occ" or "delta_bikes"
-GAMMAS = {str(k): v for k, v in CONFIG.get("gamma", {"15":1.0,"30":1.0,"60":1.0}).items()}
-
-# Load one model per horizon if available
-def _booster(p: Path) -> Optional[lgb.Booster]:
-    return lgb.Booster(model_file=str(p)) if p.exists() else None
-
-MODELS: Dict[int, lgb.Booster] = {}
-for h in (15, 30, 60):
-    m = _booster(ARTIF / f"lgbm_delta_h{h}.txt")
-    if m is not None:
-        MODELS[h] = m
-if not MODELS:
-    # fallback for older naming
-    m30 = _booster(ARTIF / "model_30.txt")
-    if m30:
-        MODELS[30] = m30
-if not MODELS:
-    raise FileNotFoundError("No LightGBM models found in artifacts/v0_2_weather/")
-
-# ==== Weather (cached) ====
-_WEATHER_CACHE: Dict[str, float | dict] = {"ts": 0.0, "val": {}}
-def fetch_current_weather(ttl_sec: int = 90) -> dict:
-    now = time.time()
-    if now - float(_WEATHER_CACHE["ts"]) < ttl_sec and _WEATHER_CACHE["val"]:
-        return _WEATHER_CACHE["val"]  # cached
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = dict(latitude=48.8566, longitude=2.3522, timezone="UTC",
-                  current="temperature_2m,precipitation,wind_speed_10m")
+        yield
+    finally:
+        rt = _TIMER.get()
+        if rt is not None:
+            rt.stages.append((name, time.perf_counter() - t0, horizon))
+
+def _batch_rows(n: int) -> None:
+    rt = _TIMER.get()
+    if rt is not None:
+        rt.rows = n
+
+def _instrumented(fn):
+    """Marks handler start/end for the middleware (and profiles the handler if enabled)."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        rt = _TIMER.get()
+        if rt is not None:
+            rt.start = time.perf_counter()
+        try:
+            if PROFILER is None:
+                return fn(*args, **kwargs)
+            with PROFILER.track(fn.__name__):
+                return fn(*args, **kwargs)
+        finally:
+            if rt is not None:
+                rt.end = time.perf_counter()
+    return wrapper
+
+class _MetricsMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware: no extra task, streaming untouched)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not INSTRUMENT:
+            return await self.app(scope, receive, send)
+        rt, status = _RequestTimer(), [500]
+        token = _TIMER.set(rt)
+
+        async def send_status(msg):
+            if msg["type"] == "http.response.start":
+                status[0] = msg["status"]
+            await send(msg)
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            _TIMER.reset(token)
+            _record(scope, rt, status[0])
+
+def _record(scope, rt: _RequestTimer, status: int) -> None:
+    t1 = time.perf_counter()
+    endpoint = getattr(scope.get("route"), "path", "unmatched")   # route template: bounded label values
+    METRICS.observe("request_seconds", t1 - rt.t0, endpoint=endpoint)
+    METRICS.inc("requests_total", endpoint=endpoint, status=str(status))
+    if rt.start is not None:
+        METRICS.observe("stage_seconds", rt.start - rt.t0, endpoint=endpoint, stage="parse_validate")
+    if rt.end is not None:
+        METRICS.observe("stage_seconds", t1 - rt.end, endpoint=endpoint, stage="serialize")
+    for name, dt, h in rt.stages:
+        if h is None:
+            METRICS.observe("stage_seconds", dt, endpoint=endpoint, stage=name)
+        else:
+            METRICS.observe("stage_seconds", dt, endpoint=endpoint, stage=name, horizon=str(h))
+    if rt.rows is not None:
+        METRICS.observe("batch_rows", rt.rows, endpoint=endpoint)
+
+app.add_middleware(_MetricsMiddleware)
+
+# ==== Models (versioned registry, hot-reloaded from the artifacts root) ====
+# VELIB_ARTIFACTS_ROOT: a dir of artifact dirs (train.py / refresh.py outputs; newest is served)
+# or one artifact dir. VELIB_MODEL_VERSION pins a version; VELIB_KEEP_VERSIONS stay resident.
+# VELIB_INFERENCE_BACKEND=compiled walks the trees with numpy (velib_ml.trees) instead of lgb.Booster;
+# =bundle also loads each version from its pre-compiled bundle.npz (scripts/build_bundle.py) when
+# present. Neither imports lightgbm, and nothing on the serving path imports pandas.
+ARTIFACTS_ROOT = Path(os.environ.get("VELIB_ARTIFACTS_ROOT", "artifacts"))
+INFERENCE_BACKEND = os.environ.get("VELIB_INFERENCE_BACKEND", "lightgbm")
+if INFERENCE_BACKEND not in ("lightgbm", "compiled", "bundle"):
+    raise ValueError(f"VELIB_INFERENCE_BACKEND must be 'lightgbm', 'compiled' or 'bundle', got {INFERENCE_BACKEND!r}")
+
+_booster = booster_loader(INFERENCE_BACKEND)
+
+REGISTRY = ModelRegistry(
+    ARTIFACTS_ROOT, _booster,
+    keep=int(os.environ.get("VELIB_KEEP_VERSIONS", 2)),
+    poll_s=float(os.environ.get("VELIB_REGISTRY_POLL_S", 30)),
+    pin=os.environ.get("VELIB_MODEL_VERSION") or None,
+    prefer_bundle=INFERENCE_BACKEND == "bundle",
+)
+if REGISTRY.refresh() is None:
+    raise FileNotFoundError(f"No LightGBM models found under {ARTIFACTS_ROOT}/")
+
+def _version(version: Optional[str] = None) -> ModelVersion:
     try:
-        r = requests.get(url, params=params, timeout=10)
-        r.raise_for_status()
-        j = r.json().get("current", {})
-    except Exception:
-        j = {}
-    precip = float(j.get("precipitation", 0.0) or 0.0)
-    out = {
-        "temperature_2m": float(j.get("temperature_2m", 0.0) or 0.0),
-        "precipitation": precip,
-        "wind_speed_10m": float(j.get("wind_speed_10m", 0.0) or 0.0),
-        "is_rain": 1 if precip > 0.1 else 0,
-    }
-    _WEATHER_CACHE.update({"ts": now, "val": out})
-    return out
+        mv = REGISTRY.get(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version {version!r} not resident. "
+                                                    f"Have: {list(REGISTRY.resident)}")
+    mv.requests += 1
+    return mv
+
+# ==== Weather (background refresh, handlers only read the snapshot) ====
+WEATHER = WeatherRefresher(
+    interval_s=float(os.environ.get("VELIB_WEATHER_REFRESH_S", 90)),
+    max_staleness_s=float(os.environ.get("VELIB_WEATHER_MAX_STALENESS_S", 900)),
+)
+
+@app.on_event("startup")
+def _start_weather():
+    WEATHER.start()
+    REGISTRY.start()
+    if PIPELINE is not None:
+        PIPELINE.start()
+
+@app.on_event("shutdown")
+def _stop_weather():
+    WEATHER.stop()
+    REGISTRY.stop()
+    if PIPELINE is not None:
+        PIPELINE.stop()
+
+def fetch_current_weather() -> dict:
+    return WEATHER.snapshot()
+
+def _weather() -> dict:
+    with _stage("weather"):
+        return fetch_current_weather()
 
 # ==== Schemas ====
 class InputRow(BaseModel):
+    station_id: str
+    # Current state; may be omitted for stations fed through /ingest (read from the state store)
+    bikes_available: Optional[float] = None
+    capacity: Optional[float] = None
+    ts: Optional[datetime.datetime] = None
+    # Optional 5-min history (oldest→newest), up to last 36 values (180min); overrides the state store
+    history_5min: Optional[List[float]] = None
+
+class Observation(BaseModel):
     station_id: str
     bikes_available: float
     capacity: float
     ts: datetime.datetime
-    # Optional 5-min history (oldest→newest), up to last 12 values (60min)
-    history_5min: Optional[List[float]] = None
 
-# ==== Feature building ====
-def _occ(x: float, cap: float) -> float:
-    if not cap or cap <= 0:
-        return 0.0
-    return float(np.clip(x / cap, 0.0, 1.0))
+class IngestRequest(BaseModel):
+    rows: List[Observation]
 
-def _time_feats(ts: datetime.datetime) -> dict:
-    ts = pd.Timestamp(ts).tz_localize("UTC") if pd.Timestamp(ts).tzinfo is None else pd.Timestamp(ts).tz_convert("UTC")
-    h, d = ts.hour, ts.dayofweek
-    return {
-        "hour_sin": float(np.sin(2*np.pi*h/24)),
-        "hour_cos": float(np.cos(2*np.pi*h/24)),
-        "dow": int(d),
-        "is_weekend": int(d >= 5),
-    }
+# ==== Station state (fed by /ingest, one ring buffer row per station) ====
+STATE = StationStateStore()
+
+# ==== Feature building (columnar: one float32 matrix for all rows) ====
+HIST_LEN = max(ROLL_STEPS)  # last 180min of 5-min history
+_occ = occupancy
+
+def _epoch_s(ts: datetime.datetime) -> float:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    return ts.timestamp()
 
-def _history_feats(history: Optional[List[float]], cap: float, occ_now: float) -> dict:
+def _history_matrix(rows: List[InputRow]) -> np.ndarray:
+    # right-aligned (oldest→newest), NaN-padded when a row has fewer values
+    H = np.full((len(rows), HIST_LEN), np.nan)
+    for i, r in enumerate(rows):
+        hist = (r.history_5min or [])[-HIST_LEN:]
+        if hist:
+            H[i, HIST_LEN - len(hist):] = hist
+    return H
+
+def _history_feats(hist: np.ndarray, cap: np.ndarray, occ_now: np.ndarray) -> dict:
+    # client-supplied history: short histories fall back to occ_now / the mean of what was sent
     feats = {}
-    hist = list(history or [])[-12:]  # last 60min
-    hist_occ = [_occ(v, cap) for v in hist]
-    def lag_k(k, default): return float(hist_occ[-k]) if len(hist_occ) >= k else float(default)
-    feats["occ_lag_5"]  = lag_k(1, occ_now)
-    feats["occ_lag_10"] = lag_k(2, occ_now)
-    feats["occ_lag_15"] = lag_k(3, occ_now)
-    feats["occ_lag_30"] = lag_k(6, occ_now)
-    feats["occ_lag_60"] = lag_k(12, occ_now)
-    def roll_mean(n): return float(np.mean(hist_occ[-min(n,len(hist_occ)):])) if hist_occ else float(occ_now)
-    feats["occ_roll_60"]  = roll_mean(12)
-    feats["occ_roll_120"] = roll_mean(24)
-    feats["occ_roll_180"] = roll_mean(36)
-    def delta_k(k): return float(occ_now - lag_k(k, occ_now))
-    feats["occ_delta_5"]  = delta_k(1)
-    feats["occ_delta_15"] = delta_k(3)
-    feats["occ_delta_30"] = delta_k(6)
-    feats["occ_delta_60"] = delta_k(12)
+    hist_occ = np.where(np.isnan(hist), np.nan, _occ(hist, cap[:, None]))
+    have = ~np.isnan(hist_occ)
+    def lag_k(k): return np.where(have[:, -k], hist_occ[:, -k], occ_now)
+    for k in LAG_STEPS:
+        feats[f"occ_lag_{k*FREQ_MIN}"] = lag_k(k)
+    for n in ROLL_STEPS:
+        cnt = have[:, -n:].sum(axis=1)
+        tot = np.where(have[:, -n:], hist_occ[:, -n:], 0.0).sum(axis=1)
+        feats[f"occ_roll_{n*FREQ_MIN}"] = np.where(cnt > 0, tot / np.maximum(cnt, 1), occ_now)
+    for k in DELTA_STEPS:
+        feats[f"occ_delta_{k*FREQ_MIN}"] = occ_now - lag_k(k)
+    for name, a in EMA_ALPHAS.items():
+        ema = np.full(len(occ_now), np.nan)
+        for j in range(hist_occ.shape[1]):
+            x = hist_occ[:, j]
+            ema = np.where(have[:, j], np.where(np.isnan(ema), x, a * x + (1 - a) * ema), ema)
+        feats[name] = np.where(np.isnan(ema), occ_now, ema)
+    feats["occ_momentum"] = feats["occ_ema_fast"] - feats["occ_ema_slow"]
     return feats
 
-def build_feature_row(inp: InputRow, weather: dict | None = None) -> pd.DataFrame:
+def _row_inputs(rows: List[InputRow]) -> Dict[str, np.ndarray]:
+    """Current state + history features per row: client values first, then the state store."""
+    bikes = np.array([np.nan if r.bikes_available is None else r.bikes_available for r in rows], dtype="float64")
+    cap   = np.array([np.nan if r.capacity is None else r.capacity for r in rows], dtype="float64")
+    epoch = np.array([np.nan if r.ts is None else _epoch_s(r.ts) for r in rows], dtype="float64")
+    sidx  = STATE.lookup([r.station_id for r in rows])
+    sidx[np.array([r.history_5min is not None for r in rows], dtype=bool)] = -1
+    use = sidx >= 0
+    st = STATE.features(sidx[use]) if use.any() else {}
+    for arr, key in ((bikes, "bikes_available"), (cap, "capacity"), (epoch, "ts")):
+        if use.any():
+            arr[use] = np.where(np.isnan(arr[use]), st[key], arr[use])
+    unknown = np.isnan(bikes) | np.isnan(cap)
+    if unknown.any():
+        ids = sorted({rows[i].station_id for i in np.flatnonzero(unknown)})[:10]
+        raise HTTPException(status_code=404, detail=f"No state for station(s) {ids}: send bikes_available "
+                                                    "and capacity, or feed them through /ingest")
+    epoch = np.where(np.isnan(epoch), time.time(), epoch)
+    occ_now = _occ(bikes, cap)
+    cols = {"station_id": [r.station_id for r in rows],
+            "bikes_available": bikes, "capacity": cap, "occ_now": occ_now, "ts": epoch,
+            **_history_feats(_history_matrix(rows), cap, occ_now)}
+    if use.any():
+        for name in cols:
+            if name.startswith("occ_") and name != "occ_now" and name in st:
+                cols[name][use] = st[name]
+        for k in DELTA_STEPS:  # relative to the resolved current value (client may override it)
+            cols[f"occ_delta_{k*FREQ_MIN}"][use] = occ_now[use] - st[f"occ_lag_{k*FREQ_MIN}"]
+    return cols
+
+def build_feature_matrix(rows: List[InputRow], weather: dict | None = None,
+                         inputs: Dict[str, np.ndarray] | None = None,
+                         mv: ModelVersion | None = None) -> np.ndarray:
+    mv = mv or REGISTRY.get()
     weather = weather or fetch_current_weather()
-    occ_now = _occ(inp.bikes_available, inp.capacity)
-    base = {
-        "station_id": inp.station_id,
-        "bikes_available": float(inp.bikes_available),
-        "capacity": float(inp.capacity),
-        "occ_now": occ_now,
-        **_time_feats(inp.ts),
-        **weather,
-        **_history_feats(inp.history_5min, inp.capacity, occ_now),
-    }
-    # rough station encodings fallback (replace by real encodings if you export them)
-    base.setdefault("sta_mean_occ", occ_now)
-    base.setdefault("sta_hdh_occ",  occ_now)
-    # align to expected feature order
-    row = {c: float(base.get(c, 0.0)) for c in FEAT_COLS}
-    return pd.DataFrame([row], columns=FEAT_COLS).astype("float32")
-
-def _predict_for_horizon(h: int, X: pd.DataFrame, bikes_now: float, capacity: float) -> Dict[str, float]:
-    mdl = MODELS[h]
-    delta = float(mdl.predict(X)[0])
-    delta *= float(GAMMAS.get(str(h), 1.0) or 1.0)
-    # convert Δocc → Δbikes if needed
-    delta_bikes = delta * capacity if TARGET_KIND == "delta_occ" else delta
-    y_hat = float(np.clip(bikes_now + delta_bikes, 0, capacity))
-    return {"predicted_bikes": round(y_hat, 3), "delta_model": round(delta, 6)}
+    inputs = inputs if inputs is not None else _row_inputs(rows)
+    return feature_matrix(inputs, mv.feat_cols, weather, mv.encodings)
+
+def build_feature_row(inp: InputRow, weather: dict | None = None, mv: ModelVersion | None = None):
+    import pandas as pd
+    mv = mv or REGISTRY.get()
+    return pd.DataFrame(build_feature_matrix([inp], weather, mv=mv), columns=mv.feat_cols)
+
+def _predict_matrix(h: int, X: np.ndarray, bikes_now: np.ndarray, capacity: np.ndarray,
+                    mv: ModelVersion | None = None):
+    with _stage("predict", h):
+        return (mv or REGISTRY.get()).predict(h, X, bikes_now, capacity)
+
+def _predict_horizons(horizons: List[int], X: np.ndarray, bikes_now: np.ndarray, capacity: np.ndarray,
+                      mv: ModelVersion | None = None) -> Dict[int, tuple]:
+    """{h: (y_hat, delta)}: one predict call per horizon, or a single one for a multi-horizon model."""
+    mv = mv or REGISTRY.get()
+    if mv.multi is None:
+        return {h: _predict_matrix(h, X, bikes_now, capacity, mv) for h in horizons}
+    with _stage("predict", "all"):
+        return mv.predict_many(horizons, X, bikes_now, capacity)
+
+def _predict_for_horizon(h: int, X: np.ndarray, bikes_now: float, capacity: float,
+                         mv: ModelVersion | None = None) -> Dict[str, float]:
+    y_hat, delta = _predict_matrix(h, X, np.array([bikes_now]), np.array([capacity]), mv)
+    return {"predicted_bikes": round(float(y_hat[0]), 3), "delta_model": round(float(delta[0]), 6)}
+
+# ==== Precomputed full-network forecasts (rebuilt after every ingested snapshot) ====
+# /ingest only requests a rebuild: one background worker builds the table off the request
+# path, coalescing the ingests that land while it is busy.
+FORECAST_ON_INGEST = os.environ.get("VELIB_FORECAST_TABLE", "1") == "1"
+FORECAST: Optional[ForecastTable] = None
+
+def _publish_forecast(table: ForecastTable) -> None:
+    global FORECAST
+    FORECAST = table                                     # atomic swap
+
+def refresh_forecast_table(mv: ModelVersion | None = None) -> Optional[ForecastTable]:
+    if not len(STATE):
+        return None
+    table = build_forecast_table(STATE, mv or REGISTRY.get(), fetch_current_weather())
+    _publish_forecast(table)
+    return table
+
+FORECAST_BUILDER = ForecastRebuilder(refresh_forecast_table)
+
+# a newly activated version rebuilds the table right away
+REGISTRY.on_swap = lambda mv: FORECAST_BUILDER.request() if FORECAST_ON_INGEST else None
+
+# ==== Streaming ingest (VELIB_STREAM_SOURCE=gbfs, or a snapshot dir / SnapshotStore to replay) ====
+# A background asyncio pipeline (velib_ml.streaming) polls snapshots into STATE and publishes
+# a fresh forecast table after each one, without any client calling /ingest.
+STREAM_SOURCE = os.environ.get("VELIB_STREAM_SOURCE") or None
+PIPELINE = None
+
+if STREAM_SOURCE:
+    from velib_ml.streaming import GBFSSource, MemorySink, ReplaySource, StreamingPipeline
+    _interval = float(os.environ.get("VELIB_STREAM_INTERVAL_S", 30))
+    PIPELINE = StreamingPipeline(
+        GBFSSource(interval_s=_interval) if STREAM_SOURCE == "gbfs" else ReplaySource(STREAM_SOURCE, interval_s=_interval),
+        REGISTRY, [MemorySink(_publish_forecast)], state=STATE, weather=lambda: fetch_current_weather())
+
+# ==== Shadow scoring (VELIB_SHADOW=1): other resident versions score each batch off the request path ====
+SHADOW = os.environ.get("VELIB_SHADOW", "0") == "1"
+_SHADOW_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow") if SHADOW else None
+
+def _shadow_score(active: ModelVersion, inp: Dict[str, np.ndarray], weather: dict,
+                  preds: Dict[int, np.ndarray]) -> None:
+    for mv in REGISTRY.others(active):
+        X = build_feature_matrix([], weather, inp, mv)
+        hs = [h for h in preds if h in mv.models]
+        for h, (y_hat, _) in mv.predict_many(hs, X, inp["bikes_available"], inp["capacity"]).items():
+            mv.record_shadow(h, np.abs(y_hat - preds[h]))
+
+def _not_modified(request: Request, table: ForecastTable) -> bool:
+    tags = request.headers.get("if-none-match", "")
+    return table.etag in [t.strip() for t in tags.split(",")] or tags.strip() == "*"
 
 # ==== Endpoints ====
 @app.get("/health")
 def health():
+    mv = REGISTRY.get()
     return {
-        "models_loaded": sorted(MODELS.keys()),
-        "n_features": len(FEAT_COLS),
-        "target_kind": TARGET_KIND,
-        "weather_cached": bool(_WEATHER_CACHE["val"]),
+        "models_loaded": mv.horizons,
+        "inference_backend": INFERENCE_BACKEND,
+        "n_features": len(mv.feat_cols),
+        "target_kind": mv.target_kind,
+        **REGISTRY.status(),
+        "shadow_scoring": SHADOW,
+        **WEATHER.status(),
+        "stations_tracked": len(STATE),
+        "forecast_stations": len(FORECAST) if FORECAST is not None else 0,
+        "forecast_age_s": round(time.time() - FORECAST.built_at, 1) if FORECAST is not None else None,
+        "forecast_rebuilds": FORECAST_BUILDER.status(),
+        "stream": PIPELINE.status() if PIPELINE is not None else None,
+        "profiler": PROFILER.status() if PROFILER is not None else None,
     }
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus text format: request/stage histograms, batch sizes, weather cache, models, stream."""
+    mv = REGISTRY.get()
+    lines = METRICS.render()
+    lines += prometheus_lines("velib_weather_cache_total", "counter", "Weather snapshots served from cache (hit) or defaulted (miss)",
+                              [({"result": "hit"}, WEATHER.hits), ({"result": "miss"}, WEATHER.misses)])
+    lines += prometheus_lines("velib_weather_refreshes_total", "counter", "Weather refresh attempts",
+                              [({"result": "ok"}, WEATHER.refreshes), ({"result": "error"}, WEATHER.failures)])
+    age = WEATHER.age_s()
+    lines += prometheus_lines("velib_weather_age_seconds", "gauge", "Age of the cached weather",
+                              [({}, age if age is not None else float("nan"))])
+    lines += prometheus_lines("velib_model_info", "gauge", "Active model version",
+                              [({"version": mv.name, "backend": INFERENCE_BACKEND}, 1)])
+    lines += prometheus_lines("velib_model_swaps_total", "counter", "Model version swaps", [({}, REGISTRY.swaps)])
+    lines += prometheus_lines("velib_stations_tracked", "gauge", "Stations in the state store", [({}, len(STATE))])
+    if FORECAST is not None:
+        lines += prometheus_lines("velib_forecast_age_seconds", "gauge", "Age of the forecast table",
+                                  [({}, time.time() - FORECAST.built_at)])
+    if PIPELINE is not None:
+        lines += prometheus_lines("velib_stream_stage_seconds", "histogram", "Streaming pipeline time per stage",
+                                  [({"stage": n}, h) for n, h in list(PIPELINE.latency.items.items())])
+        lines += prometheus_lines("velib_stream_snapshots_total", "counter", "Streaming pipeline snapshots",
+                                  [({"outcome": k}, PIPELINE.counts[k]) for k in ("snapshots", "published", "coalesced", "errors")])
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@app.get("/models")
+def models():
+    return REGISTRY.status()
+
+@app.post("/models/{version}/activate")
+def activate_model(version: str):
+    """Serve a resident version (rollback / A-B switch); pins it until another activation."""
+    try:
+        mv = REGISTRY.activate(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version {version!r} not resident. "
+                                                    f"Have: {list(REGISTRY.resident)}")
+    REGISTRY.pin = version
+    return {"active_version": mv.name, "horizons": mv.horizons}
+
+@app.post("/ingest")
+@_instrumented
+def ingest(req: IngestRequest):
+    _batch_rows(len(req.rows))
+    n = STATE.update([o.station_id for o in req.rows],
+                     [o.bikes_available for o in req.rows],
+                     [o.capacity for o in req.rows],
+                     [_epoch_s(o.ts) for o in req.rows])
+    if n and FORECAST_ON_INGEST:
+        FORECAST_BUILDER.request()
+    return {"ingested": n, "stations_tracked": len(STATE)}
+
+@app.get("/forecast")
+def forecast(request: Request):
+    table = FORECAST
+    if table is None:
+        raise HTTPException(status_code=503, detail="No forecast table yet: ingest a snapshot first")
+    headers = {"ETag": table.etag, "Cache-Control": "no-cache"}
+    if _not_modified(request, table):
+        return Response(status_code=304, headers=headers)
+    return Response(content=table.body, media_type="application/json", headers=headers)
+
+@app.get("/forecast/{station_id}")
+def forecast_station(station_id: str, request: Request):
+    table = FORECAST
+    row = table.row(station_id) if table is not None else None
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"No forecast for station {station_id}")
+    headers = {"ETag": table.etag, "Cache-Control": "no-cache"}
+    if _not_modified(request, table):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(row, headers=headers)
+
 @app.post("/predict/{horizon}")
-def predict(horizon: int, row: InputRow):
-    if horizon not in MODELS:
-        return {"error": f"Model for horizon {horizon} not available. Have: {sorted(MODELS.keys())}"}
-    w = fetch_current_weather()
-    X = build_feature_row(row, w)
-    out = _predict_for_horizon(horizon, X, row.bikes_available, row.capacity)
-    return {"horizon": horizon, **out}
+@_instrumented
+def predict(horizon: int, row: InputRow, version: Optional[str] = None):
+    mv = _version(version)
+    if horizon not in mv.models:
+        return {"error": f"Model for horizon {horizon} not available. Have: {mv.horizons}"}
+    w = _weather()
+    with _stage("features"):
+        inp = _row_inputs([row])
+        X = build_feature_matrix([row], w, inp, mv)
+    out = _predict_for_horizon(horizon, X, inp["bikes_available"][0], inp["capacity"][0], mv)
+    return {"horizon": horizon, "model_version": mv.name, **out}
 
 @app.post("/predict_all")
-def predict_all(row: InputRow):
-    w = fetch_current_weather()
-    X = build_feature_row(row, w)  # build once → reuse for all horizons
-    res = {}
-    for h in sorted(MODELS.keys()):
-        res[str(h)] = _predict_for_horizon(h, X, row.bikes_available, row.capacity)
-    return {"predictions": res}
+@_instrumented
+def predict_all(row: InputRow, version: Optional[str] = None):
+    mv = _version(version)
+    w = _weather()
+    with _stage("features"):
+        inp = _row_inputs([row])
+        X = build_feature_matrix([row], w, inp, mv)  # build once → reuse for all horizons
+    preds = _predict_horizons(mv.horizons, X, inp["bikes_available"], inp["capacity"], mv)
+    res = {str(h): {"predicted_bikes": round(float(y[0]), 3), "delta_model": round(float(d[0]), 6)}
+           for h, (y, d) in preds.items()}
+    return {"model_version": mv.name, "predictions": res}
 
 class BatchRequest(BaseModel):
     rows: List[InputRow]
     horizons: Optional[List[int]] = None  # default: available models
 
+# ==== Columnar batch responses (velib_ml.responses), chosen by the Accept header ====
+# application/x-ndjson, application/msgpack or application/vnd.apache.arrow.stream get arrays
+# station_id / horizon / predicted_bikes / delta_model (horizon-major) instead of nested
+# per-row objects. Batches above VELIB_RESPONSE_CHUNK_ROWS rows are streamed: features,
+# predict and encoding run chunk by chunk while the body is sent.
+RESPONSE_CHUNK_ROWS = int(os.environ.get("VELIB_RESPONSE_CHUNK_ROWS", 5000))
+
+def _unknown_stations(rows: List[InputRow]) -> List[str]:
+    """Stations _row_inputs would reject (no client values, no ingested state), checked up front."""
+    need = [r for r in rows if r.bikes_available is None or r.capacity is None]
+    if not need:
+        return []
+    sidx = STATE.lookup([r.station_id for r in need])
+    return sorted({r.station_id for r, i in zip(need, sidx) if i < 0 or r.history_5min is not None})[:10]
+
+def _predict_chunk(rows: List[InputRow], horizons: List[int], mv: ModelVersion, w: dict):
+    with _stage("features"):
+        inp = _row_inputs(rows)
+        X = build_feature_matrix(rows, w, inp, mv)
+    return inp, _predict_horizons(horizons, X, inp["bikes_available"], inp["capacity"], mv)
+
+def _columnar_batch(rows: List[InputRow], horizons: List[int], mv: ModelVersion, media: str, shadow: bool):
+    w, n = _weather(), max(RESPONSE_CHUNK_ROWS, 1)
+    columns = lambda part, preds: forecast_columns([r.station_id for r in part], horizons,
+                                                   [preds[h][0] for h in horizons], [preds[h][1] for h in horizons])
+    first = _predict_chunk(rows[:n], horizons, mv, w) if rows else None   # errors surface before any byte
+    if first is not None and shadow and len(REGISTRY.resident) > 1:
+        _SHADOW_POOL.submit(_shadow_score, mv, first[0], w, {h: y for h, (y, _) in first[1].items()})
+
+    def chunks():
+        if first is not None:
+            yield columns(rows[:n], first[1])
+        for i in range(n, len(rows), n):
+            yield columns(rows[i:i + n], _predict_chunk(rows[i:i + n], horizons, mv, w)[1])
+
+    meta = {"model_version": mv.name}
+    if len(rows) <= n:
+        with _stage("format"):
+            body = b"".join(encode_chunks(media, chunks(), meta))
+        return Response(body, media_type=media)
+    unknown = _unknown_stations(rows[n:])
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"No state for station(s) {unknown}: send bikes_available "
+                                                    "and capacity, or feed them through /ingest")
+    return StreamingResponse(encode_chunks(media, chunks(), meta), media_type=media)
+
 @app.post("/predict_batch")
-def predict_batch(req: BatchRequest):
-    horizons = req.horizons or sorted(MODELS.keys())
-    w = fetch_current_weather()
-    results = []
-    for r in req.rows:
-        X = build_feature_row(r, w)
-        pred = {str(h): _predict_for_horizon(h, X, r.bikes_available, r.capacity) for h in horizons if h in MODELS}
-        results.append({"station_id": r.station_id, "ts": r.ts, "predictions": pred})
-    return {"items": results}
\ No newline at end of file
+@_instrumented
+def predict_batch(req: BatchRequest, request: Request = None, version: Optional[str] = None):
+    mv = _version(version)          # one version for the whole request, even if a swap happens meanwhile
+    horizons = [h for h in (req.horizons or mv.horizons) if h in mv.models]
+    _batch_rows(len(req.rows))
+    media = negotiate(request.headers.get("accept")) if request is not None else None
+    if media is not None:
+        return _columnar_batch(req.rows, horizons, mv, media, SHADOW and version is None)
+    if not req.rows:
+        return {"items": []}
+    w = _weather()
+    with _stage("features"):
+        inp = _row_inputs(req.rows)
+        X = build_feature_matrix(req.rows, w, inp, mv)  # one matrix → one predict call per horizon (or for all)
+    cols, preds = {}, {}
+    for h, (y_hat, delta) in _predict_horizons(horizons, X, inp["bikes_available"], inp["capacity"], mv).items():
+        preds[h] = y_hat
+        cols[str(h)] = (np.round(y_hat, 3).tolist(), np.round(delta, 6).tolist())
+    if SHADOW and version is None and len(REGISTRY.resident) > 1:
+        _SHADOW_POOL.submit(_shadow_score, mv, inp, w, preds)
+    with _stage("format"):
+        results = [
+            {"station_id": r.station_id,
+             "ts": r.ts or datetime.datetime.fromtimestamp(inp["ts"][i], datetime.timezone.utc),
+             "predictions": {k: {"predicted_bikes": y[i], "delta_model": d[i]} for k, (y, d) in cols.items()}}
+            for i, r in enumerate(req.rows)
+        ]
+    return {"model_version": mv.name, "items": results}
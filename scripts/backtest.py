@@ -0,0 +1,133 @@
+# scripts/backtest.py
+# Backtest walk-forward : features calculées une fois (colonnes .npy mappées),
+# folds en parallèle, MAE (vélos) par horizon × heure / jour / cluster de stations,
+# modèle vs naïf vs EWMA.
+from __future__ import annotations
+import argparse, json, time
+from pathlib import Path
+import pandas as pd
+
+from velib_ml.backtest import EWMA_ALPHA, make_folds, prepare, results_frame, run_backtest, station_clusters
+from velib_ml.chunked import feature_columns, load_feature_chunks
+from velib_ml.config import HORIZONS
+from velib_ml.data import load_timeseries
+from velib_ml.features import feature_list, make_features
+from velib_ml.panel import StationPanel
+from velib_ml.weather import add_weather, load_weather
+
+WEATHER_COLS = ["temperature_2m", "precipitation", "wind_speed_10m", "is_rain"]
+
+
+def load_features(args) -> pd.DataFrame:
+    if args.features_dir:
+        cols = feature_columns(args.features_dir)
+        need = (["ts", "station_id", "occ", "capacity", "hour", "dow"]
+                + [c for c in feature_list(use_ema=args.use_ema, use_sta=False) if c != "occ_now"]
+                + [f"occ_{h}" for h in HORIZONS] + [c for c in WEATHER_COLS if c in cols])
+        return load_feature_chunks(args.features_dir, columns=need)
+    if args.panel:
+        feat = StationPanel.load(args.panel).feature_frame(use_ema=args.use_ema)
+    else:
+        df = load_timeseries(args.data)
+        feat = (StationPanel.from_timeseries(df).feature_frame(use_ema=args.use_ema) if args.grid
+                else make_features(df, use_ema=args.use_ema))
+    if args.weather:
+        feat = add_weather(feat, load_weather(args.weather))
+    return feat
+
+
+def folds_for(args, ts_min, ts_max):
+    folds = make_folds(ts_min, ts_max, args.folds, args.test_days, args.step_days,
+                       args.train_days, args.min_train_days)
+    if not folds:
+        raise SystemExit("No fold fits in the data: lower --test-days / --min-train-days")
+    return folds
+
+
+def main(args: argparse.Namespace) -> None:
+    out = Path(args.out)
+    cols_dir = out / "columns"
+    t0 = time.time()
+
+    # ===== Features (une seule fois pour tous les folds) =====
+    if args.reuse_columns and (cols_dir / "meta.json").exists():
+        meta = json.loads((cols_dir / "meta.json").read_text())
+        folds = folds_for(args, *(pd.Timestamp(t, unit="s", tz="UTC") for t in meta["ts_range"]))
+        print(f"Columns reused from {cols_dir}")
+    else:
+        feat = load_features(args)
+        feat["occ_now"] = feat["occ"].astype("float32")
+        if args.models:
+            feat_cols = json.loads((Path(args.models) / "feat_cols_delta.json").read_text())
+            missing = [c for c in feat_cols if c not in feat.columns]
+            if missing:
+                raise SystemExit(f"--models expects features not built here: {missing}")
+        else:
+            feat_cols = feature_list(use_ema=args.use_ema, use_sta=False)
+            feat_cols += [c for c in WEATHER_COLS if c in feat.columns]
+        ts_min, ts_max = feat["ts"].min(), feat["ts"].max()
+        folds = folds_for(args, ts_min, ts_max)
+        # clusters appris avant le premier test (pas de fuite)
+        clusters = station_clusters(feat, args.clusters, before=folds[0]["test_start"]) if args.clusters else None
+        prepare(feat, feat_cols, cols_dir, HORIZONS, clusters, args.ewma_alpha)
+        meta = json.loads((cols_dir / "meta.json").read_text())
+        meta["ts_range"] = [int(ts_min.value // 10**9), int(ts_max.value // 10**9)]
+        (cols_dir / "meta.json").write_text(json.dumps(meta))
+        del feat
+    print(f"Features ready in {time.time() - t0:.1f}s")
+
+    # ===== Folds (processus en parallèle) =====
+    t1 = time.time()
+    results = run_backtest(cols_dir, folds, workers=args.workers, threads_per_worker=args.threads_per_worker,
+                           models_dir=args.models, num_boost_round=args.rounds)
+    print(f"{len(folds)} folds in {time.time() - t1:.1f}s")
+
+    df = results_frame(results)
+    out.mkdir(parents=True, exist_ok=True)
+    df.to_csv(out / "backtest.csv", index=False)
+    runs = pd.DataFrame([{**r["fold"], "n_test": r["n_test"], "fit_s": round(r["fit_s"], 2),
+                          "score_s": round(r["score_s"], 2),
+                          **{f"gamma_{h}": m["gamma"] for h, m in r["models"].items()}} for r in results])
+    for c in ("train_start", "test_start", "test_end"):
+        runs[c] = pd.to_datetime(runs[c], unit="s", utc=True)
+    runs.to_csv(out / "folds.csv", index=False)
+
+    # ===== Résumé =====
+    print(runs.to_string(index=False))
+    tot = df[(df["by"] == "all")]
+    print("\nMAE (vélos), tous folds :")
+    print(tot[tot["fold"] == -1].pivot(index="horizon", columns="method", values="mae")
+          [["model", "naive", "ewma"]].round(3).to_string())
+    print("\nMAE modèle par fold :")
+    print(tot[(tot["fold"] >= 0) & (tot["method"] == "model")]
+          .pivot(index="fold", columns="horizon", values="mae").round(3).to_string())
+    print(f"\nWritten {out / 'backtest.csv'} and {out / 'folds.csv'}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", type=str, default="data/raw/velib_timeseries_5min.csv")
+    ap.add_argument("--features-dir", type=str, default=None, help="Feature chunks from build_features.py")
+    ap.add_argument("--panel", type=str, default=None, help="StationPanel dir (build_timeseries.py --panel-out)")
+    ap.add_argument("--grid", action="store_true", help="Features on the 5-min grid (StationPanel)")
+    ap.add_argument("--weather", type=str, default=None, help="CSV or store dir from fetch_weather.py")
+    ap.add_argument("--use-ema", action="store_true")
+    ap.add_argument("--out", type=str, default="artifacts/backtest")
+    ap.add_argument("--reuse-columns", action="store_true",
+                    help="Skip feature building if OUT/columns already exists (same data, new folds)")
+
+    # folds
+    ap.add_argument("--folds", type=int, default=4)
+    ap.add_argument("--test-days", type=float, default=7)
+    ap.add_argument("--step-days", type=float, default=None, help="Default: --test-days (contiguous tests)")
+    ap.add_argument("--train-days", type=float, default=None, help="Rolling train window (default: expanding)")
+    ap.add_argument("--min-train-days", type=float, default=7)
+
+    # models / execution
+    ap.add_argument("--models", type=str, default=None, help="Reuse these artifacts instead of training per fold")
+    ap.add_argument("--rounds", type=int, default=None, help="Max boosting rounds per fold (default: training's)")
+    ap.add_argument("--workers", type=int, default=1, help="Folds run in parallel (process pool)")
+    ap.add_argument("--threads-per-worker", type=int, default=1)
+    ap.add_argument("--clusters", type=int, default=6, help="Station clusters for the breakdown (0: none)")
+    ap.add_argument("--ewma-alpha", type=float, default=EWMA_ALPHA)
+    main(ap.parse_args())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Un modèle par horizon vs. un seul modèle multi-horizon (exemples (ligne, horizon), horizon_min
+# en feature) : MAE test par horizon, arbres évalués par station pour servir les horizons
+# demandés, temps de prédiction d'un batch réseau (lgb.Booster, 1 thread) et taille des modèles.
+# Optionnellement un second modèle multi-horizon sur une grille fine (--horizon-grid 5 10 … 90),
+# évalué sur les mêmes horizons : un seul modèle couvre alors toute la grille.
+# Usage (depuis la racine du repo) :
+#   python scripts/bench_multihorizon.py --data data/raw/velib_timeseries_5min.csv --weather data/external/weather \
+#       --horizon-grid $(seq 5 5 90) --out bench/multihorizon.json
+from __future__ import annotations
+import argparse, json, time
+from pathlib import Path
+import numpy as np
+
+from velib_ml.config import HORIZONS
+from velib_ml.features import feature_list
+from velib_ml.inference import predict_bikes, predict_bikes_multi
+from velib_ml.training import train_horizons_shared, train_multi_horizon
+from train import add_data_args, training_frames
+
+
+def timeit(fn, repeat):
+    fn()  # warm-up
+    ts = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        ts.append(time.perf_counter() - t0)
+    return float(np.median(ts) * 1e3)
+
+
+def main(args: argparse.Namespace) -> None:
+    horizons = sorted(args.horizons or HORIZONS)
+    weather_cols = ["temperature_2m","precipitation","wind_speed_10m","is_rain"]
+    train_d, test_d, _, info, cache_status, _ = training_frames(args, weather_cols)
+    feat_cols = feature_list(use_ema=args.use_ema, use_sta=args.use_sta)
+    if info["use_weather"]:
+        feat_cols = feat_cols + weather_cols
+    print(f"{info['n_rows']:,} rows, {info['n_stations']} stations, features: cache {cache_status}")
+
+    # un batch « réseau » : une ligne par station (la dernière du test)
+    last = test_d.dropna(subset=feat_cols).groupby("station_id", observed=True).tail(1)
+    X = last[feat_cols].to_numpy("float32")
+    bikes, cap = (last["occ_now"] * last["capacity"]).to_numpy(), last["capacity"].to_numpy("float64")
+
+    t0 = time.time()
+    per_h = train_horizons_shared(train_d, test_d, feat_cols, horizons, num_threads=args.threads)
+    setups = {"per_horizon": {
+        "train_s": time.time() - t0,
+        "mae": {h: float(per_h[h]["mae"]) for h in horizons},
+        "models": len(horizons),
+        "trees_per_station": int(sum(per_h[h]["best_iter"] or per_h[h]["model"].num_trees() for h in horizons)),
+        "model_bytes": sum(len(per_h[h]["model"].model_to_string()) for h in horizons),
+        "predict_ms": timeit(lambda: [predict_bikes(per_h[h]["model"], X, bikes, cap, per_h[h]["gamma"])
+                                      for h in horizons], args.repeat),
+        "predict_calls": len(horizons),
+    }}
+    grids = {"multi": horizons}
+    if args.horizon_grid:
+        grids[f"multi_grid{len(args.horizon_grid)}"] = sorted(set(args.horizon_grid) | set(horizons))
+    for name, grid in grids.items():
+        t0 = time.time()
+        res = train_multi_horizon(train_d, test_d, feat_cols, grid, num_threads=args.threads)
+        m, gammas = res["model"], {str(h): r["gamma"] for h, r in res["per_h"].items()}
+        setups[name] = {
+            "train_s": time.time() - t0,
+            "mae": {h: float(res["per_h"][h]["mae"]) for h in horizons},
+            "mae_grid": {h: float(r["mae"]) for h, r in res["per_h"].items()},
+            "models": 1,
+            "train_examples": res["n_train"],
+            # chaque (station, horizon) traverse tous les arbres du modèle
+            "trees_per_station": int((res["best_iter"] or m.num_trees()) * len(horizons)),
+            "model_bytes": len(m.model_to_string()),
+            "predict_ms": timeit(lambda: predict_bikes_multi(m, X, horizons, bikes, cap, gammas), args.repeat),
+            "predict_calls": 1,
+        }
+
+    print(f"\n{len(X)} stations × horizons {horizons}, lgb.Booster.predict (threads={args.threads}):")
+    print(f"{'setup':<16} {'models':>6} {'trees/station':>14} {'predict ms':>11} {'calls':>6} "
+          f"{'model KB':>9} {'train s':>8}  " + "  ".join(f"{'MAE ' + str(h):>8}" for h in horizons))
+    for name, r in setups.items():
+        print(f"{name:<16} {r['models']:>6} {r['trees_per_station']:>14} {r['predict_ms']:>11.2f} "
+              f"{r['predict_calls']:>6} {r['model_bytes'] / 1024:>9.0f} {r['train_s']:>8.0f}  "
+              + "  ".join(f"{r['mae'][h]:>8.4f}" for h in horizons))
+    for name, r in setups.items():
+        if "mae_grid" in r and len(r["mae_grid"]) > len(horizons):
+            print(f"\n{name}: test MAE over its grid")
+            print("  ".join(f"{h}:{v:.3f}" for h, v in r["mae_grid"].items()))
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps({"horizons": horizons, "stations": len(X), "setups": setups},
+                                             indent=2, default=str))
+        print(f"→ {args.out}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    add_data_args(ap)
+    ap.add_argument("--horizons", type=int, nargs="+", default=None, help="Horizons compared (default: config HORIZONS)")
+    ap.add_argument("--horizon-grid", type=int, nargs="+", default=None,
+                    help="Also train a multi-horizon model on this grid, e.g. $(seq 5 5 90)")
+    ap.add_argument("--threads", type=int, default=2)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--out", type=str, default=None, help="Results as JSON")
+    main(ap.parse_args())
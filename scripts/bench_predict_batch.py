@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# Benchmark /predict_batch : chemin colonne (1 matrice float32, 1 predict par horizon)
+# vs. l'ancien chemin ligne par ligne (build_feature_row + predict par ligne et par horizon).
+# Usage (depuis la racine du repo, artefacts présents) :
+#   python scripts/bench_predict_batch.py --sizes 1 100 1500 15000
+from __future__ import annotations
+import argparse, datetime, sys, time
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import api.api as api
+
+WEATHER = {"temperature_2m": 18.0, "precipitation": 0.0, "wind_speed_10m": 3.0, "is_rain": 0}
+
+
+def make_rows(n: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    ts = datetime.datetime(2025, 9, 2, 16, 0, tzinfo=datetime.timezone.utc)
+    rows = []
+    for i in range(n):
+        cap = float(rng.integers(10, 60))
+        hist = rng.integers(0, int(cap) + 1, 12).astype(float).tolist()
+        rows.append(api.InputRow(station_id=str(i), bikes_available=hist[-1], capacity=cap,
+                                 ts=ts, history_5min=hist))
+    return rows
+
+
+def legacy_batch(rows: list) -> list:
+    out = []
+    for r in rows:
+        X = api.build_feature_row(r, WEATHER)
+        out.append({str(h): api._predict_for_horizon(h, X, r.bikes_available, r.capacity)
+                    for h in api.REGISTRY.get().horizons})
+    return out
+
+
+def bench(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 1500, 15000])
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--legacy-max", type=int, default=1500, help="skip the per-row path above this size")
+    args = ap.parse_args()
+
+    api.fetch_current_weather = lambda *a, **k: WEATHER
+    mv = api.REGISTRY.get()
+    print(f"version={mv.name} horizons={mv.horizons} n_features={len(mv.feat_cols)}")
+    print(f"{'rows':>7} {'batch rows/s':>14} {'legacy rows/s':>14} {'speedup':>8}")
+    for n in args.sizes:
+        rows = make_rows(n)
+        req = api.BatchRequest(rows=rows)
+        t_new = bench(lambda: api.predict_batch(req), args.repeat)
+        if n <= args.legacy_max:
+            t_old = bench(lambda: legacy_batch(rows), max(1, args.repeat // 2))
+            old_s, speed = f"{n / t_old:14,.0f}", f"{t_old / t_new:7.1f}x"
+        else:
+            old_s, speed = f"{'-':>14}", f"{'-':>8}"
+        print(f"{n:>7} {n / t_new:14,.0f} {old_s} {speed}")
+
+
+if __name__ == "__main__":
+    main()
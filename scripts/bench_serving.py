@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# Benchmark de charge de l'API, hors ligne et dans le processus (client ASGI httpx, pas de
+# serveur) : rejoue des snapshots GBFS enregistrés (sortie de collect_velib_gbfs.py) ou des
+# séries synthétiques sur /predict/{h}, /predict_all et /predict_batch, en balayant
+# concurrence × taille de batch. Rapporte p50/p95/p99, req/s, lignes/s et RSS, en JSON
+# (--out) pour suivre les régressions ; --baseline compare à un rapport précédent.
+# --accept compare les encodages de réponse de /predict_batch (JSON imbriqué, NDJSON, MessagePack, Arrow).
+# Usage (depuis la racine du repo) :
+#   python scripts/bench_serving.py --artifacts artifacts --out bench_serving.json
+#   python scripts/bench_serving.py --snapshots data/raw/velib --warm-snapshots 36 --concurrency 1 8 32 --batch-sizes 1 100 1468
+#   python scripts/bench_serving.py --baseline bench_serving.json --max-regression 20
+#   python scripts/bench_serving.py --endpoints predict_batch --batch-sizes 1468 --accept application/json application/vnd.apache.arrow.stream
+from __future__ import annotations
+import argparse, asyncio, datetime, itertools, json, os, platform, resource, subprocess, sys, time
+from pathlib import Path
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+WEATHER = {"temperature_2m": 18.0, "precipitation": 0.0, "wind_speed_10m": 3.0, "is_rain": 0}
+
+
+# ===== Lignes de requête =====
+def snapshot_rows(path: str, limit: int = 0) -> list:
+    """One list of request rows per recorded snapshot (oldest first)."""
+    from velib_ml.streaming import ReplaySource, normalize_snapshot
+    out = []
+    for read in ReplaySource(path)._frames():
+        ids, bikes, cap, epoch = normalize_snapshot(read())
+        ts = [datetime.datetime.fromtimestamp(t, datetime.timezone.utc).isoformat() for t in epoch]
+        out.append([{"station_id": s, "bikes_available": float(b), "capacity": float(c), "ts": t}
+                    for s, b, c, t in zip(ids, bikes, cap, ts) if np.isfinite(b) and np.isfinite(c)])
+        if limit and len(out) >= limit:
+            break
+    return out
+
+
+def synthetic_rows(n_stations: int, n_snapshots: int, seed: int = 0) -> list:
+    """Random-walk stations on the 5-min grid, each row carrying its last hour as history_5min."""
+    rng = np.random.default_rng(seed)
+    cap = rng.integers(10, 60, n_stations).astype(float)
+    hist = np.clip(rng.integers(0, 20, (n_stations, 1)) + rng.integers(-2, 3, (n_stations, n_snapshots + 12)).cumsum(1),
+                   0, cap[:, None]).astype(float)
+    t0 = datetime.datetime(2025, 9, 2, 16, 0, tzinfo=datetime.timezone.utc)
+    out = []
+    for k in range(n_snapshots):
+        ts = (t0 + datetime.timedelta(minutes=5 * k)).isoformat()
+        h = hist[:, k:k + 12]
+        out.append([{"station_id": str(100000 + i), "bikes_available": h[i, -1], "capacity": cap[i], "ts": ts,
+                     "history_5min": h[i].tolist()} for i in range(n_stations)])
+    return out
+
+
+# ===== Charge =====
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return float("nan")
+
+
+def payloads(endpoint: str, rows: list, batch: int, horizon: int):
+    """Endless (path, json body, n rows) cycling through the rows, snapshot after snapshot."""
+    flat = itertools.cycle(itertools.chain.from_iterable(rows))
+    while True:
+        if endpoint == "predict_batch":
+            yield "/predict_batch", {"rows": [next(flat) for _ in range(batch)]}, batch
+        elif endpoint == "predict_all":
+            yield "/predict_all", next(flat), 1
+        else:
+            yield f"/predict/{horizon}", next(flat), 1
+
+
+async def run_scenario(client, endpoint: str, rows: list, batch: int, concurrency: int,
+                       duration: float, warmup: int, horizon: int, accept: str = "application/json") -> dict:
+    gen = payloads(endpoint, rows, batch, horizon)
+    headers = {"Accept": accept}
+    for _ in range(warmup):
+        path, body, _ = next(gen)
+        await client.post(path, json=body, headers=headers)
+    lat, n_rows, errors, size = [], 0, 0, 0
+    t_end = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal n_rows, errors, size
+        while time.perf_counter() < t_end:
+            path, body, n = next(gen)
+            t0 = time.perf_counter()
+            r = await client.post(path, json=body, headers=headers)
+            lat.append(time.perf_counter() - t0)
+            size = len(r.content)
+            if r.status_code != 200 or (r.headers["content-type"].startswith("application/json") and "error" in r.json()):
+                errors += 1
+            else:
+                n_rows += n
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    ms = np.asarray(lat) * 1e3
+    return {"endpoint": endpoint, "batch": batch, "concurrency": concurrency, "accept": accept,
+            "requests": len(lat), "response_bytes": size, "errors": errors, "rows": n_rows, "wall_s": round(wall, 3),
+            "req_per_s": round(len(lat) / wall, 1), "rows_per_s": round(n_rows / wall, 1),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3), "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3), "max_ms": round(float(ms.max()), 3),
+            "rss_mb": round(_rss_mb(), 1)}
+
+
+async def bench(args, api) -> list:
+    import httpx
+    if args.snapshots:
+        rows = snapshot_rows(args.snapshots, limit=args.warm_snapshots + args.max_snapshots)
+        warm, rows = rows[:args.warm_snapshots], rows[args.warm_snapshots:] or rows[-1:]
+    else:
+        rows, warm = synthetic_rows(args.stations, args.max_snapshots), []
+    if not rows or not rows[0]:
+        raise SystemExit("No request rows")
+    transport = httpx.ASGITransport(app=api.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for snap in warm:              # server-side history (lags/rolls) for the replayed stations
+            await client.post("/ingest", json={"rows": [{k: r[k] for k in ("station_id", "bikes_available",
+                                                                             "capacity", "ts")} for r in snap]})
+        horizon = api.REGISTRY.get().horizons[0]
+        for endpoint in args.endpoints:
+            sizes = args.batch_sizes if endpoint == "predict_batch" else [1]
+            accepts = args.accept if endpoint == "predict_batch" else ["application/json"]
+            for batch, conc, accept in itertools.product(sizes, args.concurrency, accepts):
+                res = await run_scenario(client, endpoint, rows, batch, conc, args.duration, args.warmup, horizon, accept)
+                results.append(res)
+                print(f"{endpoint:>13} {_short(accept):>7} {batch:>6} {conc:>5} {res['requests']:>7} {res['p50_ms']:>9.2f} "
+                      f"{res['p95_ms']:>9.2f} {res['p99_ms']:>9.2f} {res['req_per_s']:>9.1f} "
+                      f"{res['rows_per_s']:>11,.0f} {res['rss_mb']:>7.0f}{'  errors=%d' % res['errors'] if res['errors'] else ''}")
+    return results
+
+
+def _short(accept: str) -> str:
+    return accept.split("/")[-1].replace("x-", "").replace("vnd.apache.", "").split(".")[0][:7]
+
+
+def _key(r: dict) -> tuple:
+    return r["endpoint"], r.get("accept", "application/json"), r["batch"], r["concurrency"]
+
+
+def compare(results: list, baseline_path: str, max_regression: float) -> int:
+    """Print p95 / rows/s deltas vs a previous report; number of scenarios regressing more than the limit."""
+    base = {_key(r): r for r in json.loads(Path(baseline_path).read_text())["results"]}
+    bad = 0
+    print(f"\nvs {baseline_path}")
+    for r in results:
+        b = base.get(_key(r))
+        if b is None:
+            continue
+        d_p95 = 100 * (r["p95_ms"] / b["p95_ms"] - 1) if b["p95_ms"] else 0.0
+        d_rps = 100 * (r["rows_per_s"] / b["rows_per_s"] - 1) if b["rows_per_s"] else 0.0
+        flag = d_p95 > max_regression or -d_rps > max_regression
+        bad += flag
+        print(f"{r['endpoint']:>13} {_short(r['accept']):>7} {r['batch']:>6} {r['concurrency']:>5}  p95 {d_p95:+6.1f}%  rows/s {d_rps:+6.1f}%"
+              f"{'  REGRESSION' if flag else ''}")
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--artifacts", type=str, default=None, help="VELIB_ARTIFACTS_ROOT (default: env / artifacts)")
+    ap.add_argument("--backend", choices=["lightgbm", "compiled", "bundle"], default=None,
+                    help="VELIB_INFERENCE_BACKEND (default: env / lightgbm)")
+    ap.add_argument("--snapshots", type=str, default=None,
+                    help="Collector snapshot dir or SnapshotStore to replay (default: synthetic stations)")
+    ap.add_argument("--warm-snapshots", type=int, default=0, help="Replay: first N snapshots sent to /ingest, not timed")
+    ap.add_argument("--max-snapshots", type=int, default=24, help="Snapshots used for requests")
+    ap.add_argument("--stations", type=int, default=1468, help="Synthetic: number of stations")
+    ap.add_argument("--endpoints", nargs="+", default=["predict", "predict_all", "predict_batch"],
+                    choices=["predict", "predict_all", "predict_batch"])
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    ap.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 1468])
+    ap.add_argument("--accept", nargs="+", default=["application/json"],
+                    help="predict_batch: response media types to compare (application/x-ndjson, "
+                         "application/msgpack, application/vnd.apache.arrow.stream)")
+    ap.add_argument("--duration", type=float, default=3.0, help="Seconds per scenario")
+    ap.add_argument("--warmup", type=int, default=3, help="Untimed requests per scenario")
+    ap.add_argument("--out", type=str, default=None, help="JSON report")
+    ap.add_argument("--baseline", type=str, default=None, help="Previous JSON report to compare with")
+    ap.add_argument("--max-regression", type=float, default=20.0, help="%% on p95 or rows/s; exit 1 above it")
+    args = ap.parse_args()
+
+    if args.artifacts:
+        os.environ["VELIB_ARTIFACTS_ROOT"] = args.artifacts
+    if args.backend:
+        os.environ["VELIB_INFERENCE_BACKEND"] = args.backend
+    os.environ.setdefault("VELIB_REGISTRY_POLL_S", "0")
+    sys.path[:0] = [str(ROOT), str(ROOT / "src")]
+    t0 = time.perf_counter()
+    import api.api as api
+    api.fetch_current_weather = lambda *a, **k: dict(WEATHER)     # offline
+    mv = api.REGISTRY.get()
+    print(f"version={mv.name} backend={api.INFERENCE_BACKEND} horizons={mv.horizons} "
+          f"import {time.perf_counter() - t0:.2f}s  RSS {_rss_mb():.0f} MB")
+    print(f"{'endpoint':>13} {'accept':>7} {'batch':>6} {'conc':>5} {'reqs':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'req/s':>9} {'rows/s':>11} {'RSS MB':>7}")
+    results = asyncio.run(bench(args, api))
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {
+        "meta": {"commit": commit, "python": platform.python_version(), "machine": platform.machine(),
+                 "cpus": os.cpu_count(), "model_version": mv.name, "backend": api.INFERENCE_BACKEND,
+                 "source": args.snapshots or f"synthetic:{args.stations}", "duration_s": args.duration,
+                 "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                 "at": datetime.datetime.now(datetime.timezone.utc).isoformat()},
+        "results": results,
+    }
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"→ {args.out}")
+    if args.baseline and compare(results, args.baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Benchmark du démarrage à froid de l'API : temps import → première prédiction et RSS,
+# par backend (lightgbm / compiled / bundle), chaque mesure dans un processus neuf.
+# Usage (depuis la racine du repo) :
+#   python scripts/build_bundle.py --artifacts artifacts/v0_2_weather
+#   python scripts/bench_startup.py --artifacts artifacts --repeat 5 --json startup.json
+from __future__ import annotations
+import argparse, json, os, statistics, subprocess, sys, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+HEAVY = ("pandas", "lightgbm", "sklearn", "scipy", "requests", "pyarrow")
+
+CHILD = r"""
+import time, json, sys, resource
+t0 = time.perf_counter()
+import api.api as api
+t_import = time.perf_counter() - t0
+from velib_ml.live_weather import WEATHER_DEFAULT
+api.fetch_current_weather = lambda *a, **k: dict(WEATHER_DEFAULT)   # no network in the benchmark
+req = api.BatchRequest(rows=[api.InputRow(station_id="1", bikes_available=7, capacity=27,
+                                          ts="2025-09-02T16:00:00+00:00")])
+t1 = time.perf_counter()
+out = api.predict_batch(req)
+t_first = time.perf_counter() - t1
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({"import_s": t_import, "first_predict_s": t_first, "peak_rss_mb": rss,
+                  "version": out["model_version"],
+                  "heavy_modules": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY,)
+
+
+def run_once(backend: str, artifacts: str) -> dict:
+    env = dict(os.environ, VELIB_INFERENCE_BACKEND=backend, VELIB_ARTIFACTS_ROOT=artifacts,
+               VELIB_REGISTRY_POLL_S="0", VELIB_FORECAST_TABLE="0",
+               PYTHONPATH=os.pathsep.join([str(ROOT / "src"), str(ROOT), os.environ.get("PYTHONPATH", "")]))
+    t0 = time.perf_counter()
+    p = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, cwd=os.getcwd())
+    wall = time.perf_counter() - t0
+    if p.returncode != 0:
+        raise RuntimeError(f"{backend}: child failed\n{p.stderr[-2000:]}")
+    res = json.loads(p.stdout.strip().splitlines()[-1])
+    res["process_to_first_predict_s"] = wall          # interpreter start included
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--artifacts", type=str, default="artifacts", help="VELIB_ARTIFACTS_ROOT for the children")
+    ap.add_argument("--backends", nargs="+", default=["lightgbm", "compiled", "bundle"])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", type=str, default=None, help="Write the results here (for regression tracking)")
+    args = ap.parse_args()
+
+    report = {"python": sys.version.split()[0], "artifacts": args.artifacts, "repeat": args.repeat, "backends": {}}
+    print(f"{'backend':>9} {'import s':>9} {'1st pred ms':>11} {'process s':>10} {'RSS MB':>8}  heavy modules")
+    for b in args.backends:
+        runs = [run_once(b, args.artifacts) for _ in range(args.repeat)]
+        med = {k: statistics.median(r[k] for r in runs)
+               for k in ("import_s", "first_predict_s", "process_to_first_predict_s", "peak_rss_mb")}
+        med["heavy_modules"] = runs[-1]["heavy_modules"]
+        med["version"] = runs[-1]["version"]
+        report["backends"][b] = med
+        print(f"{b:>9} {med['import_s']:9.2f} {med['first_predict_s'] * 1e3:11.1f} "
+              f"{med['process_to_first_predict_s']:10.2f} {med['peak_rss_mb']:8.0f}  {','.join(med['heavy_modules']) or '-'}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+        print(f"→ {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# Parité et latence : arbres compilés (velib_ml.trees, numpy seul) vs. lgb.Booster.predict.
+# Usage :
+#   python scripts/bench_trees.py --artifacts artifacts/v0_2_weather --batch 1 16 1500
+from __future__ import annotations
+import argparse, json, time
+from pathlib import Path
+import numpy as np, pandas as pd
+import lightgbm as lgb
+
+from velib_ml.trees import CompiledTrees
+
+
+def timeit(fn, X, repeat):
+    fn(X)  # warm-up
+    ts = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(X)
+        ts.append(time.perf_counter() - t0)
+    return np.median(ts) * 1e3
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--artifacts", default="artifacts/v0_2_weather")
+    ap.add_argument("--batch", type=int, nargs="+", default=[1, 16, 1500])
+    ap.add_argument("--repeat", type=int, default=50)
+    ap.add_argument("--atol", type=float, default=1e-9)
+    args = ap.parse_args()
+
+    d = Path(args.artifacts)
+    feat_cols = json.load(open(d / "feat_cols_delta.json"))
+    X = pd.read_csv(d / "sample_features.csv")[feat_cols].to_numpy("float32")
+    # same rows with missing values, to exercise the NaN / zero default directions
+    Xm = X.copy()
+    Xm[::3, feat_cols.index("occ_lag_5") if "occ_lag_5" in feat_cols else 0] = np.nan
+    Xm[::4, -1] = np.nan
+
+    print(f"{'h':>3} {'trees':>6} {'depth':>6} {'max |Δ|':>10} {'batch':>6} {'booster ms':>11} {'compiled ms':>12}")
+    for p in sorted(d.glob("lgbm_delta_h*.txt"), key=lambda p: int(p.stem.split("_h")[-1])):
+        h = int(p.stem.split("_h")[-1])
+        booster, compiled = lgb.Booster(model_file=str(p)), CompiledTrees.from_file(p)
+        err = max(np.abs(booster.predict(A) - compiled.predict(A)).max() for A in (X, Xm))
+        assert err <= args.atol, f"h={h}: compiled trees differ from LightGBM by {err:g}"
+        for n in args.batch:
+            B = np.ascontiguousarray(np.resize(X, (n, X.shape[1])), dtype="float32")
+            print(f"{h:>3} {compiled.num_trees:>6} {compiled.depth:>6} {err:>10.2e} {n:>6} "
+                  f"{timeit(booster.predict, B, args.repeat):>11.3f} {timeit(compiled.predict, B, args.repeat):>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# scripts/build_bundle.py
+# Compile un dossier d'artefacts (train.py / refresh.py) en un seul bundle.npz servi par l'API
+# avec VELIB_INFERENCE_BACKEND=bundle (arbres pré-compilés, hash sha256, ni lightgbm ni pandas).
+from __future__ import annotations
+import argparse, time
+import numpy as np
+
+from velib_ml.bundle import Bundle, build_bundle
+from velib_ml.inference import MULTI_FILE, stack_horizons
+
+
+def main(args: argparse.Namespace) -> None:
+    t0 = time.perf_counter()
+    out = build_bundle(args.artifacts, args.out)
+    t_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    b = Bundle(out)
+    t_load = time.perf_counter() - t0
+    print(f"{out}  {out.stat().st_size / 2**20:.1f} MB  sha256={b.sha256[:16]}…  "
+          f"horizons={sorted(b.models)}  built in {t_build:.2f}s, loads in {t_load * 1e3:.0f} ms")
+    if args.check:
+        # même prédiction que les boosters texte sur sample_features.csv
+        import lightgbm as lgb, pandas as pd
+        from pathlib import Path
+        X = pd.read_csv(Path(args.artifacts) / "sample_features.csv")[b.feat_cols].to_numpy("float32")
+        if b.multi is not None:
+            # modèle multi-horizon : toutes les lignes × horizons en une matrice
+            X = stack_horizons(X, sorted(b.models))
+            ref = lgb.Booster(model_file=str(Path(args.artifacts) / MULTI_FILE)).predict(X)
+            err = float(np.abs(b.multi.predict(X) - ref).max())
+            print(f"multi ({len(b.models)} horizons): max |bundle - booster| = {err:.2e}")
+            assert err < 1e-9
+            return
+        for h, m in b.models.items():
+            ref = lgb.Booster(model_file=str(Path(args.artifacts) / f"lgbm_delta_h{h}.txt")).predict(X)
+            err = float(np.abs(m.predict(X) - ref).max())
+            print(f"h{h}: max |bundle - booster| = {err:.2e}")
+            assert err < 1e-9
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--artifacts", type=str, default="artifacts/v0_2_weather")
+    ap.add_argument("--out", type=str, default=None, help="Default: <artifacts>/bundle.npz")
+    ap.add_argument("--check", action="store_true", help="Compare with the text boosters on sample_features.csv")
+    main(ap.parse_args())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Construit les features par morceaux (hors mémoire) à partir d'un Parquet partitionné
+# (temps ou station) ou d'un gros CSV, et les écrit en chunks Parquet pour train.py :
+#   python scripts/build_features.py --input data/raw/velib_parquet --out data/features/v1 \
+#       --weather data/external/weather_hourly.csv
+#   python scripts/train.py --features-dir data/features/v1 --out artifacts/v0_3
+# --spark : même features avec PySpark (velib_ml.spark) en local[*], tous les cœurs, Parquet
+# partitionné par mois ; pour des historiques de plusieurs années :
+#   python scripts/build_features.py --spark --input data/raw/velib_parquet --out data/features/v2 \
+#       --weather data/external/weather --driver-memory 16g --local-dir /mnt/scratch/spark
+from __future__ import annotations
+import argparse, time
+
+from velib_ml.chunked import build_feature_chunks, halo_past
+from velib_ml.io_utils import peak_rss_mb
+from velib_ml.weather import load_weather
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", required=True, help="Parquet file/dir (hive partitions ok) or CSV")
+    ap.add_argument("--out", required=True, help="Output dir for part-NNNNN.parquet chunks")
+    ap.add_argument("--weather", default=None, help="CSV or store dir from fetch_weather.py")
+    ap.add_argument("--use-ema", action="store_true")
+    ap.add_argument("--chunksize", type=int, default=2_000_000, help="CSV rows per chunk")
+    ap.add_argument("--spark", action="store_true", help="Build with PySpark (month-partitioned Parquet)")
+    ap.add_argument("--master", default="local[*]", help="Spark master (--spark)")
+    ap.add_argument("--driver-memory", default="8g", help="Spark driver memory (--spark)")
+    ap.add_argument("--local-dir", default=None, help="Spark spill dir for shuffles / sorts (--spark)")
+    args = ap.parse_args()
+
+    w5 = None
+    if args.weather:
+        w5 = load_weather(args.weather)
+
+    t0 = time.time()
+    if args.spark:
+        from velib_ml import spark as vs
+        ss = vs.session(args.master, args.driver_memory, local_dir=args.local_dir)
+        feat = vs.make_features(vs.read_timeseries(ss, args.input), use_ema=args.use_ema)
+        if w5 is not None:
+            feat = vs.add_weather(feat, w5)
+        vs.write_features(feat, args.out)
+        print(f"Spark ({ss.sparkContext.defaultParallelism} cores) → {args.out} in {time.time() - t0:.1f}s")
+        ss.stop()
+        return
+    paths = build_feature_chunks(args.input, args.out, use_ema=args.use_ema,
+                                 weather_5min=w5, chunksize=args.chunksize)
+    print(f"{len(paths)} chunks → {args.out} (halo {halo_past(args.use_ema)} rows/station) "
+          f"in {time.time() - t0:.1f}s, peak RSS {peak_rss_mb():,.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
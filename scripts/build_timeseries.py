@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# Série 5 min (ts, station_id, bikes_available, capacity) extraite du SnapshotStore,
+# au format attendu par scripts/train.py --input :
+#   python scripts/build_timeseries.py --store data/raw/velib_store --start 2025-08-01 --end 2025-09-01 \
+#       --out data/raw/velib_timeseries_5min.parquet --panel-out data/panel/2025-08
+# --panel-out écrit aussi un StationPanel (.npy mappables) pour train.py --panel.
+from __future__ import annotations
+import argparse, time
+
+from velib_ml.data import clean_timeseries
+from velib_ml.panel import StationPanel
+from velib_ml.snapshot_store import SnapshotStore
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--store", required=True, help="SnapshotStore root (collect_velib_gbfs.py --store)")
+    ap.add_argument("--out", default=None, help=".csv or .parquet")
+    ap.add_argument("--panel-out", default=None, help="Also save a StationPanel dir (train.py --panel)")
+    ap.add_argument("--start", default=None, help="UTC, inclusive (default: first snapshot)")
+    ap.add_argument("--end", default=None, help="UTC, exclusive (default: last snapshot)")
+    ap.add_argument("--freq-min", type=int, default=5)
+    ap.add_argument("--compact", action="store_true", help="Compact staging files first")
+    args = ap.parse_args()
+
+    store = SnapshotStore(args.store)
+    if args.compact:
+        print("compaction:", store.compact())
+    t0 = time.time()
+    df = store.read_timeseries(args.start, args.end, freq_min=args.freq_min)
+    if args.out and args.out.endswith(".parquet"):
+        df.to_parquet(args.out, index=False)
+    elif args.out:
+        df.to_csv(args.out, index=False)
+    print(f"{len(df):,} rows, {df['station_id'].nunique()} stations, "
+          f"{df['ts'].min()} → {df['ts'].max()} in {time.time() - t0:.1f}s" + (f" → {args.out}" if args.out else ""))
+    if args.panel_out:
+        panel = StationPanel.from_timeseries(clean_timeseries(df), freq_min=args.freq_min)
+        panel.save(args.panel_out)
+        print(f"panel {panel.n_stations} × {panel.n_steps} → {args.panel_out}")
+
+
+if __name__ == "__main__":
+    main()
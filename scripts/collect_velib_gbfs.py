@@ -3,52 +3,29 @@
 # - Récupère station_information.json et station_status.json
 # - Merge par station_id + ajoute un horodatage UTC 'snapshot_ts'
 # - Ecrit un fichier par snapshot (timestampé) + un fichier 'latest' (option)
+# - Session HTTP réutilisée, les deux flux en parallèle ; station_information n'est
+#   re-téléchargé qu'à expiration de son ttl GBFS (ETag / If-Modified-Since), et un tick
+#   est sauté si station_status.last_updated n'a pas avancé (polling < 60 s possible)
+# - Avec --store : ajout dans un SnapshotStore (Parquet partitionné par jour, compaction
+#   en tâche de fond) au lieu d'un fichier par snapshot
 # Usage:
 #   python scripts/collect_velib_gbfs.py --outdir data/raw/velib --format csv --repeat --interval 60
+#   python scripts/collect_velib_gbfs.py --store data/raw/velib_store --repeat --interval 30
 
 import argparse, time, sys, os
 from datetime import datetime, timezone
-import requests
+from typing import Optional
 import pandas as pd
 
-VELIB_BASE = "https://velib-metropole-opendata.smovengo.cloud/opendata/Velib_Metropole"
-URL_INFO = f"{VELIB_BASE}/station_information.json"
-URL_STATUS = f"{VELIB_BASE}/station_status.json"
+from velib_ml.gbfs import GBFSClient, VELIB_BASE
+from velib_ml.snapshot_store import SnapshotStore
 
-def fetch_json(url: str) -> dict:
-    r = requests.get(url, timeout=20)
-    r.raise_for_status()
-    return r.json()
-
-def one_snapshot() -> pd.DataFrame:
-    info = fetch_json(URL_INFO)
-    status = fetch_json(URL_STATUS)
-    # GBFS structure: {'data': {'stations': [...]}, ...}
-    info_df = pd.DataFrame(info['data']['stations'])
-    status_df = pd.DataFrame(status['data']['stations'])
-
-    # Harmonisation colonnes (certains champs ont des alias)
-    if 'numBikesAvailable' in status_df and 'num_bikes_available' not in status_df:
-        status_df['num_bikes_available'] = status_df['numBikesAvailable']
-    if 'numDocksAvailable' in status_df and 'num_docks_available' not in status_df:
-        status_df['num_docks_available'] = status_df['numDocksAvailable']
-
-    # Merge
-    df = pd.merge(status_df, info_df, on='station_id', suffixes=('_status', '_info'), how='inner')
-
-    # Colonnes utiles de base
-    keep = [
-        'station_id', 'name', 'lat', 'lon', 'capacity',
-        'is_installed', 'is_renting', 'is_returning', 'last_reported',
-        'num_bikes_available', 'num_docks_available'
-    ]
-    existing = [c for c in keep if c in df.columns]
-    df = df[existing].copy()
-
-    # Horodatage du snapshot (UTC ISO)
-    df['snapshot_ts'] = datetime.now(timezone.utc).isoformat()
-
-    return df
+def one_snapshot(client: Optional[GBFSClient] = None) -> pd.DataFrame:
+    """Snapshot complet, même si station_status n'a pas bougé depuis le dernier appel."""
+    if client is not None:
+        return client.fetch(force=True)
+    with GBFSClient() as c:
+        return c.fetch(force=True)
 
 def write_output(df: pd.DataFrame, outdir: str, fmt: str = 'csv', latest: bool = True) -> str:
     os.makedirs(outdir, exist_ok=True)
@@ -72,35 +49,60 @@ def parse_args():
     p.add_argument('--outdir', default='data/raw/velib', help='Dossier de sortie')
     p.add_argument('--format', default='csv', choices=['csv','parquet'], help='Format de sortie')
     p.add_argument('--repeat', action='store_true', help='Boucle de collecte continue (sinon un seul snapshot)')
-    p.add_argument('--interval', type=int, default=60, help='Intervalle en secondes entre snapshots (min ~60s)')
+    p.add_argument('--interval', type=float, default=60, help='Intervalle en secondes entre ticks')
     p.add_argument('--max-snapshots', type=int, default=0, help='Nombre max de snapshots (0 = infini en mode --repeat)')
+    p.add_argument('--base-url', default=VELIB_BASE, help='Racine GBFS (ex. un stub local http://127.0.0.1:8765)')
+    p.add_argument('--info-min-interval', type=float, default=60,
+                   help='Délai minimal (s) entre deux requêtes station_information')
+    p.add_argument('--store', default=None, help='Racine SnapshotStore (remplace --outdir/--format)')
+    p.add_argument('--compact-every', type=float, default=600, help='Compaction du store toutes les N secondes')
+    p.add_argument('--no-skip', action='store_true', help='Ecrire un snapshot même si station_status est inchangé')
     return p.parse_args()
 
 def main():
     args = parse_args()
+    client = GBFSClient(base_url=args.base_url, info_min_interval_s=args.info_min_interval)
+    store = SnapshotStore(args.store) if args.store else None
+
+    def save(df):
+        if store is not None:
+            return store.append(df)
+        return write_output(df, args.outdir, args.format)
 
     if not args.repeat:
-        df = one_snapshot()
-        path = write_output(df, args.outdir, args.format)
+        path = save(one_snapshot(client))
         print(f'Snapshot écrit → {path}')
+        client.close()
+        if store is not None:
+            print(f'Compaction : {store.compact()}')
         return
 
+    if store is not None:
+        store.start_compactor(interval_s=args.compact_every)
+
     count = 0
     try:
         while True:
             start = time.time()
-            df = one_snapshot()
-            path = write_output(df, args.outdir, args.format)
-            count += 1
-            print(f'[{count}] Snapshot écrit → {path}')
-            if args.max_snapshots and count >= args.max_snapshots:
-                break
+            df = client.fetch(force=args.no_skip)
+            if df is None:
+                print(f'status inchangé (last_updated={client.status.last_updated}), tick sauté')
+            else:
+                path = save(df)
+                count += 1
+                print(f'[{count}] Snapshot écrit → {path} ({time.time() - start:.2f}s)')
+                if args.max_snapshots and count >= args.max_snapshots:
+                    break
             elapsed = time.time() - start
             to_sleep = max(0, args.interval - elapsed)
             time.sleep(to_sleep)
     except KeyboardInterrupt:
         print('Arrêt demandé (Ctrl+C).')
         sys.exit(0)
+    finally:
+        client.close()
+        if store is not None:
+            store.stop_compactor()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,97 @@
+# scripts/refresh.py
+# Refresh incrémental d'un jeu d'artefacts : features uniquement sur les données récentes,
+# boosting continué (init_model) ou refit des feuilles, gamma recalibré, nouvelle version
+# écrite à côté de la source (ex. artifacts/v0_2_weather.r202509020000).
+from __future__ import annotations
+import argparse, time
+from pathlib import Path
+import pandas as pd
+
+from velib_ml.config import HORIZONS
+from velib_ml.encodings import ENCODINGS_NAME, StationEncodings
+from velib_ml.io_utils import peak_rss_mb
+from velib_ml.refresh import MODES, load_artifacts, recent_features, refresh_horizons, save_refreshed, version_name
+from velib_ml.weather import load_weather
+
+
+def main(args: argparse.Namespace) -> None:
+    t0 = time.time()
+    src = Path(args.models)
+    models, feat_cols, cfg = load_artifacts(src)
+
+    # ===== Fenêtre récente =====
+    last_end = args.since or cfg.get("data_end_ts")
+    if args.mode == "continue" and last_end is None:
+        raise SystemExit(f"{src}/config.json has no data_end_ts (trained before it was recorded): pass --since")
+    weather = load_weather(args.weather) if args.weather else None
+    until = pd.Timestamp(args.until) if args.until else None
+    if args.mode == "continue":
+        # reprendre les origines dont la cible tombait après la fin des données d'entraînement
+        start = pd.Timestamp(last_end) - pd.Timedelta(minutes=max(HORIZONS))
+    else:
+        # refit : fenêtre glissante de --window-days avant --until (défaut : maintenant)
+        ref = until if until is not None else pd.Timestamp.now(tz="UTC")
+        start = ref - pd.Timedelta(days=args.window_days)
+    enc = StationEncodings.load(src) if (src / ENCODINGS_NAME).exists() else None
+    feat = recent_features(args.data, start, feat_cols, end=until, weather_5min=weather, encodings=enc)
+    if not len(feat):
+        raise SystemExit(f"No data after {start} in {args.data}")
+    data_end = feat["ts"].max()
+    print(f"Window {feat['ts'].min()} → {data_end}: {len(feat):,} rows "
+          f"({feat['station_id'].nunique()} stations) in {time.time() - t0:.1f}s")
+
+    # ===== Refresh par horizon =====
+    results = refresh_horizons(models, feat, feat_cols, cfg.get("gammas", {}), mode=args.mode,
+                               rounds=args.rounds, decay_rate=args.decay_rate, num_threads=args.threads,
+                               params={"learning_rate": args.learning_rate} if args.learning_rate else None,
+                               keep_better=not args.force)
+
+    out = Path(args.out) if args.out else (Path(args.out_root) if args.out_root else src.parent) / version_name(src.name, data_end)
+    if out.exists() and not args.out:
+        raise SystemExit(f"{out} already exists (no new data since that version?): pass --out to overwrite")
+    info = {"mode": args.mode, "window_start": pd.Timestamp(feat["ts"].min()).isoformat(),
+            "rounds": args.rounds, "decay_rate": args.decay_rate,
+            "kept_previous": [h for h, r in results.items() if r["kept"]]}
+    sample = feat[feat_cols].dropna().tail(1)
+    save_refreshed(src, out, results, feat_cols, cfg, data_end, info, sample=sample)
+
+    df = pd.DataFrame([{"horizon": h, **{k: v for k, v in r.items() if k != "model"}} for h, r in results.items()])
+    print(df.round(4).to_string(index=False))
+    print(f"→ {out}  ({time.time() - t0:.1f}s, peak RSS {peak_rss_mb():,.0f} MB)")
+
+    if args.experiment:
+        import mlflow
+        if args.tracking_uri:
+            mlflow.set_tracking_uri(args.tracking_uri)
+        mlflow.set_experiment(args.experiment)
+        with mlflow.start_run(run_name=f"refresh--{out.name}"):
+            mlflow.log_params({"parent": src.name, "mode": args.mode, "rounds": args.rounds,
+                               "window_start": info["window_start"], "data_end_ts": str(data_end)})
+            for h, r in results.items():
+                for k in ("mae_old", "mae_new", "mae_naive", "gamma", "train_s"):
+                    mlflow.log_metric(f"{k}_{h}", r[k])
+            mlflow.log_artifact(str(out / "metrics.csv"))
+            mlflow.log_artifact(str(out / "config.json"))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--models", type=str, required=True, help="Artifact dir to refresh (train.py or refresh.py output)")
+    ap.add_argument("--data", type=str, default="data/raw/velib_timeseries_5min.csv",
+                    help="5-min CSV/Parquet or SnapshotStore root; only the recent window is featurized")
+    ap.add_argument("--weather", type=str, default=None, help="CSV or store dir from fetch_weather.py (if the models use weather)")
+    ap.add_argument("--mode", choices=MODES, default="continue",
+                    help="continue: add trees on data since data_end_ts; refit: refit leaves on the last --window-days")
+    ap.add_argument("--since", type=str, default=None, help="Override config.json data_end_ts")
+    ap.add_argument("--until", type=str, default=None, help="Ignore data at or after this time (default: all)")
+    ap.add_argument("--window-days", type=float, default=7, help="refit window, ending at --until (default: now)")
+    ap.add_argument("--rounds", type=int, default=100, help="Max new trees per horizon (continue)")
+    ap.add_argument("--learning-rate", type=float, default=None, help="Learning rate for the new trees")
+    ap.add_argument("--decay-rate", type=float, default=0.9, help="Weight kept on old leaf values (refit)")
+    ap.add_argument("--threads", type=int, default=2)
+    ap.add_argument("--force", action="store_true", help="Keep refreshed models even if worse on the recent holdout")
+    ap.add_argument("--out", type=str, default=None, help="Output dir (default: <out-root>/<name>.r<YYYYmmddHHMM>)")
+    ap.add_argument("--out-root", type=str, default=None, help="Default: parent of --models")
+    ap.add_argument("--experiment", type=str, default=None, help="Log the refresh to this MLflow experiment")
+    ap.add_argument("--tracking-uri", type=str, default=None)
+    main(ap.parse_args())
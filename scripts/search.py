@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# Recherche d'hyperparamètres LightGBM (velib_ml.search) : successive halving par horizon
+# sur un Dataset binned construit une seule fois, essais en parallèle (pool de processus),
+# chaque essai journalisé comme run MLflow imbriqué. Rapporte le front de Pareto MAE (val,
+# en vélos) / coût d'inférence (arbres, feuilles, µs/ligne mesurées) et écrit
+# best_params.json pour train.py --params ; --mae-tolerance choisit le modèle le moins coûteux
+# à moins de x % du meilleur MAE.
+# Usage (depuis la racine du repo) :
+#   python scripts/search.py --data data/raw/velib_timeseries_5min.csv --weather data/external/weather --trials 27 --workers 3 --out search/v1
+#   python scripts/train.py --data data/raw/velib_timeseries_5min.csv --weather data/external/weather --params search/v1/best_params.json
+from __future__ import annotations
+import argparse, json, time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import mlflow
+
+from velib_ml.config import HORIZONS
+from velib_ml.features import feature_list
+from velib_ml.search import SEARCH_SPACE, pareto_front, rung_budgets, sample_configs, successive_halving
+from velib_ml.training import NUM_BOOST_ROUND
+from train import add_data_args, training_frames
+
+
+def select(df: pd.DataFrame, tolerance: float) -> pd.DataFrame:
+    """Per horizon: the fewest-leaves trial with val MAE within `tolerance` of the best."""
+    rows = []
+    for h, g in df.groupby("horizon"):
+        ok = g[g["val_mae"] <= g["val_mae"].min() * (1 + tolerance)]
+        rows.append(ok.sort_values(["leaves", "val_mae"]).iloc[0])
+    return pd.DataFrame(rows)
+
+
+def main(args: argparse.Namespace) -> None:
+    if args.tracking_uri:
+        mlflow.set_tracking_uri(args.tracking_uri)
+    mlflow.set_experiment(args.experiment)
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    horizons = args.horizons or HORIZONS
+    configs = sample_configs(SEARCH_SPACE, args.trials, seed=args.seed)
+    budgets = rung_budgets(args.min_rounds, args.max_rounds, args.eta)
+
+    with mlflow.start_run(run_name=args.run_name or f"search-{out.name}"):
+        # ===== Features (même cache que train.py) =====
+        weather_cols = ["temperature_2m","precipitation","wind_speed_10m","is_rain"]
+        train_d, test_d, _, info, cache_status, _ = training_frames(args, weather_cols)
+        feat_cols = feature_list(use_ema=args.use_ema, use_sta=args.use_sta)
+        if info["use_weather"]:
+            feat_cols = feat_cols + weather_cols
+        mlflow.log_params({"n_rows": info["n_rows"], "feature_cache": cache_status, "configs": len(configs),
+                           "eta": args.eta, "budgets": str(budgets), "horizons": str(horizons),
+                           "workers": args.workers, "threads": args.threads, "use_ema": args.use_ema,
+                           "use_sta": args.use_sta, "search_space": json.dumps(SEARCH_SPACE)})
+        print(f"{len(configs)} configs × {len(horizons)} horizons, rungs {budgets} rounds, "
+              f"{args.workers} worker(s), features: cache {cache_status}")
+
+        # ===== Essais (un run MLflow imbriqué chacun) =====
+        def log_trial(r):
+            with mlflow.start_run(run_name=f"h{r['horizon']}-t{r['trial']:03d}-r{r['rounds']}", nested=True):
+                mlflow.log_params({**r["config"], "horizon": r["horizon"], "trial": r["trial"],
+                                   "rung": r["rung"], "rounds": r["rounds"]})
+                mlflow.log_metrics({k: float(r[k]) for k in ("val_mae", "gamma", "best_iter", "trees", "leaves",
+                                                             "predict_us_row", "train_s")})
+                mlflow.set_tags({"pruned": r["pruned"], "reused": r["reused"]})
+            if not args.quiet:
+                print(f"h{r['horizon']:<3} rung {r['rung']} ({r['rounds']:>4} r) trial {r['trial']:>3}  "
+                      f"val MAE {r['val_mae']:.4f}  trees {r['trees']:>4}  leaves {r['leaves']:>6}  "
+                      f"{r['predict_us_row']:6.2f} µs/row  {r['train_s']:5.1f}s"
+                      f"{'  (reused)' if r['reused'] else ''}{'  pruned' if r['pruned'] else ''}")
+
+        t0 = time.time()
+        trials = successive_halving(train_d, test_d, feat_cols, horizons, configs, eta=args.eta,
+                                    min_rounds=args.min_rounds, max_rounds=args.max_rounds,
+                                    workers=args.workers, num_threads=args.threads, on_result=log_trial)
+        mlflow.log_metric("search_wall_s", time.time() - t0)
+
+        # ===== Rapport : essais, front de Pareto, sélection =====
+        df = pd.DataFrame([{k: v for k, v in r.items() if k not in ("config", "model")} | r["config"]
+                           for r in trials])
+        df.to_csv(out / "trials.csv", index=False)
+        fronts = []
+        for h, g in df.groupby("horizon"):
+            g = g.reset_index(drop=True)
+            fronts.append(g.iloc[pareto_front(g["val_mae"].to_numpy(), g["leaves"].to_numpy())])
+        pareto = pd.concat(fronts, ignore_index=True)
+        pareto.to_csv(out / "pareto.csv", index=False)
+        chosen = select(df, args.mae_tolerance)
+        best = {str(int(r["horizon"])): {**{k: (r[k].item() if isinstance(r[k], np.generic) else r[k])
+                                            for k in SEARCH_SPACE},
+                                         "num_iterations": int(r["rounds"])}
+                for _, r in chosen.iterrows()}
+        (out / "best_params.json").write_text(json.dumps(best, indent=2))
+
+        cols = ["horizon", "trial", "rounds", "val_mae", "trees", "leaves", "predict_us_row"]
+        print(f"\nPareto front (val MAE vs total leaves), {time.time() - t0:.0f}s:")
+        print(pareto[cols + list(SEARCH_SPACE)].to_string(index=False))
+        print(f"\nSelected (tolerance {args.mae_tolerance:.1%}):")
+        print(chosen[cols].to_string(index=False))
+        for _, r in chosen.iterrows():
+            h = int(r["horizon"])
+            default = df[(df["horizon"] == h) & (df["trial"] == 0)].sort_values("rung").iloc[-1]
+            mlflow.log_metrics({f"val_mae_{h}": r["val_mae"], f"leaves_{h}": r["leaves"],
+                                f"val_mae_default_{h}": default["val_mae"], f"leaves_default_{h}": default["leaves"]})
+        for f in ("trials.csv", "pareto.csv", "best_params.json"):
+            mlflow.log_artifact(str(out / f))
+        print(f"→ {out}/best_params.json")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    add_data_args(ap)
+    ap.add_argument("--out", type=str, default="search/v1", help="trials.csv, pareto.csv, best_params.json")
+    ap.add_argument("--horizons", type=int, nargs="+", default=None, help="Default: config HORIZONS")
+    ap.add_argument("--trials", type=int, default=27, help="Configs sampled (the first is the current default)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--eta", type=int, default=3, help="Keep 1/eta of the configs per rung, eta x more rounds")
+    ap.add_argument("--min-rounds", type=int, default=50, help="Smallest rung budget (boosting rounds)")
+    ap.add_argument("--max-rounds", type=int, default=NUM_BOOST_ROUND, help="Last rung budget")
+    ap.add_argument("--workers", type=int, default=1, help="Trials trained in parallel (process pool)")
+    ap.add_argument("--threads", type=int, default=2, help="LightGBM threads in total (split across workers)")
+    ap.add_argument("--mae-tolerance", type=float, default=0.0,
+                    help="Pick the fewest-leaves trial within this fraction of the best val MAE (e.g. 0.01)")
+    ap.add_argument("--experiment", type=str, default="velib-forecast-search")
+    ap.add_argument("--tracking-uri", type=str, default=None)
+    ap.add_argument("--run-name", type=str, default=None)
+    ap.add_argument("--quiet", action="store_true")
+    main(ap.parse_args())
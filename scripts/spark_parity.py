@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Parité pandas / Spark (velib_ml.spark) sur des données échantillon : mêmes colonnes, même
+# ordre, mêmes dtypes et mêmes valeurs pour les features, la météo, le split train/test, les
+# encodages station et les cibles Δ ; puis aller-retour write_features → load_feature_chunks
+# (ce que lit train.py --features-dir). Les moyennes glissantes et les encodages station sont
+# sommés dans un autre ordre : comparés à --atol près, tout le reste à l'identique.
+# Usage :
+#   python scripts/spark_parity.py --data data/raw/velib_timeseries_5min.csv --weather data/external/weather --use-ema --use-sta
+from __future__ import annotations
+import argparse, sys, tempfile
+import numpy as np
+import pandas as pd
+
+from velib_ml import spark as vs
+from velib_ml.chunked import load_feature_chunks
+from velib_ml.config import SPLIT_TRAINTEST
+from velib_ml.data import load_timeseries
+from velib_ml.features import attach_station_encodings, fit_station_encodings, make_delta_targets, make_features
+from velib_ml.splits import split_train_test
+from velib_ml.weather import add_weather, load_weather
+
+APPROX = ("occ_roll_", "sta_")
+
+
+def pandas_frames(args, weather):
+    feat = make_features(load_timeseries(args.data), use_ema=args.use_ema)
+    if weather is not None:
+        feat = add_weather(feat, weather)
+    train, test = split_train_test(feat, SPLIT_TRAINTEST)
+    if args.use_sta:
+        enc = fit_station_encodings(train)
+        train, test = attach_station_encodings(train, enc), attach_station_encodings(test, enc)
+    for d in (train, test):
+        d["occ_now"] = d["occ"].astype("float32")
+    train, test = make_delta_targets(train, test)
+    return feat, train, test
+
+
+def compare(name: str, ref: pd.DataFrame, got: pd.DataFrame, atol: float) -> list:
+    errors = []
+    if list(ref.columns) != list(got.columns):
+        return [f"{name}: columns differ\n  pandas {list(ref.columns)}\n  spark  {list(got.columns)}"]
+    if len(ref) != len(got):
+        return [f"{name}: {len(ref)} rows (pandas) vs {len(got)} (spark)"]
+    key = ["station_id", "ts"]
+    ref = ref.assign(_s=ref["station_id"].astype(str)).sort_values(["_s", "ts"], ignore_index=True).drop(columns="_s")
+    got = got.assign(_s=got["station_id"].astype(str)).sort_values(["_s", "ts"], ignore_index=True).drop(columns="_s")
+    worst = {}
+    for c in ref.columns:
+        a, b = ref[c], got[c]
+        if str(a.dtype) != str(b.dtype) and not (isinstance(a.dtype, pd.CategoricalDtype)
+                                                 and isinstance(b.dtype, pd.CategoricalDtype)):
+            errors.append(f"{name}.{c}: dtype {a.dtype} (pandas) vs {b.dtype} (spark)")
+            continue
+        if c in key or isinstance(a.dtype, pd.CategoricalDtype):
+            if not (a.astype(str).to_numpy() == b.astype(str).to_numpy()).all():
+                errors.append(f"{name}.{c}: values differ")
+            continue
+        x, y = a.to_numpy("float64"), b.to_numpy("float64")
+        if not (np.isnan(x) == np.isnan(y)).all():
+            errors.append(f"{name}.{c}: {int((np.isnan(x) != np.isnan(y)).sum())} rows null in one side only")
+            continue
+        err = float(np.nanmax(np.abs(x - y))) if len(x) and not np.isnan(x).all() else 0.0
+        worst[c] = err
+        tol = atol if c.startswith(APPROX) else 0.0
+        if err > tol:
+            errors.append(f"{name}.{c}: max |pandas - spark| = {err:.3g} (tolerance {tol:g})")
+    print(f"{name:<9} {len(ref):>9,} rows  {len(ref.columns):>3} columns  "
+          f"max |Δ| {max(worst.values(), default=0):.2e}  {'OK' if not errors else 'MISMATCH'}")
+    return errors
+
+
+def main(args: argparse.Namespace) -> None:
+    weather = load_weather(args.weather) if args.weather else None
+    feat, train, test = pandas_frames(args, weather)
+
+    ss = vs.session(args.master, args.driver_memory)
+    sfeat = vs.make_features(vs.read_timeseries(ss, args.data), use_ema=args.use_ema)
+    if weather is not None:
+        sfeat = vs.add_weather(sfeat, weather)
+    sfeat = sfeat.cache()
+    strain, stest, _ = vs.training_frames(sfeat, SPLIT_TRAINTEST, use_sta=args.use_sta)
+
+    errors = compare("features", feat, vs.to_pandas(sfeat), args.atol)
+    errors += compare("train", train, vs.to_pandas(strain), args.atol)
+    errors += compare("test", test, vs.to_pandas(stest), args.atol)
+    with tempfile.TemporaryDirectory() as tmp:
+        vs.write_features(sfeat, tmp)
+        errors += compare("parquet", feat, load_feature_chunks(tmp), args.atol)
+    ss.stop()
+    for e in errors:
+        print(e)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", default="data/raw/velib_timeseries_5min.csv", help="Raw CSV / Parquet sample")
+    ap.add_argument("--weather", default=None, help="CSV or store dir from fetch_weather.py")
+    ap.add_argument("--use-ema", action="store_true")
+    ap.add_argument("--use-sta", action="store_true")
+    ap.add_argument("--atol", type=float, default=1e-6, help="Tolerance for rolling means / station encodings")
+    ap.add_argument("--master", default="local[*]")
+    ap.add_argument("--driver-memory", default="4g")
+    main(ap.parse_args())
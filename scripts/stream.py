@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# Pipeline continu snapshots GBFS → prévisions pour toutes les stations
+# (velib_ml.streaming : poll → normalize → update → predict → publish, files bornées).
+# Source : le flux GBFS en direct, ou un dossier de snapshots enregistrés (sortie de
+# collect_velib_gbfs.py, ou racine SnapshotStore) rejoué. Sorties : JSON (même corps que
+# GET /forecast) et/ou SQLite. Latences par étape (p50/p95/p99) affichées à la fin.
+# Usage :
+#   python scripts/stream.py --models artifacts --source gbfs --interval 30 --out-json data/forecast/latest.json
+#   python scripts/stream.py --models artifacts/v0_3 --source data/raw/velib --replay-interval 1 --max-snapshots 60 --report stream.json
+from __future__ import annotations
+import argparse, asyncio, json, time
+from pathlib import Path
+
+from velib_ml.live_weather import WeatherRefresher
+from velib_ml.registry import ModelRegistry, booster_loader
+from velib_ml.streaming import (FileSink, GBFSSource, MemorySink, ReplaySource, SQLiteSink,
+                                StreamingPipeline)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--models", type=str, default="artifacts", help="Artifact dir, or a root of versions (newest served)")
+    ap.add_argument("--backend", choices=["lightgbm", "compiled", "bundle"], default="lightgbm")
+    ap.add_argument("--source", type=str, default="gbfs", help="'gbfs' (live) or a snapshot dir / SnapshotStore to replay")
+    ap.add_argument("--base-url", type=str, default=None, help="GBFS root (e.g. a local stub)")
+    ap.add_argument("--interval", type=float, default=30, help="Live polling interval (s)")
+    ap.add_argument("--replay-interval", type=float, default=None, help="Replay: seconds between snapshots")
+    ap.add_argument("--speed", type=float, default=0, help="Replay: recorded gaps / speed (0 = no pacing)")
+    ap.add_argument("--max-snapshots", type=int, default=0, help="Stop after N snapshots (0 = until the source ends)")
+    ap.add_argument("--queue-size", type=int, default=4)
+    ap.add_argument("--out-json", type=str, default=None, help="Forecast table JSON, replaced on each snapshot")
+    ap.add_argument("--sqlite", type=str, default=None, help="SQLite file (table 'forecast')")
+    ap.add_argument("--sqlite-history", action="store_true", help="Keep every forecast, not only the latest")
+    ap.add_argument("--live-weather", action="store_true", help="Open-Meteo current weather (default: neutral values)")
+    ap.add_argument("--registry-poll", type=float, default=30, help="Rescan --models every N s for new versions (0 = off)")
+    ap.add_argument("--report", type=str, default=None, help="Write the final status/latencies here (JSON)")
+    ap.add_argument("--quiet", action="store_true")
+    args = ap.parse_args()
+
+    # ===== Modèles (même registre que l'API : une nouvelle version est prise au vol) =====
+    registry = ModelRegistry(args.models, booster_loader(args.backend), keep=1,
+                             poll_s=args.registry_poll, prefer_bundle=args.backend == "bundle")
+    if registry.refresh() is None:
+        raise SystemExit(f"No models found under {args.models}")
+    registry.start()
+
+    # ===== Source =====
+    if args.source == "gbfs":
+        from velib_ml.gbfs import GBFSClient
+        source = GBFSSource(GBFSClient(args.base_url) if args.base_url else None, interval_s=args.interval)
+    else:
+        source = ReplaySource(args.source, interval_s=args.replay_interval, speed=args.speed)
+
+    # ===== Météo =====
+    weather = None
+    if args.live_weather:
+        w = WeatherRefresher().start()
+        weather = w.snapshot
+
+    # ===== Sorties =====
+    t_start = time.perf_counter()
+    def progress(table):
+        if not args.quiet:
+            e2e = pipe.latency["end_to_end"]
+            print(f"[{time.perf_counter() - t_start:7.1f}s] #{pipe.counts['snapshots']:<5} "
+                  f"{len(table):>5} stations  model={table.source}  "
+                  f"e2e p50={e2e.summary()['p50_ms']} ms  coalesced={pipe.counts['coalesced']}")
+    sinks = [MemorySink(progress)]
+    if args.out_json:
+        sinks.append(FileSink(args.out_json))
+    if args.sqlite:
+        sinks.append(SQLiteSink(args.sqlite, history=args.sqlite_history))
+
+    pipe = StreamingPipeline(source, registry, sinks, weather=weather, queue_size=args.queue_size)
+    try:
+        status = asyncio.run(pipe.run(max_snapshots=args.max_snapshots or None))
+    except KeyboardInterrupt:
+        status = pipe.status()
+    finally:
+        registry.stop()
+
+    # ===== Rapport =====
+    print(f"\n{status['snapshots']} snapshots, {status['published']} published, {status['coalesced']} coalesced, "
+          f"{status['errors']} errors, {status['stations']} stations")
+    if status["last_error"]:
+        print(f"last error: {status['last_error']}")
+    print(f"{'stage':>11} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name in ("poll", "normalize", "update", "predict", "publish", "end_to_end"):
+        s = status["latency"].get(name)
+        if s:
+            print(f"{name:>11} {s['count']:>6} {s['p50_ms']:>8} {s['p95_ms']:>8} {s['p99_ms']:>8} {s['max_ms']:>8}")
+    if args.report:
+        Path(args.report).write_text(json.dumps({"args": vars(args), **status}, indent=2))
+        print(f"→ {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 # scripts/train.py
 from __future__ import annotations
-import argparse, json
+import argparse, json, tempfile, time
 from pathlib import Path
 import pandas as pd
 import mlflow, mlflow.lightgbm
@@ -8,11 +8,17 @@ import mlflow, mlflow.lightgbm
 # ==== project imports ====
 from velib_ml.config import FREQ_MIN, HORIZONS, SPLIT_TRAINTEST, SPLIT_TRAINVAL
 from velib_ml.data import load_timeseries
-from velib_ml.features import make_features, station_encodings, feature_list, make_delta_targets
+from velib_ml.features import (make_features, fit_station_encodings, attach_station_encodings,
+                               feature_list, make_delta_targets)
 from velib_ml.splits import split_train_test
-from velib_ml.training import train_delta_gamma
-from velib_ml.io_utils import save_artifacts
-from velib_ml.weather import resample_weather_to_5min, add_weather
+from velib_ml.training import train_horizons_shared, train_multi_horizon
+from velib_ml.inference import HORIZON_FEATURE, MULTI_FILE
+from velib_ml.io_utils import save_artifacts, peak_rss_mb, publish_dir, staging_dir
+from velib_ml.encodings import ENCODINGS_NAME, StationEncodings
+from velib_ml.feature_cache import FeatureCache
+from velib_ml.chunked import feature_columns, load_feature_chunks
+from velib_ml.panel import StationPanel
+from velib_ml.weather import load_weather, add_weather
 
 
 def naive_mae_bikes(feat: pd.DataFrame, split_q: float) -> dict[int, float]:
@@ -32,6 +38,166 @@ def naive_mae_bikes(feat: pd.DataFrame, split_q: float) -> dict[int, float]:
     return out
 
 
+def build_frames(args: argparse.Namespace, weather_cols: list):
+    """(train_d, test_d, station encodings or None, info) — the whole feature pipeline."""
+    if args.features_dir:
+        # chunks from scripts/build_features.py: read only the columns this run needs
+        use_weather = set(weather_cols) <= set(feature_columns(args.features_dir))
+        need = (["ts","station_id","occ","capacity","hour","dow"]
+                + [c for c in feature_list(use_ema=args.use_ema, use_sta=False) if c != "occ_now"]
+                + [f"occ_{h}" for h in HORIZONS] + (weather_cols if use_weather else []))
+        feat = load_feature_chunks(args.features_dir, columns=need)
+        n_rows, n_sta = len(feat), feat["station_id"].nunique()
+    else:
+        use_weather = bool(args.weather)
+        if args.panel:
+            # panel mappé (build_timeseries.py --panel-out) : features sur la grille 5 min
+            panel = StationPanel.load(args.panel)
+            feat = panel.feature_frame(use_ema=args.use_ema)
+            n_rows, n_sta = len(feat), panel.n_stations
+        else:
+            df = load_timeseries(args.data)
+            n_rows, n_sta = len(df), df["station_id"].nunique()
+            if args.grid:
+                feat = StationPanel.from_timeseries(df).feature_frame(use_ema=args.use_ema)
+            else:
+                feat = make_features(df, use_ema=args.use_ema)
+            del df
+        if args.weather:
+            feat = add_weather(feat, load_weather(args.weather))
+
+    # Split train/test (temps)
+    train, test = split_train_test(feat, SPLIT_TRAINTEST)
+
+    # Encodages station (optionnels) – tables station × 7 × 24 calculées sur TRAIN,
+    # appliquées au TRAIN et au TEST par indexation (exportées pour l'API)
+    sta_enc = None
+    if args.use_sta:
+        sta_enc = fit_station_encodings(train, dtype=args.sta_dtype)
+        train = attach_station_encodings(train, sta_enc)
+        test  = attach_station_encodings(test, sta_enc)
+
+    # Ancre niveau courant
+    for d in (train, test):
+        d["occ_now"] = d["occ"].astype("float32")
+
+    # Cibles Δ
+    train_d, test_d = make_delta_targets(train, test)
+    info = {"n_rows": int(n_rows), "n_stations": int(n_sta), "use_weather": use_weather,
+            "mae_naive": naive_mae_bikes(feat, SPLIT_TRAINTEST),
+            "data_end_ts": pd.Timestamp(feat["ts"].max()).isoformat()}
+    return train_d, test_d, sta_enc, info
+
+
+def _cached_columns(args: argparse.Namespace, weather_cols: list) -> list:
+    """Columns a training run reads back from the cache (the rest stays on disk)."""
+    return (["ts","station_id","occ","occ_now","capacity"] + feature_list(use_ema=args.use_ema, use_sta=args.use_sta)
+            + weather_cols + [f"occ_{h}" for h in HORIZONS] + [f"occ_delta_target_{h}" for h in HORIZONS])
+
+
+def training_frames(args: argparse.Namespace, weather_cols: list):
+    """build_frames through the feature cache: (train_d, test_d, sta_enc, info, "hit"|"miss"|"off", key)."""
+    if not args.feature_cache:
+        return (*build_frames(args, weather_cols), "off", None)
+    cache = FeatureCache(args.feature_cache, max_bytes=args.feature_cache_gb * 2**30)
+    key = cache.key([args.features_dir or args.panel or args.data, None if args.features_dir else args.weather],
+                    {"features_dir": bool(args.features_dir), "panel": bool(args.panel), "grid": args.grid,
+                     "use_ema": args.use_ema, "use_sta": args.use_sta, "sta_dtype": args.sta_dtype,
+                     "freq_min": FREQ_MIN, "horizons": HORIZONS, "split_train_test": SPLIT_TRAINTEST},
+                    code=[__file__])
+    hit = cache.get(key, columns=_cached_columns(args, weather_cols))
+    if hit is not None:
+        frames, info = hit
+        sta_enc = StationEncodings.load(cache.path(key)) if args.use_sta else None
+        return frames["train"], frames["test"], sta_enc, info, "hit", key
+    train_d, test_d, sta_enc, info = build_frames(args, weather_cols)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache.put(key, {"train": train_d, "test": test_d}, info,
+                  files=[sta_enc.save(tmp)] if sta_enc is not None else [])
+    return train_d, test_d, sta_enc, info, "miss", key
+
+
+def add_data_args(ap: argparse.ArgumentParser) -> None:
+    """Input / feature options (shared with search.py)."""
+    ap.add_argument("--data", type=str, default="data/raw/velib_timeseries_5min.csv")
+    ap.add_argument("--features-dir", type=str, default=None,
+                    help="Feature chunks from build_features.py (used instead of --data/--weather)")
+    ap.add_argument("--panel", type=str, default=None,
+                    help="StationPanel dir (build_timeseries.py --panel-out), memory-mapped; replaces --data")
+    ap.add_argument("--grid", action="store_true",
+                    help="Build features on the 5-min grid (StationPanel): lags/windows skip gaps by time")
+    ap.add_argument("--weather", type=str, default=None, help="CSV or store dir from fetch_weather.py")
+
+    ap.add_argument("--use-ema", dest="use_ema", action="store_true")
+    ap.add_argument("--no-ema",  dest="use_ema", action="store_false")
+    ap.set_defaults(use_ema=False)
+
+    ap.add_argument("--use-sta", dest="use_sta", action="store_true")
+    ap.add_argument("--no-sta",  dest="use_sta", action="store_false")
+    ap.set_defaults(use_sta=False)
+    ap.add_argument("--sta-dtype", choices=["float32", "float16"], default="float32",
+                    help="dtype of the exported station encodings (float16 halves the artifact)")
+
+    # Feature cache
+    ap.add_argument("--feature-cache", type=str, default="data/cache/features",
+                    help="Content-addressed cache of the feature frames ('' = off)")
+    ap.add_argument("--feature-cache-gb", type=float, default=20, help="Cache size limit (LRU eviction)")
+
+
+def train_multi(args, train_d, test_d, feat_cols, mae_naive, info, sta_enc) -> None:
+    """--multi-horizon : un seul modèle Δ pour toute la grille d'horizons (horizon_min en feature)."""
+    horizons = sorted(args.horizons or HORIZONS)
+    lgb_params = json.loads(Path(args.params).read_text()) if args.params else None
+    mlflow.log_params({"multi_horizon": True, "multi_horizons": str(horizons), "lgb_params": args.params})
+    t_train = time.time()
+    res = train_multi_horizon(train_d, test_d, feat_cols, horizons, num_threads=args.threads, params=lgb_params)
+    mlflow.log_metrics({"train_wall_s": time.time() - t_train, "best_iter": res["best_iter"],
+                        "train_s": res["train_s"], "n_train_examples": res["n_train"]})
+    for h, r in res["per_h"].items():
+        mlflow.log_metrics({f"mae_{h}": r["mae"], f"gamma_{h}": r["gamma"]})
+    mi = mlflow.lightgbm.log_model(res["model"], artifact_path="model_multi")
+    if args.register:
+        mlflow.register_model(model_uri=mi.model_uri, name=f"{args.register}_multi")
+
+    outdir = Path(args.out)
+    metrics_df = pd.DataFrame({
+        "horizon_min": horizons,
+        "mae_naive":   [mae_naive.get(h) for h in horizons],
+        "mae_model":   [res["per_h"][h]["mae"] for h in horizons],
+        "best_iter":   res["best_iter"],
+        "train_s":     res["train_s"],
+        "gamma":       [res["per_h"][h]["gamma"] for h in horizons],
+    })
+    cfg = {
+        "freq_min": FREQ_MIN,
+        "horizons": horizons,
+        "multi_horizon": True,
+        "horizon_feature": HORIZON_FEATURE,
+        "split_train_test": SPLIT_TRAINTEST,
+        "split_train_val": SPLIT_TRAINVAL,
+        "gammas": {str(h): res["per_h"][h]["gamma"] for h in horizons},
+        "data_end_ts": info["data_end_ts"],
+        "created_at": pd.Timestamp.now(tz="UTC").isoformat(),
+    }
+    # feat_cols_delta.json garde les features de base : l'horizon est ajouté au scoring
+    tmp = staging_dir(outdir)
+    save_artifacts({}, feat_cols, cfg, metrics_df, str(tmp))
+    res["model"].save_model(str(tmp / MULTI_FILE))
+    if sta_enc is not None:
+        sta_enc.save(tmp)
+    test_d[feat_cols].dropna().head(1).to_csv(tmp / "sample_features.csv", index=False)
+    publish_dir(tmp, outdir)
+    for f in ("metrics.csv", "feat_cols_delta.json", "config.json", ENCODINGS_NAME):
+        if (outdir / f).exists():
+            mlflow.log_artifact(str(outdir / f))
+
+    rss = peak_rss_mb()
+    mlflow.log_metric("peak_rss_mb", rss)
+    print(metrics_df.to_string(index=False))
+    print(f"{res['n_train']:,} (row, horizon) examples, {res['best_iter']} trees, "
+          f"{res['train_s']:.0f}s, peak RSS {rss:,.0f} MB → {outdir / MULTI_FILE}")
+
+
 def main(args: argparse.Namespace) -> None:
     # ===== MLflow config =====
     if args.tracking_uri:
@@ -41,39 +207,23 @@ def main(args: argparse.Namespace) -> None:
     run_name = args.run_name or f"{Path(args.out).name}--ema{args.use_ema}--sta{args.use_sta}"
 
     with mlflow.start_run(run_name=run_name):
-        # ===== Load & features =====
-        df = load_timeseries(args.data)
-        n_rows, n_sta = len(df), df["station_id"].nunique()
-        mlflow.log_params({"n_rows": n_rows, "n_stations": n_sta})
-
-        feat = make_features(df, use_ema=args.use_ema)
-        if args.weather:
-            w_hourly = pd.read_csv(args.weather, parse_dates=["ts"])
-            w_5min   = resample_weather_to_5min(w_hourly)
-            feat     = add_weather(feat, w_5min)
-
-        # Split train/test (temps)
-        train, test = split_train_test(feat, SPLIT_TRAINTEST)
-
-        # Encodages station (optionnels) – calculés sur TRAIN puis appliqués au TEST
-        if args.use_sta:
-            train = station_encodings(train, train)
-            test  = station_encodings(train, test)
-
-        # Ancre niveau courant
-        for d in (train, test):
-            d["occ_now"] = d["occ"].astype("float32")
-
-        # Cibles Δ
-        train_d, test_d = make_delta_targets(train, test)
+        # ===== Load & features (from the feature cache when inputs/config/code are unchanged) =====
+        weather_cols = ["temperature_2m","precipitation","wind_speed_10m","is_rain"]
+        t_feat = time.time()
+        train_d, test_d, sta_enc, info, cache_status, key = training_frames(args, weather_cols)
+        mlflow.log_params({"n_rows": info["n_rows"], "n_stations": info["n_stations"],
+                           "features_dir": args.features_dir, "grid_features": bool(args.grid or args.panel),
+                           "feature_cache": cache_status, "feature_cache_key": key})
+        mlflow.log_metric("features_s", time.time() - t_feat)
+        print(f"features: cache {cache_status} ({time.time() - t_feat:.1f}s)")
 
         # Liste des features (même ordre que l’entraînement)
         feat_cols = feature_list(use_ema=args.use_ema, use_sta=args.use_sta)
-        if args.weather:
-            feat_cols = feat_cols + ["temperature_2m","precipitation","wind_speed_10m","is_rain"]
+        if info["use_weather"]:
+            feat_cols = feat_cols + weather_cols
 
         # ===== Baseline Naïve (sur TEST) =====
-        mae_naive = naive_mae_bikes(feat, SPLIT_TRAINTEST)
+        mae_naive = {int(h): v for h, v in info["mae_naive"].items()}
         for h, v in mae_naive.items():
             mlflow.log_metric(f"mae_naive_{h}", v)
 
@@ -84,23 +234,38 @@ def main(args: argparse.Namespace) -> None:
             "split_train_test": SPLIT_TRAINTEST,
             "split_train_val": SPLIT_TRAINVAL,
             "threads": args.threads,
+            "workers": args.workers,
             "use_ema": args.use_ema,
             "use_sta": args.use_sta,
         })
 
-        # ===== Train per horizon (Δ + gamma calibration) =====
-        results, models = {}, {}
+        if args.multi_horizon:
+            train_multi(args, train_d, test_d, feat_cols, mae_naive, info, sta_enc)
+            return
+
+        # ===== Train all horizons (Δ + gamma calibration) on one binned Dataset =====
+        t_train = time.time()
+        lgb_params = None
+        if args.params:
+            # {"15": {"num_leaves": 31, ...}, ...} (search.py) → overrides of LGB_PARAMS per horizon
+            lgb_params = {int(h): p for h, p in json.loads(Path(args.params).read_text()).items()}
+            mlflow.log_params({"lgb_params": args.params})
+        results = train_horizons_shared(
+            train_d, test_d, feat_cols, HORIZONS, num_threads=args.threads,
+            workers=args.workers, threads_per_worker=args.threads_per_worker, params=lgb_params,
+        )
+        mlflow.log_metric("train_wall_s", time.time() - t_train)
+        models = {}
         for h in HORIZONS:
-            out = train_delta_gamma(
-                train_d, test_d, feat_cols, h, num_threads=args.threads
-            )
-            results[h] = out
+            out = results[h]
             models[h] = out["model"]
 
             # MLflow metrics
             mlflow.log_metric(f"mae_{h}", out["mae"])
             mlflow.log_metric(f"best_iter_{h}", out["best_iter"])
             mlflow.log_metric(f"gamma_{h}", out["gamma"])
+            mlflow.log_metric(f"train_s_{h}", out["train_s"])
+            mlflow.log_metric(f"peak_rss_mb_{h}", out["peak_rss_mb"])
 
             # Log model inside MLflow run
             mi = mlflow.lightgbm.log_model(out["model"], artifact_path=f"model_h{h}")
@@ -111,8 +276,9 @@ def main(args: argparse.Namespace) -> None:
                 mlflow.register_model(model_uri=mi.model_uri, name=model_name)
 
         # ===== Save local artifacts (filesystem) =====
+        # écrits dans un dossier caché puis renommés : le registry ne voit jamais une version à moitié écrite
         outdir = Path(args.out)
-        outdir.mkdir(parents=True, exist_ok=True)
+        tmp = staging_dir(outdir)
 
         # Metrics dataframe (filesystem)
         metrics_df = pd.DataFrame({
@@ -120,6 +286,7 @@ def main(args: argparse.Namespace) -> None:
             "mae_naive":   [mae_naive[h] for h in HORIZONS],
             "mae_model":   [results[h]["mae"] for h in HORIZONS],
             "best_iter":   [results[h]["best_iter"] for h in HORIZONS],
+            "train_s":     [results[h]["train_s"] for h in HORIZONS],
             "gamma":       [results[h]["gamma"] for h in HORIZONS],
         })
         # Config for reproducibility
@@ -129,48 +296,49 @@ def main(args: argparse.Namespace) -> None:
             "split_train_test": SPLIT_TRAINTEST,
             "split_train_val": SPLIT_TRAINVAL,
             "gammas": {str(h): results[h]["gamma"] for h in HORIZONS},
+            # point de départ d'un refresh incrémental (scripts/refresh.py)
+            "data_end_ts": info["data_end_ts"],
+            "created_at": pd.Timestamp.now(tz="UTC").isoformat(),
         }
 
         # Persist models + feature list + config + metrics (filesystem)
-        with open(outdir / "feat_cols_delta.json", "w") as f:
-            json.dump(feat_cols, f)
-        metrics_df.to_csv(outdir / "metrics.csv", index=False)
-        with open(outdir / "config.json", "w") as f:
-            json.dump(cfg, f, indent=2)
-
-        # Save boosters to filesystem via helper (also prints path)
-        save_artifacts({h: models[h] for h in HORIZONS}, feat_cols, cfg, metrics_df, str(outdir))
-
-        # ===== Log artifacts into MLflow run =====
-        mlflow.log_artifact(str(outdir / "metrics.csv"))
-        mlflow.log_artifact(str(outdir / "feat_cols_delta.json"))
-        mlflow.log_artifact(str(outdir / "config.json"))
+        save_artifacts({h: models[h] for h in HORIZONS}, feat_cols, cfg, metrics_df, str(tmp))
+        if sta_enc is not None:
+            sta_enc.save(tmp)
 
-        # Also log one sample features row to help API testing later
+        # Also save one sample features row to help API testing later
         try:
-            sample = test_d[feat_cols].dropna().head(1)
-            sample.to_csv(outdir / "sample_features.csv", index=False)
-            mlflow.log_artifact(str(outdir / "sample_features.csv"))
+            test_d[feat_cols].dropna().head(1).to_csv(tmp / "sample_features.csv", index=False)
         except Exception as e:
             print("Could not save sample_features.csv:", e)
+        publish_dir(tmp, outdir)
+
+        # ===== Log artifacts into MLflow run =====
+        for f in ("metrics.csv", "feat_cols_delta.json", "config.json", ENCODINGS_NAME, "sample_features.csv"):
+            if (outdir / f).exists():
+                mlflow.log_artifact(str(outdir / f))
 
         # Pretty print
+        rss = peak_rss_mb()
+        mlflow.log_metric("peak_rss_mb", rss)
         print(metrics_df.to_string(index=False))
+        print(f"Peak RSS: {rss:,.0f} MB")
 
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
-    ap.add_argument("--data", type=str, default="data/raw/velib_timeseries_5min.csv")
+    add_data_args(ap)
     ap.add_argument("--out", type=str,  default="artifacts/v0_1")
     ap.add_argument("--threads", type=int, default=2)
-
-    ap.add_argument("--use-ema", dest="use_ema", action="store_true")
-    ap.add_argument("--no-ema",  dest="use_ema", action="store_false")
-    ap.set_defaults(use_ema=False)
-
-    ap.add_argument("--use-sta", dest="use_sta", action="store_true")
-    ap.add_argument("--no-sta",  dest="use_sta", action="store_false")
-    ap.set_defaults(use_sta=False)
+    ap.add_argument("--workers", type=int, default=1, help="Horizons trained in parallel (process pool)")
+    ap.add_argument("--threads-per-worker", type=int, default=None, help="Default: threads // workers")
+    ap.add_argument("--params", type=str, default=None,
+                    help="LightGBM overrides per horizon (best_params.json from search.py); "
+                         "with --multi-horizon one flat dict of overrides")
+    ap.add_argument("--multi-horizon", action="store_true",
+                    help="One model for all horizons (horizon as a feature) instead of one per horizon")
+    ap.add_argument("--horizons", type=int, nargs="+", default=None,
+                    help="Horizon grid of --multi-horizon in minutes, e.g. $(seq 5 5 90) (default: config HORIZONS)")
 
     # MLflow options
     ap.add_argument("--experiment", type=str, default="velib-forecast")
@@ -178,7 +346,4 @@ if __name__ == "__main__":
     ap.add_argument("--run-name", type=str, default=None)
     ap.add_argument("--register", type=str, default=None, help="Register models under this base name (one per horizon)")
 
-    # Weather options
-    ap.add_argument("--weather", type=str, default=None, help="CSV from fetch_weather.py")
-
     main(ap.parse_args())
@@ -1,5 +1,26 @@
-# src/velib_ml/__init__.py
 __version__ = "0.1.0"
 from .config import FREQ_MIN, HORIZONS, SPLIT_TRAINTEST, SPLIT_TRAINVAL
-from .data import load_timeseries
-from .features import make_features, station_encodings, feature_list, make_delta_targets
+
+# pandas-backed helpers are imported on first access, so `import velib_ml` (and the
+# serving path: online, trees, bundle, registry) stays free of pandas
+_LAZY = {
+    "load_timeseries": "data",
+    "make_features": "features",
+    "station_encodings": "features",
+    "feature_list": "features",
+    "make_delta_targets": "features",
+}
+__all__ = ["FREQ_MIN", "HORIZONS", "SPLIT_TRAINTEST", "SPLIT_TRAINVAL", *_LAZY]
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        value = getattr(importlib.import_module(f".{_LAZY[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
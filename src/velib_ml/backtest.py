@@ -0,0 +1,230 @@
+# src/velib_ml/backtest.py
+# Walk-forward backtest: features computed once and stored as memory-mapped columns,
+# folds (expanding or rolling train window) run in a process pool, every 5-min origin
+# of each test window scored with bincount breakdowns (horizon × hour / weekday /
+# station cluster) for the model, the naive baseline and an EWMA baseline.
+from __future__ import annotations
+import json, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+from .config import FREQ_MIN, HORIZONS, SPLIT_TRAINVAL
+from .features import _seg_ema_past, _segments, _station_order
+
+EWMA_ALPHA = 0.3
+METHODS = ("model", "naive", "ewma")
+BREAKDOWNS = {"hour": 24, "dow": 7}
+
+
+# ---- folds ----
+def make_folds(ts_min, ts_max, n_folds: int = 4, test_days: float = 7, step_days: Optional[float] = None,
+               train_days: Optional[float] = None, min_train_days: float = 7) -> List[dict]:
+    """Walk-forward folds ending at ts_max, newest last.
+
+    Test windows are `test_days` long, `step_days` apart (default: contiguous).
+    Train is everything before the test window (expanding) or the last
+    `train_days` before it (rolling). Folds with less than `min_train_days` of
+    train history are dropped. Times are epoch seconds.
+    """
+    day = 86400
+    t_min, t_max = (int(pd.Timestamp(t).value // 10**9) for t in (ts_min, ts_max))
+    step = int((step_days or test_days) * day)
+    folds = []
+    for k in range(n_folds):
+        test_end = t_max + FREQ_MIN * 60 - k * step       # end of the last 5-min slot
+        test_start = test_end - int(test_days * day)
+        train_start = t_min if train_days is None else max(t_min, test_start - int(train_days * day))
+        if test_start - train_start < min_train_days * day:
+            break
+        folds.append({"train_start": train_start, "test_start": test_start, "test_end": test_end})
+    folds = folds[::-1]
+    for i, f in enumerate(folds):
+        f["fold"] = i
+    return folds
+
+
+# ---- station clusters ----
+def station_clusters(feat: pd.DataFrame, n_clusters: int = 6, before=None, seed: int = 42) -> np.ndarray:
+    """KMeans on each station's mean occupancy by hour of day (rows before `before` only).
+
+    Returns one cluster id per station_id category code (-1 if never seen).
+    """
+    from sklearn.cluster import KMeans
+    codes = feat["station_id"].cat.codes.to_numpy()
+    n_sta = len(feat["station_id"].cat.categories)
+    ok = np.isfinite(feat["occ"].to_numpy())
+    if before is not None:
+        ok &= (feat["ts"] < pd.Timestamp(before, unit="s", tz="UTC")).to_numpy()
+    cell = codes[ok].astype("int64") * 24 + feat["hour"].to_numpy()[ok]
+    s = np.bincount(cell, feat["occ"].to_numpy()[ok], minlength=n_sta * 24).reshape(n_sta, 24)
+    n = np.bincount(cell, minlength=n_sta * 24).reshape(n_sta, 24)
+    prof = np.divide(s, n, out=np.full(s.shape, np.nan), where=n > 0)
+    seen = ~np.isnan(prof).all(axis=1)
+    prof = np.where(np.isnan(prof), np.nanmean(prof[seen], axis=0), prof)
+    out = np.full(n_sta, -1, dtype="int32")
+    k = min(n_clusters, int(seen.sum()))
+    if k:
+        out[seen] = KMeans(n_clusters=k, n_init=10, random_state=seed).fit_predict(prof[seen])
+    return out
+
+
+# ---- shared columns ----
+def prepare(feat: pd.DataFrame, feat_cols: Sequence[str], outdir, horizons: Sequence[int] = HORIZONS,
+            clusters: Optional[np.ndarray] = None, ewma_alpha: float = EWMA_ALPHA) -> Path:
+    """Write what the folds need as .npy columns (memory-mapped by the workers)."""
+    order, key, _ = _station_order(feat)
+    if order is not None:
+        feat, key = feat.take(order).reset_index(drop=True), key[order]
+    d = Path(outdir)
+    d.mkdir(parents=True, exist_ok=True)
+    occ = feat["occ"].to_numpy(dtype="float32")
+    starts, lens, _, _ = _segments(key)
+    past = _seg_ema_past(occ, ewma_alpha, starts, lens)
+    ewma = np.where(np.isnan(past), occ, ewma_alpha * occ + (1 - ewma_alpha) * past).astype("float32")
+    cols = {
+        "ts": np.asarray(feat["ts"].values).astype("datetime64[s]").astype("int64"),
+        "station": key.astype("int32"),
+        "occ": occ,
+        "capacity": feat["capacity"].to_numpy(dtype="float32"),
+        "hour": feat["hour"].to_numpy().astype("int64"),
+        "dow": feat["dow"].to_numpy().astype("int64"),
+        "ewma": ewma,
+        "X": feat[list(feat_cols)].to_numpy(dtype="float32"),
+        "Y": np.stack([feat[f"occ_{h}"].to_numpy(dtype="float32") for h in horizons], axis=1),
+    }
+    if clusters is not None:
+        cols["cluster"] = np.asarray(clusters, dtype="int64")[key]
+    for name, a in cols.items():
+        np.save(d / f"{name}.npy", a)
+    (d / "meta.json").write_text(json.dumps({"feat_cols": list(feat_cols), "horizons": list(horizons),
+                                             "ewma_alpha": ewma_alpha,
+                                             "n_clusters": int(clusters.max()) + 1 if clusters is not None else 0}))
+    return d
+
+
+def _load(d: Path):
+    meta = json.loads((d / "meta.json").read_text())
+    cols = {p.stem: np.load(p, mmap_mode="r") for p in d.glob("*.npy")}
+    return meta, cols
+
+
+# ---- one fold ----
+def _score(err: np.ndarray, keys: Dict[str, np.ndarray], sizes: Dict[str, int]) -> dict:
+    out = {"all": (float(err.sum()), int(len(err)))}
+    for name, k in keys.items():
+        out[name] = (np.bincount(k, err, minlength=sizes[name]), np.bincount(k, minlength=sizes[name]))
+    return out
+
+
+def _fit_fold(X, Y, occ, cap, ts, rows, horizons, params, gamma_grid, purge_s, num_boost_round=None):
+    """One shared binned Dataset for the fold; per horizon: SPLIT_TRAINVAL cut, fit, gamma."""
+    import lightgbm as lgb
+    from .training import _calibrate_gamma, _fit_on_shared
+    Xtr = np.ascontiguousarray(X[rows])
+    complete = np.isfinite(Xtr).all(axis=1)       # same rows train_horizons_shared keeps
+    base = lgb.Dataset(Xtr, label=np.zeros(len(rows), dtype="float32"), free_raw_data=False,
+                       params={"verbosity": -1, "num_threads": params.get("num_threads", 1)}).construct()
+    fitted = {}
+    for j, h in enumerate(horizons):
+        y_occ = Y[rows, j]
+        ok = complete & np.isfinite(y_occ) & (ts[rows] + h * 60 < purge_s)   # target inside train
+        cut = np.quantile(ts[rows][ok], SPLIT_TRAINVAL)
+        fit, val = np.flatnonzero(ok & (ts[rows] <= cut)), np.flatnonzero(ok & (ts[rows] > cut))
+        dy = (y_occ - occ[rows]).astype("float32")
+        model, secs = _fit_on_shared(base, fit, dy[fit], val, dy[val], params, num_boost_round)
+        it = model.best_iteration or None
+        cv = cap[rows][val]
+        g, _ = _calibrate_gamma(model.predict(Xtr[val], num_iteration=it), occ[rows][val], cv,
+                                y_occ[val] * cv, gamma_grid)
+        fitted[h] = (model, it, float(g), secs)
+    return fitted
+
+
+def run_fold(data_dir, fold: dict, models_dir: Optional[str] = None, params: Optional[dict] = None,
+             num_boost_round: Optional[int] = None, gamma_grid=(0.5, 0.7, 0.9, 1.0)) -> dict:
+    """Train (or load) the per-horizon models for one fold and score its test window."""
+    from .training import LGB_PARAMS
+    t0 = time.time()
+    meta, c = _load(Path(data_dir))
+    horizons = meta["horizons"]
+    ts = c["ts"]
+    test = np.flatnonzero((ts >= fold["test_start"]) & (ts < fold["test_end"]))
+    if models_dir:
+        import lightgbm as lgb
+        d = Path(models_dir)
+        gammas = json.loads((d / "config.json").read_text()).get("gammas", {})
+        fitted = {h: (lgb.Booster(model_file=str(d / f"lgbm_delta_h{h}.txt")), None,
+                      float(gammas.get(str(h), 1.0)), 0.0) for h in horizons}
+    else:
+        rows = np.flatnonzero((ts >= fold["train_start"]) & (ts < fold["test_start"]))
+        p = dict(LGB_PARAMS, **(params or {}))
+        fitted = _fit_fold(c["X"], c["Y"], c["occ"], c["capacity"], ts, rows, horizons, p,
+                           gamma_grid, fold["test_start"], num_boost_round)
+    t_fit = time.time() - t0
+
+    sizes = dict(BREAKDOWNS)
+    keys_all = {"hour": c["hour"][test], "dow": c["dow"][test]}
+    if "cluster" in c:
+        sizes["cluster"] = max(1, meta["n_clusters"])
+        keys_all["cluster"] = np.maximum(c["cluster"][test], 0)
+    occ, cap = c["occ"][test], c["capacity"][test]
+    Xte = np.ascontiguousarray(c["X"][test])
+    scores = {}
+    for j, h in enumerate(horizons):
+        model, it, g, _ = fitted[h]
+        y_occ = c["Y"][test, j]
+        ok = np.isfinite(y_occ) & np.isfinite(occ) & np.isfinite(cap)
+        y_true = y_occ[ok] * cap[ok]
+        pred = {
+            "model": np.clip(occ[ok] + g * model.predict(Xte[ok], num_iteration=it), 0, 1) * cap[ok],
+            "naive": occ[ok] * cap[ok],
+            "ewma": c["ewma"][test][ok] * cap[ok],
+        }
+        keys = {k: v[ok] for k, v in keys_all.items()}
+        scores[h] = {m: _score(np.abs(pred[m] - y_true), keys, sizes) for m in METHODS}
+    return {"fold": fold, "scores": scores, "fit_s": t_fit, "score_s": time.time() - t0 - t_fit,
+            "n_test": int(len(test)),
+            "models": {h: {"best_iter": int(fitted[h][1] or 0), "gamma": fitted[h][2], "train_s": fitted[h][3]}
+                       for h in horizons}}
+
+
+# ---- driver ----
+def run_backtest(data_dir, folds: Sequence[dict], workers: int = 1, threads_per_worker: int = 1,
+                 models_dir: Optional[str] = None, num_boost_round: Optional[int] = None) -> List[dict]:
+    params = {"num_threads": int(threads_per_worker)}
+    args = [(str(data_dir), f, models_dir, params, num_boost_round) for f in folds]
+    if workers <= 1:
+        return [run_fold(*a) for a in args]
+    kw = {"max_tasks_per_child": 1} if sys.version_info >= (3, 11) else {}
+    with ProcessPoolExecutor(max_workers=int(workers), mp_context=get_context("spawn"), **kw) as ex:
+        return list(ex.map(run_fold, *zip(*args)))
+
+
+def results_frame(results: Sequence[dict]) -> pd.DataFrame:
+    """Tidy MAE table: fold, horizon, method, by (all/hour/dow/cluster), key, mae, n.
+
+    fold == -1 rows pool every fold (sums and counts, not a mean of MAEs).
+    """
+    acc: Dict[tuple, list] = {}
+    rows = []
+    for r in results:
+        fold = r["fold"]["fold"]
+        for h, by_m in r["scores"].items():
+            for m, sc in by_m.items():
+                for by, (s, n) in sc.items():
+                    s, n = np.atleast_1d(s), np.atleast_1d(n)
+                    a = acc.setdefault((int(h), m, by), [np.zeros_like(s, dtype="float64"), np.zeros_like(n)])
+                    a[0] += s
+                    a[1] += n
+                    for k in range(len(s)):
+                        rows.append((fold, int(h), m, by, k if by != "all" else 0, s[k], n[k]))
+    for (h, m, by), (s, n) in acc.items():
+        for k in range(len(s)):
+            rows.append((-1, h, m, by, k if by != "all" else 0, s[k], n[k]))
+    df = pd.DataFrame(rows, columns=["fold", "horizon", "method", "by", "key", "abs_err", "n"])
+    df["mae"] = df["abs_err"] / df["n"].where(df["n"] > 0)
+    return df.drop(columns="abs_err")
@@ -0,0 +1,107 @@
+# src/velib_ml/bundle.py
+# Single-file serving artifact: every horizon's trees already compiled to flat node
+# arrays (velib_ml.trees), the feature list, gammas, config and optional station
+# encodings in one uncompressed .npz, with a sha256 over the content. Loading is a
+# few array reads: no text parsing, no lightgbm, no pandas.
+from __future__ import annotations
+import hashlib, json, time
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+
+from .inference import HORIZON_FEATURE, MULTI_FILE
+from .trees import CompiledTrees
+
+BUNDLE_NAME = "bundle.npz"
+FORMAT_VERSION = 1
+
+
+def _digest(arrays: Dict[str, np.ndarray], meta: dict) -> str:
+    h = hashlib.sha256(json.dumps(meta, sort_keys=True).encode())
+    for k in sorted(arrays):
+        a = np.ascontiguousarray(arrays[k])
+        h.update(f"{k}:{a.dtype.str}:{a.shape}".encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def build_bundle(artifact_dir, out=None, encodings: Optional[Dict[str, np.ndarray]] = None) -> Path:
+    """Compile an artifact dir (train.py / refresh.py output) into `<dir>/bundle.npz`.
+
+    `encodings` (arrays, e.g. station ids + per-station tables) are stored as-is;
+    by default they come from `<dir>/station_encodings.npz` when present.
+    """
+    d = Path(artifact_dir)
+    out = Path(out) if out else d / BUNDLE_NAME
+    feat_cols = json.loads((d / "feat_cols_delta.json").read_text())
+    cfg = json.loads((d / "config.json").read_text()) if (d / "config.json").exists() else {}
+    if encodings is None and (d / "station_encodings.npz").exists():
+        with np.load(d / "station_encodings.npz", allow_pickle=False) as z:
+            encodings = {k: z[k] for k in z.files}
+    arrays: Dict[str, np.ndarray] = {}
+    horizons = []
+    for p in sorted(d.glob("lgbm_delta_h*.txt")):
+        h = int(p.stem.rsplit("_h", 1)[1])
+        horizons.append(h)
+        for k, a in CompiledTrees.from_file(p).to_arrays().items():
+            arrays[f"h{h}/{k}"] = a
+    multi = (d / MULTI_FILE).exists()
+    if multi:
+        # one model for every horizon of the config (train.py --multi-horizon)
+        horizons = [int(h) for h in cfg["horizons"]]
+        for k, a in CompiledTrees.from_file(d / MULTI_FILE).to_arrays().items():
+            arrays[f"multi/{k}"] = a
+    if not horizons:
+        raise FileNotFoundError(f"No lgbm_delta_h*.txt or {MULTI_FILE} in {d}")
+    for k, a in (encodings or {}).items():
+        arrays[f"enc/{k}"] = np.asarray(a)
+    meta = {
+        "format": FORMAT_VERSION,
+        "source": d.name,
+        "horizons": sorted(horizons),
+        "multi_horizon": multi,
+        "feat_cols": feat_cols,
+        "gammas": {str(k): float(v) for k, v in cfg.get("gammas", cfg.get("gamma", {})).items()},
+        "target_kind": cfg.get("target_kind", "delta_occ"),
+        "config": cfg,
+        "built_at": time.time(),
+    }
+    meta["sha256"] = _digest(arrays, meta)
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), dtype="uint8")
+    tmp = out.with_name("." + out.name)
+    with open(tmp, "wb") as f:                    # np.savez on a path would append ".npz"
+        np.savez(f, **arrays)
+    tmp.replace(out)
+    return out
+
+
+class Bundle:
+    """A loaded bundle: `models` {h: CompiledTrees}, `feat_cols`, `gammas`, `encodings`, `sha256`.
+
+    For a multi-horizon bundle every horizon maps to the same `multi` model.
+    """
+
+    def __init__(self, path, verify: bool = True):
+        self.path = Path(path)
+        with np.load(self.path, allow_pickle=False) as z:
+            arrays = {k: z[k] for k in z.files}
+        meta = json.loads(arrays.pop("meta").tobytes())
+        self.sha256 = meta.pop("sha256")
+        if verify and _digest(arrays, meta) != self.sha256:
+            raise ValueError(f"{self.path}: content hash mismatch (corrupt or edited bundle)")
+        self.meta = meta
+        self.feat_cols: List[str] = meta["feat_cols"]
+        self.gammas: Dict[str, float] = meta["gammas"]
+        self.config: dict = meta.get("config", {})
+        self.target_kind: str = meta.get("target_kind", "delta_occ")
+        self.models: Dict[int, CompiledTrees] = {}
+        self.multi: Optional[CompiledTrees] = None
+        if meta.get("multi_horizon"):
+            self.multi = CompiledTrees.from_arrays({k[6:]: a for k, a in arrays.items() if k.startswith("multi/")},
+                                                   self.feat_cols + [HORIZON_FEATURE])
+            self.models = {int(h): self.multi for h in meta["horizons"]}
+        for h in ([] if self.multi is not None else meta["horizons"]):
+            pre = f"h{h}/"
+            self.models[int(h)] = CompiledTrees.from_arrays(
+                {k[len(pre):]: a for k, a in arrays.items() if k.startswith(pre)}, self.feat_cols)
+        self.encodings = {k[4:]: a for k, a in arrays.items() if k.startswith("enc/")}
@@ -0,0 +1,158 @@
+# src/velib_ml/chunked.py
+# Out-of-core feature pipeline: stream raw chunks (partitioned Parquet or a big CSV),
+# compute features per chunk with just the halo rows the windows need, write
+# feature chunks to disk, and load them back with column projection for training.
+from __future__ import annotations
+import math
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence
+import pandas as pd
+
+from .config import FREQ_MIN, HORIZONS, LAG_STEPS, ROLL_STEPS, EMA_ALPHAS
+from .data import RAW_COLS, RAW_DTYPES, clean_timeseries
+from .features import make_features
+
+HALO_FUTURE = max(HORIZONS) // FREQ_MIN
+HALO_WAIT = pd.Timedelta(days=1)  # a station silent this long past a chunk gets no later rows for it
+EMA_TOL = 1e-4  # weight left on rows older than the halo when EMAs are on
+
+
+def halo_past(use_ema: bool = False) -> int:
+    """Past rows per station a chunk needs so its first rows get full windows."""
+    n = max(LAG_STEPS + ROLL_STEPS)
+    if use_ema:  # EMAs have infinite memory: keep enough rows for the tail weight to vanish
+        n = max(n, math.ceil(math.log(EMA_TOL) / math.log(1 - min(EMA_ALPHAS.values()))))
+    return n
+
+
+def iter_raw_chunks(path, chunksize: int = 2_000_000) -> Iterator[pd.DataFrame]:
+    """Raw (ts, station_id, bikes_available, capacity) chunks, in time order per station.
+
+    SnapshotStore root: FREQ_MIN-aligned read_timeseries, whole days per chunk
+    (staging rows included). Parquet (file or time/station-partitioned directory):
+    one chunk per row group, files in path order, reading only RAW_COLS. CSV:
+    `chunksize` rows at a time.
+    """
+    p = Path(path)
+    if (p / "_staging").is_dir():
+        from .snapshot_store import SnapshotStore
+        yield from SnapshotStore(p).iter_timeseries(chunksize)
+    elif p.is_dir() or p.suffix == ".parquet":
+        import pyarrow.dataset as ds
+        dset = ds.dataset(str(p), format="parquet", partitioning="hive")
+        for frag in sorted(dset.get_fragments(), key=lambda f: f.path):
+            for rg in frag.split_by_row_group():
+                df = rg.to_table(schema=dset.schema, columns=RAW_COLS).to_pandas()
+                df["ts"] = pd.to_datetime(df["ts"], utc=True)
+                yield df.astype({k: v for k, v in RAW_DTYPES.items() if k != "station_id"})
+    else:
+        dtypes = {**RAW_DTYPES, "station_id": "str"}
+        yield from pd.read_csv(p, usecols=RAW_COLS, dtype=dtypes, parse_dates=["ts"], chunksize=chunksize)
+
+
+def _clean_parts(past, core, future, last_cap) -> pd.DataFrame:
+    """clean_timeseries over past (cleaned) + core + future (raw) rows, tagged by `_part` 0 / 1 / 2.
+
+    Capacity is ffilled from `last_cap` (last raw capacity per station before
+    `core`), so every row gets the capacity the full-frame path gives it.
+    """
+    raw = pd.concat([d.assign(_part=k) for d, k in ((core, 1), (future, 2)) if d is not None and len(d)],
+                    ignore_index=True).sort_values(["station_id", "ts"], kind="stable")
+    cap = raw.groupby("station_id", sort=False)["capacity"].ffill()
+    raw["capacity"] = cap.fillna(raw["station_id"].map(last_cap)).astype("float32")
+    parts = ([past.assign(_part=0)] if past is not None and len(past) else []) + [raw]
+    return clean_timeseries(pd.concat(parts, ignore_index=True))
+
+
+def _features_for_core(frame, use_ema, weather_5min):
+    feat = make_features(frame, use_ema=use_ema)
+    if weather_5min is not None:
+        from .weather import add_weather
+        feat = add_weather(feat, weather_5min)
+    feat = feat[feat["_part"] == 1].drop(columns="_part")
+    return feat.reset_index(drop=True)
+
+
+def _has_future(core, later, last_cap) -> bool:
+    """Every station of `core` has HALO_FUTURE rows in `later` (and a capacity to bfill from if it
+    has none yet), or `later` runs HALO_WAIT past its last row."""
+    g = core.groupby("station_id", sort=False)
+    last = g["ts"].max()
+    rows = later.loc[later["capacity"] != 0, "station_id"].value_counts().reindex(last.index, fill_value=0)
+    no_cap = g["capacity"].count().eq(0) & ~last.index.isin(last_cap.index)
+    cap_later = last.index.isin(later.loc[later["capacity"].notna(), "station_id"].unique())
+    ok = (rows >= HALO_FUTURE) & (~no_cap | cap_later)
+    return bool((ok | (later["ts"].max() - last > HALO_WAIT)).all())
+
+
+def build_feature_chunks(src, outdir, use_ema: bool = False, weather_5min: Optional[pd.DataFrame] = None,
+                         chunksize: int = 2_000_000) -> List[Path]:
+    """Stream `src` → make_features (+ weather) → outdir/part-NNNNN.parquet, one part per input chunk.
+
+    A chunk is written once the chunks read after it hold HALO_FUTURE rows for
+    each of its stations (or reach HALO_WAIT past it, for stations that stop
+    reporting), so its last rows get their targets; cleaning and features run
+    on halo_past() rows per station + chunk + those later rows, as on the
+    full frame. In memory: the unwritten chunks and the past halo.
+    """
+    out = Path(outdir)
+    out.mkdir(parents=True, exist_ok=True)
+    for old in out.glob("part-*.parquet"):
+        old.unlink()
+    n_past = halo_past(use_ema)
+    past, last_cap, queue, paths = None, pd.Series(dtype="float32"), [], []
+
+    def flush():
+        nonlocal past, last_cap
+        core = queue.pop(0)
+        frame = _clean_parts(past, core, pd.concat(queue, ignore_index=True) if queue else None, last_cap)
+        feat = _features_for_core(frame, use_ema, weather_5min)
+        path = out / f"part-{len(paths):05d}.parquet"
+        feat.astype({"station_id": "str"}).to_parquet(path, index=False)
+        paths.append(path)
+        seen = frame[frame["_part"] < 2].drop(columns="_part")
+        past = seen.groupby("station_id", sort=False).tail(n_past).reset_index(drop=True)
+        cap = core.dropna(subset=["capacity"]).groupby("station_id", sort=False)["capacity"].last()
+        last_cap = cap.combine_first(last_cap)
+
+    for raw in iter_raw_chunks(src, chunksize=chunksize):
+        cur = raw.astype({"station_id": "str"})
+        if not len(cur):
+            continue
+        queue.append(cur)
+        while len(queue) > 1 and _has_future(queue[0], pd.concat(queue[1:], ignore_index=True), last_cap):
+            flush()
+    while queue:
+        flush()
+    return paths
+
+
+# uint8 in the pandas frames; Parquet written by Spark (velib_ml.spark) has them as int8
+UINT8_COLS = ("hour", "dow", "is_weekend", "is_rain")
+
+
+def restore_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """station_id as category, UINT8_COLS as uint8 (in place, returned)."""
+    if "station_id" in df:
+        df["station_id"] = df["station_id"].astype("category")
+    for c in UINT8_COLS:
+        if c in df and df[c].dtype != "uint8":
+            df[c] = df[c].astype("uint8")
+    return df
+
+
+def feature_columns(path) -> List[str]:
+    import pyarrow.dataset as ds
+    return list(ds.dataset(str(path), format="parquet").schema.names)
+
+
+def load_feature_chunks(path, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Feature chunks (or spark.write_features output) → one frame sorted by (station_id, ts), only `columns`."""
+    import pyarrow.dataset as ds
+    cols = None if columns is None else list(dict.fromkeys(columns))
+    df = restore_dtypes(ds.dataset(str(path), format="parquet").to_table(columns=cols).to_pandas())
+    if "ts" in df:
+        df["ts"] = pd.to_datetime(df["ts"], utc=True).astype("datetime64[ns, UTC]")   # Spark writes µs
+    if {"station_id", "ts"} <= set(df.columns):
+        df = df.sort_values(["station_id", "ts"], ignore_index=True)
+    return df
@@ -1,4 +1,10 @@
 FREQ_MIN = 5
 HORIZONS = [15, 30, 60]
 SPLIT_TRAINTEST = 0.70
-SPLIT_TRAINVAL  = 0.85 
\ No newline at end of file
+SPLIT_TRAINVAL  = 0.85
+
+# history features, in 5-min steps (names use minutes: occ_lag_{k*FREQ_MIN}, ...)
+LAG_STEPS   = [1, 2, 3, 6, 12]
+ROLL_STEPS  = [3, 6, 12, 24, 36]
+DELTA_STEPS = [1, 3, 6, 12]
+EMA_ALPHAS  = {"occ_ema_fast": 0.5, "occ_ema_slow": 0.1}
@@ -1,13 +1,21 @@
 import pandas as pd
 
-def load_timeseries(path):
-    usecols = ["ts","station_id","bikes_available","capacity"]
-    dtypes  = {"station_id":"category","bikes_available":"float32","capacity":"float32"}
-    df = (pd.read_csv(path, usecols=usecols, dtype=dtypes, parse_dates=["ts"])
-            .sort_values(["station_id","ts"]).reset_index(drop=True))
-    df["capacity"] = (df.groupby("station_id")["capacity"]
+RAW_COLS   = ["ts","station_id","bikes_available","capacity"]
+RAW_DTYPES = {"station_id":"category","bikes_available":"float32","capacity":"float32"}
+
+def clean_timeseries(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.sort_values(["station_id","ts"]).reset_index(drop=True)
+    df["capacity"] = (df.groupby("station_id", observed=True)["capacity"]
                         .transform(lambda s: s.ffill().bfill().fillna(s.max()))
                         .astype("float32"))
     df = df[df["capacity"]>0].copy()
     df["occ"] = (df["bikes_available"]/df["capacity"]).clip(0,1).astype("float32")
-    return df
\ No newline at end of file
+    return df
+
+def load_timeseries(path):
+    if str(path).endswith(".parquet"):
+        df = pd.read_parquet(path, columns=RAW_COLS).astype(RAW_DTYPES)
+        df["ts"] = pd.to_datetime(df["ts"], utc=True)
+    else:
+        df = pd.read_csv(path, usecols=RAW_COLS, dtype=RAW_DTYPES, parse_dates=["ts"])
+    return clean_timeseries(df)
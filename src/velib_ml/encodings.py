@@ -0,0 +1,89 @@
+# src/velib_ml/encodings.py
+# Station encodings as dense arrays (NumPy only, shared by training and serving):
+# sta_mean_occ per station and sta_hdh_occ per (station, dow, hour), read with one
+# fancy-indexing gather instead of DataFrame merges.
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+import numpy as np
+
+ENCODINGS_NAME = "station_encodings.npz"
+
+
+class StationEncodings:
+    """`mean` (n,) and `hdh` (n, 7, 24) occupancy tables + station_id → row index.
+
+    `hdh` cells never seen in training hold the station mean (what the
+    merge + fillna in features.station_encodings produced); stations never
+    seen get NaN for both.
+    """
+
+    def __init__(self, station_ids: Sequence[str], mean: np.ndarray, hdh: np.ndarray):
+        self.station_ids = np.asarray([str(s) for s in station_ids])
+        self.mean = np.asarray(mean)
+        self.hdh = np.asarray(hdh)
+        self.index: Dict[str, int] = {s: i for i, s in enumerate(self.station_ids.tolist())}
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    @classmethod
+    def fit(cls, codes: np.ndarray, station_ids: Sequence[str], dow: np.ndarray, hour: np.ndarray,
+            occ: np.ndarray, dtype: str = "float32") -> "StationEncodings":
+        """Mean per station and median per (station, dow, hour); `codes` index `station_ids`."""
+        n = len(station_ids)
+        ok = np.isfinite(occ) & (codes >= 0)
+        codes, occ = codes[ok].astype("int64"), occ[ok].astype("float64")
+        cnt = np.bincount(codes, minlength=n)
+        mean = np.divide(np.bincount(codes, occ, minlength=n), cnt, out=np.full(n, np.nan), where=cnt > 0)
+        # median per cell: sort by (cell, occ), average the two middle values of each run
+        cell = codes * 168 + dow[ok].astype("int64") * 24 + hour[ok].astype("int64")
+        order = np.lexsort((occ, cell))
+        cell, occ = cell[order], occ[order]
+        uniq, start, size = np.unique(cell, return_index=True, return_counts=True)
+        med = (occ[start + (size - 1) // 2] + occ[start + size // 2]) / 2
+        hdh = np.repeat(mean, 168)
+        hdh[uniq] = med
+        return cls(station_ids, mean.astype(dtype), hdh.reshape(n, 7, 24).astype(dtype))
+
+    # ---- lookups ----
+    def rows(self, station_ids: Sequence[str]) -> np.ndarray:
+        get = self.index.get
+        return np.fromiter((get(str(s), -1) for s in station_ids), dtype="int64", count=len(station_ids))
+
+    def gather(self, rows: np.ndarray, dow: np.ndarray, hour: np.ndarray):
+        """(sta_mean_occ, sta_hdh_occ) as float32 for table rows (-1 = unknown → NaN)."""
+        rows = np.asarray(rows, dtype="int64")
+        known = rows >= 0
+        r = np.where(known, rows, 0)
+        mean = np.where(known, self.mean[r], np.nan).astype("float32")
+        hdh = np.where(known, self.hdh[r, np.asarray(dow, dtype="int64"), np.asarray(hour, dtype="int64")],
+                       np.nan).astype("float32")
+        return mean, hdh
+
+    def lookup(self, station_ids: Sequence[str], dow: np.ndarray, hour: np.ndarray):
+        return self.gather(self.rows(station_ids), dow, hour)
+
+    # ---- persistence ----
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {"station_ids": self.station_ids, "sta_mean_occ": self.mean, "sta_hdh_occ": self.hdh}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> Optional["StationEncodings"]:
+        if "sta_hdh_occ" not in arrays:
+            return None
+        return cls(arrays["station_ids"], arrays["sta_mean_occ"], arrays["sta_hdh_occ"])
+
+    def save(self, path) -> Path:
+        p = Path(path)
+        p = p / ENCODINGS_NAME if p.is_dir() else p
+        with open(p, "wb") as f:
+            np.savez(f, **self.to_arrays())
+        return p
+
+    @classmethod
+    def load(cls, path) -> "StationEncodings":
+        p = Path(path)
+        p = p / ENCODINGS_NAME if p.is_dir() else p
+        with np.load(p, allow_pickle=False) as z:
+            return cls.from_arrays({k: z[k] for k in z.files})
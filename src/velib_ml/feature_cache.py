@@ -0,0 +1,156 @@
+# src/velib_ml/feature_cache.py
+# Content-addressed on-disk cache for training frames. The key hashes the input files
+# (content, not mtime), the feature config and the source of the modules that build the
+# features, so any change to one of them is a miss. An entry is a dir of plain .npy
+# column files (one per column and frame) + meta.json; a hit memory-maps only the
+# columns asked for. Entries are evicted least-recently-used once the cache grows past
+# `max_bytes`.
+from __future__ import annotations
+import hashlib, json, os, shutil, time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+# modules whose code decides what the cached frames contain
+CODE_MODULES = ("config", "data", "features", "weather", "weather_store", "panel", "chunked", "encodings", "splits")
+_BLOCK = 1 << 22
+
+
+def _hash_file(h, path: Path) -> None:
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_BLOCK), b""):
+            h.update(block)
+
+
+def fingerprint(paths: Iterable) -> str:
+    """Hash of the content of files / directory trees (None entries skipped)."""
+    h = hashlib.blake2b(digest_size=16)
+    for p in paths:
+        if p is None:
+            continue
+        p = Path(p)
+        files = sorted(f for f in p.rglob("*") if f.is_file()) if p.is_dir() else [p]
+        for f in files:
+            h.update(str(f.relative_to(p) if p.is_dir() else f.name).encode() + b"\0")
+            _hash_file(h, f)
+    return h.hexdigest()
+
+
+def code_version(extra: Sequence = ()) -> str:
+    """Hash of the feature-building modules (+ `extra` files, e.g. the calling script)."""
+    here = Path(__file__).resolve().parent
+    return fingerprint([here / f"{m}.py" for m in CODE_MODULES] + list(extra))
+
+
+def _dir_bytes(d: Path) -> int:
+    return sum(f.stat().st_size for f in d.rglob("*") if f.is_file())
+
+
+class FeatureCache:
+    """Frames (and small files) per key under `root`, LRU-evicted above `max_bytes`."""
+
+    def __init__(self, root, max_bytes: float = 20 * 2**30):
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+
+    def key(self, inputs: Iterable, config: dict, code: Sequence = ()) -> str:
+        blob = json.dumps({"inputs": fingerprint(inputs), "config": config, "code": code_version(code)},
+                          sort_keys=True, default=str)
+        return hashlib.blake2b(blob.encode(), digest_size=16).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def entries(self) -> List[Path]:
+        return [d for d in self.root.glob("*") if (d / "meta.json").is_file()] if self.root.is_dir() else []
+
+    # ---- read ----
+    def get(self, key: str, columns: Optional[Sequence[str]] = None, mmap: bool = True
+            ) -> Optional[Tuple[Dict[str, pd.DataFrame], dict]]:
+        """({frame name: DataFrame}, info) or None. `columns`: load only these (when present)."""
+        d = self.path(key)
+        try:
+            meta = json.loads((d / "meta.json").read_text())
+        except (OSError, ValueError):
+            return None
+        os.utime(d / "meta.json")                      # last use, for LRU
+        mode = "r" if mmap else None
+        frames = {}
+        for name, spec in meta["frames"].items():
+            cols = [c for c in (columns or spec["columns"]) if c in spec["columns"]]
+            frames[name] = pd.DataFrame({c: self._read_column(d / name, c, spec["columns"][c], mode) for c in cols},
+                                        index=pd.RangeIndex(spec["n_rows"]))
+        return frames, meta["info"]
+
+    @staticmethod
+    def _read_column(d: Path, col: str, spec: dict, mode):
+        a = np.load(d / f"{col}.npy", mmap_mode=mode)
+        kind = spec["kind"]
+        if kind == "datetime":
+            return pd.DatetimeIndex(a.view("datetime64[ns]")).tz_localize(spec["tz"]) if spec["tz"] \
+                else a.view("datetime64[ns]")
+        if kind == "category":
+            return pd.Categorical.from_codes(a, categories=spec["categories"])
+        if kind == "object":
+            return np.asarray(spec["categories"], dtype=object)[a]
+        return a
+
+    # ---- write ----
+    def put(self, key: str, frames: Dict[str, pd.DataFrame], info: dict, files: Sequence = ()) -> Path:
+        """Write an entry (atomically: built aside, then renamed), then evict down to max_bytes."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".tmp-{key}-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        meta = {"frames": {}, "info": info, "created_at": time.time()}
+        for name, df in frames.items():
+            (tmp / name).mkdir(parents=True)
+            meta["frames"][name] = {"n_rows": len(df),
+                                    "columns": {c: self._write_column(tmp / name, c, df[c]) for c in df.columns}}
+        for f in files:
+            shutil.copy2(f, tmp / Path(f).name)
+        meta["bytes"] = _dir_bytes(tmp)
+        (tmp / "meta.json").write_text(json.dumps(meta, default=str))
+        dest = self.path(key)
+        try:
+            os.replace(tmp, dest)
+        except OSError:                                # same key written meanwhile: keep that one
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=key)
+        return dest
+
+    @staticmethod
+    def _write_column(d: Path, col: str, s: pd.Series) -> dict:
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            spec, a = {"kind": "category", "categories": s.cat.categories.tolist()}, s.cat.codes.to_numpy()
+        elif pd.api.types.is_datetime64_any_dtype(s.dtype):
+            tz = getattr(s.dt, "tz", None)
+            spec = {"kind": "datetime", "tz": str(tz) if tz is not None else None}
+            a = (s.dt.tz_convert("UTC").dt.tz_localize(None) if tz is not None else s).to_numpy("datetime64[ns]").view("int64")
+        elif s.dtype == object:
+            codes, uniq = pd.factorize(s)
+            spec, a = {"kind": "object", "categories": uniq.tolist()}, codes
+        else:
+            spec, a = {"kind": "numeric"}, s.to_numpy()
+        np.save(d / f"{col}.npy", np.ascontiguousarray(a))
+        return spec
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        """Drop least-recently-used entries until the total fits in max_bytes; removed keys."""
+        entries = sorted(self.entries(), key=lambda d: (d / "meta.json").stat().st_mtime)
+        sizes = {}
+        for d in entries:
+            try:
+                sizes[d] = json.loads((d / "meta.json").read_text())["bytes"]
+            except (OSError, ValueError, KeyError):
+                sizes[d] = _dir_bytes(d)
+        total, removed = sum(sizes.values()), []
+        for d in entries:
+            if total <= self.max_bytes:
+                break
+            if d.name == keep:
+                continue
+            shutil.rmtree(d, ignore_errors=True)
+            total -= sizes[d]
+            removed.append(d.name)
+        return removed
@@ -1,58 +1,156 @@
 import numpy as np, pandas as pd
-from .config import FREQ_MIN, HORIZONS
+from .config import FREQ_MIN, HORIZONS, LAG_STEPS, ROLL_STEPS, DELTA_STEPS, EMA_ALPHAS
+
+# ---- segment engine: rows sorted by (station, ts), one contiguous segment per station ----
+def _station_order(df: pd.DataFrame):
+    """Row order of sort_values(["station_id","ts"]) (stable, None if already sorted), the station
+    key and the station labels it indexes (categories, or the sorted unique ids)."""
+    sid = df["station_id"]
+    if isinstance(sid.dtype, pd.CategoricalDtype):
+        key, ids = sid.cat.codes.to_numpy(), sid.cat.categories
+    else:
+        key, ids = pd.factorize(sid, sort=True)
+    ts = np.asarray(df["ts"].values)
+    dk = np.diff(key)
+    if (dk >= 0).all() and (np.diff(ts)[dk == 0] >= np.timedelta64(0)).all():
+        return None, key, ids
+    return np.lexsort((ts, key)), key, ids
+
+def _calendar(ts: pd.Series):
+    """hour and dayofweek as uint8 (integer arithmetic on UTC/naive timestamps)."""
+    tz = getattr(ts.dt, "tz", None)
+    if tz is not None and str(tz) != "UTC":
+        return ts.dt.hour.to_numpy().astype("uint8"), ts.dt.dayofweek.to_numpy().astype("uint8")
+    secs = np.asarray(ts.values).astype("datetime64[s]").astype("int64")
+    return ((secs // 3600) % 24).astype("uint8"), ((secs // 86400 + 3) % 7).astype("uint8")
+
+def _segments(key_sorted: np.ndarray):
+    """Start of each station segment, position of each row in its segment, rows left after it."""
+    n = len(key_sorted)
+    starts = np.flatnonzero(np.r_[True, key_sorted[1:] != key_sorted[:-1]]) if n else np.zeros(0, dtype="int64")
+    lens = np.diff(np.r_[starts, n])
+    pos = np.arange(n) - np.repeat(starts, lens)
+    left = np.repeat(lens, lens) - pos - 1
+    return starts, lens, pos, left
+
+def _seg_shift(a: np.ndarray, k: int, pos: np.ndarray, left: np.ndarray) -> np.ndarray:
+    """groupby-shift(k) inside segments (k<0 looks ahead)."""
+    out = np.full(len(a), np.nan, dtype=a.dtype)
+    if k > 0:
+        out[k:] = a[:-k]
+        out[pos < k] = np.nan
+    elif k < 0:
+        out[:k] = a[-k:]
+        out[left < -k] = np.nan
+    else:
+        out[:] = a
+    return out
+
+def _past_sums(a: np.ndarray):
+    """Prefix sums (NaN as 0) and prefix NaN counts, shared by every rolling window."""
+    nan = np.isnan(a)
+    csum = np.zeros(len(a) + 1)
+    np.cumsum(np.where(nan, 0.0, a), dtype="float64", out=csum[1:])
+    cnan = np.zeros(len(a) + 1, dtype="int32")
+    np.cumsum(nan, dtype="int32", out=cnan[1:])
+    return csum, cnan
+
+def _seg_roll_mean_past(sums, n: int, pos: np.ndarray) -> np.ndarray:
+    """Mean of the n previous rows of the segment (shift(1).rolling(n).mean()), NaN if any is missing."""
+    csum, cnan = sums
+    out = np.full(len(pos), np.nan, dtype="float32")
+    out[n:] = (csum[n:-1] - csum[:-n-1]) / n
+    out[(pos < n)] = np.nan
+    out[n:][cnan[n:-1] != cnan[:-n-1]] = np.nan
+    return out
+
+def _seg_ema_past(a: np.ndarray, alpha: float, starts: np.ndarray, lens: np.ndarray) -> np.ndarray:
+    """shift(1).ewm(alpha, adjust=False).mean() per segment, stepping all stations together."""
+    out = np.full(len(a), np.nan)
+    w = np.full(len(starts), np.nan)       # current EMA per segment
+    old_wt = np.ones(len(starts))
+    for t in range(1, int(lens.max()) if len(lens) else 0):
+        alive = lens > t
+        i = starts[alive] + t
+        v, wa, ow = a[i - 1].astype("float64"), w[alive], old_wt[alive]
+        obs, has = ~np.isnan(v), ~np.isnan(wa)
+        ow = np.where(has, ow * (1 - alpha), ow)        # same NaN handling as pandas (ignore_na=False)
+        upd = has & obs
+        wa = np.where(upd, (ow * wa + alpha * v) / (ow + alpha), np.where(obs, v, wa))
+        old_wt[alive] = np.where(upd, 1.0, ow)
+        w[alive] = wa
+        out[i] = wa
+    return out
 
 def make_features(df: pd.DataFrame, use_ema=False) -> pd.DataFrame:
-    feat = df.copy().sort_values(["station_id","ts"]).reset_index(drop=True)
-    feat["hour"] = feat["ts"].dt.hour.astype("uint8")
-    feat["dow"]  = feat["ts"].dt.dayofweek.astype("uint8")
-    feat["is_weekend"] = (feat["dow"]>=5).astype("uint8")
-    feat["hour_sin"] = np.sin(2*np.pi*feat["hour"]/24).astype("float32")
-    feat["hour_cos"] = np.cos(2*np.pi*feat["hour"]/24).astype("float32")
-    feat["hour_sin2"] = np.sin(4*np.pi*feat["hour"]/24).astype("float32")
-    feat["hour_cos2"] = np.cos(4*np.pi*feat["hour"]/24).astype("float32")
-
-    def shift(col,k): return feat.groupby("station_id")[col].shift(k)
-
-    for k in [1,2,3,6,12]:
-        feat[f"occ_lag_{k*FREQ_MIN}"] = shift("occ", k).astype("float32")
-
-    feat["occ_roll_15"]  = shift("occ",1).rolling(3).mean().reset_index(level=0, drop=True).astype("float32")
-    feat["occ_roll_30"]  = shift("occ",1).rolling(6).mean().reset_index(level=0, drop=True).astype("float32")
-    feat["occ_roll_60"]  = shift("occ",1).rolling(12).mean().reset_index(level=0, drop=True).astype("float32")
-    feat["occ_roll_120"] = shift("occ",1).rolling(24).mean().reset_index(level=0, drop=True).astype("float32")
-    feat["occ_roll_180"] = shift("occ",1).rolling(36).mean().reset_index(level=0, drop=True).astype("float32")
-
-    feat["occ_delta_5"]  = (feat["occ"] - shift("occ",1)).astype("float32")
-    feat["occ_delta_15"] = (feat["occ"] - shift("occ",3)).astype("float32")
-    feat["occ_delta_30"] = (feat["occ"] - shift("occ",6)).astype("float32")
-    feat["occ_delta_60"] = (feat["occ"] - shift("occ",12)).astype("float32")
+    # single pass: sort once, then every lag/roll/delta/EMA/target on contiguous float32
+    # arrays that never cross a station boundary
+    order, key, _ = _station_order(df)
+    if order is None:
+        feat = df.reset_index(drop=True)
+    else:
+        feat, key = df.take(order).reset_index(drop=True), key[order]
+    starts, lens, pos, left = _segments(key)
+    occ = feat["occ"].to_numpy(dtype="float32")
+
+    hour, dow = _calendar(feat["ts"])
+    h24 = np.arange(24)
+    feat["hour"] = hour
+    feat["dow"]  = dow
+    feat["is_weekend"] = (dow>=5).astype("uint8")
+    feat["hour_sin"] = np.sin(2*np.pi*h24/24).astype("float32")[hour]
+    feat["hour_cos"] = np.cos(2*np.pi*h24/24).astype("float32")[hour]
+    feat["hour_sin2"] = np.sin(4*np.pi*h24/24).astype("float32")[hour]
+    feat["hour_cos2"] = np.cos(4*np.pi*h24/24).astype("float32")[hour]
+
+    lags = {k: _seg_shift(occ, k, pos, left) for k in sorted(set(LAG_STEPS) | set(DELTA_STEPS))}
+    for k in LAG_STEPS:
+        feat[f"occ_lag_{k*FREQ_MIN}"] = lags[k]
+
+    sums = _past_sums(occ)
+    for n in ROLL_STEPS:
+        feat[f"occ_roll_{n*FREQ_MIN}"] = _seg_roll_mean_past(sums, n, pos)
+    del sums
+
+    for k in DELTA_STEPS:
+        feat[f"occ_delta_{k*FREQ_MIN}"] = occ - lags[k]
 
     if use_ema:
-        feat["occ_ema_fast"] = (
-            feat.groupby("station_id")["occ"].transform(lambda s: s.shift(1).ewm(alpha=0.5, adjust=False).mean())
-        ).astype("float32")
-        feat["occ_ema_slow"] = (
-            feat.groupby("station_id")["occ"].transform(lambda s: s.shift(1).ewm(alpha=0.1, adjust=False).mean())
-        ).astype("float32")
+        for name, a in EMA_ALPHAS.items():
+            feat[name] = _seg_ema_past(occ, a, starts, lens).astype("float32")
         feat["occ_momentum"] = (feat["occ_ema_fast"] - feat["occ_ema_slow"]).astype("float32")
 
     for h in HORIZONS:
-        sh = h // FREQ_MIN
-        feat[f"occ_{h}"] = feat.groupby("station_id")["occ"].shift(-sh).astype("float32")
+        feat[f"occ_{h}"] = _seg_shift(occ, -(h // FREQ_MIN), pos, left)
 
     return feat
 
-def station_encodings(train: pd.DataFrame, frame: pd.DataFrame) -> pd.DataFrame:
-    sta_mean = (train.groupby("station_id")["occ"].mean().rename("sta_mean_occ")).reset_index()
-    sta_hdh  = (train.assign(hour=train["ts"].dt.hour.astype("uint8"),
-                             dow=train["ts"].dt.dayofweek.astype("uint8"))
-                     .groupby(["station_id","dow","hour"])["occ"].median()
-                     .rename("sta_hdh_occ")).reset_index()
-    out = frame.merge(sta_mean, on="station_id", how="left")
-    out = out.merge(sta_hdh, on=["station_id","dow","hour"], how="left")
-    out["sta_hdh_occ"] = out["sta_hdh_occ"].fillna(out["sta_mean_occ"])
+def _station_codes(sid: pd.Series):
+    """(codes, labels) for station_id, categorical or not."""
+    if isinstance(sid.dtype, pd.CategoricalDtype):
+        return sid.cat.codes.to_numpy(), sid.cat.categories.astype(str)
+    codes, uniq = pd.factorize(sid.astype(str))
+    return codes, uniq
+
+def fit_station_encodings(train: pd.DataFrame, dtype: str = "float32"):
+    """StationEncodings (dense station × 7 × 24 tables) fitted on TRAIN rows."""
+    from .encodings import StationEncodings
+    codes, labels = _station_codes(train["station_id"])
+    hour, dow = _calendar(train["ts"])
+    return StationEncodings.fit(codes, labels, dow, hour, train["occ"].to_numpy(dtype="float64"), dtype=dtype)
+
+def attach_station_encodings(frame: pd.DataFrame, enc) -> pd.DataFrame:
+    """sta_mean_occ / sta_hdh_occ columns by array gather (unknown stations → NaN)."""
+    codes, labels = _station_codes(frame["station_id"])
+    rows = np.where(codes >= 0, enc.rows(labels)[codes], -1)
+    hour, dow = _calendar(frame["ts"])
+    out = frame.reset_index(drop=True)
+    out["sta_mean_occ"], out["sta_hdh_occ"] = enc.gather(rows, dow, hour)
     return out
 
+def station_encodings(train: pd.DataFrame, frame: pd.DataFrame) -> pd.DataFrame:
+    return attach_station_encodings(frame, fit_station_encodings(train))
+
 def feature_list(use_ema=False, use_sta=True):
     base = [
         "dow","is_weekend","hour_sin","hour_cos","hour_sin2","hour_cos2",
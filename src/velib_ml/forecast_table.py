@@ -0,0 +1,142 @@
+# src/velib_ml/forecast_table.py
+# Immutable station × horizon forecast table, built once per snapshot and read many times,
+# and the single background worker that rebuilds it off the request path.
+from __future__ import annotations
+import datetime, hashlib, json, threading, time
+from typing import Callable, Optional, Sequence
+import numpy as np
+
+from .online import feature_matrix
+
+
+def _iso(epoch_s: float) -> Optional[str]:
+    if not np.isfinite(epoch_s):
+        return None
+    return datetime.datetime.fromtimestamp(float(epoch_s), datetime.timezone.utc).isoformat()
+
+
+class ForecastTable:
+    """Columnar forecasts: arrays of shape (n_stations, n_horizons) + a station_id → row index.
+
+    Arrays are made read-only and the full JSON body is encoded once at build
+    time, so serving the whole table or one station is a dict lookup. The ETag
+    is a hash of the content (the served, rounded forecasts; not `generated_at`),
+    so a rebuild with identical forecasts keeps it and If-None-Match still
+    answers 304. It is weak: the body also carries the build time.
+    """
+
+    def __init__(self, station_ids: Sequence[str], horizons: Sequence[int], ts: np.ndarray,
+                 predicted_bikes: np.ndarray, delta: np.ndarray, source: str = ""):
+        self.station_ids = [str(s) for s in station_ids]
+        self.horizons = [int(h) for h in horizons]
+        self.ts = np.asarray(ts, dtype="float64")
+        self.predicted_bikes = np.asarray(predicted_bikes, dtype="float32").reshape(len(self.station_ids), -1)
+        self.delta = np.asarray(delta, dtype="float32").reshape(len(self.station_ids), -1)
+        for a in (self.ts, self.predicted_bikes, self.delta):
+            a.flags.writeable = False
+        self.index = {s: i for i, s in enumerate(self.station_ids)}
+        self.source = source
+        self.built_at = time.time()
+
+        self.body = json.dumps(self.to_dict()).encode()
+        self.etag = 'W/"' + self.content_hash() + '"'
+
+    def content_hash(self) -> str:
+        h = hashlib.sha1(json.dumps([self.source, self.horizons, self.station_ids]).encode())
+        for a in (self.ts, np.round(self.predicted_bikes, 3), np.round(self.delta, 6)):
+            h.update(np.ascontiguousarray(a).tobytes())
+        return h.hexdigest()[:20]
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    def to_dict(self) -> dict:
+        bikes, delta = np.round(self.predicted_bikes, 3), np.round(self.delta, 6)
+        return {
+            "generated_at": _iso(self.built_at),
+            "source": self.source,
+            "horizons": self.horizons,
+            "station_id": self.station_ids,
+            "ts": [_iso(t) for t in self.ts],
+            "predicted_bikes": {str(h): bikes[:, j].tolist() for j, h in enumerate(self.horizons)},
+            "delta_model": {str(h): delta[:, j].tolist() for j, h in enumerate(self.horizons)},
+        }
+
+    def row(self, station_id: str) -> Optional[dict]:
+        i = self.index.get(str(station_id))
+        if i is None:
+            return None
+        return {
+            "station_id": self.station_ids[i],
+            "ts": _iso(self.ts[i]),
+            "predictions": {str(h): {"predicted_bikes": round(float(self.predicted_bikes[i, j]), 3),
+                                     "delta_model": round(float(self.delta[i, j]), 6)}
+                            for j, h in enumerate(self.horizons)},
+        }
+
+
+def build_forecast_table(state, mv, weather: dict, source: Optional[str] = None) -> Optional[ForecastTable]:
+    """Forecast every station of a StationStateStore with one ModelVersion (one matrix, mv.predict_many)."""
+    n = len(state)
+    if not n:
+        return None
+    ids = list(state.station_ids[:n])
+    inp = {**state.features(np.arange(n)), "station_id": ids}
+    X = feature_matrix(inp, mv.feat_cols, weather, mv.encodings)
+    horizons = mv.horizons
+    bikes, delta = np.empty((n, len(horizons))), np.empty((n, len(horizons)))
+    preds = mv.predict_many(horizons, X, inp["bikes_available"], inp["capacity"])
+    for j, h in enumerate(horizons):
+        bikes[:, j], delta[:, j] = preds[h]
+    return ForecastTable(ids, horizons, inp["ts"], bikes, delta, source=mv.name if source is None else source)
+
+
+class ForecastRebuilder:
+    """One daemon thread running `rebuild()` (build + publish a table) on request.
+
+    `request()` returns at once; requests made while a build runs coalesce into
+    a single next build, so concurrent ingests never run overlapping predicts
+    or race on publishing. `wait()` blocks until the requests made so far are
+    covered by a finished build.
+    """
+
+    def __init__(self, rebuild: Callable[[], object]):
+        self.rebuild = rebuild
+        self.builds = self.coalesced = self.errors = 0
+        self.last_error: Optional[str] = None
+        self._cond = threading.Condition()
+        self._requested = self._done = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def request(self) -> None:
+        with self._cond:
+            self._requested += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="forecast-rebuild", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            target = self._requested
+            return self._cond.wait_for(lambda: self._done >= target, timeout)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._requested > self._done)
+                target = self._requested
+            try:
+                self.rebuild()
+            except Exception as e:          # keep serving the previous table, retry on the next request
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+            with self._cond:
+                self.coalesced += target - self._done - 1
+                self._done = target
+                self.builds += 1
+                self._cond.notify_all()
+
+    def status(self) -> dict:
+        return {"builds": self.builds, "coalesced": self.coalesced, "errors": self.errors,
+                "pending": self._requested > self._done, "last_error": self.last_error}
@@ -0,0 +1,146 @@
+# src/velib_ml/gbfs.py
+# Vélib' GBFS client for the collector: one pooled HTTP session, both feeds fetched
+# concurrently, station_information cached (GBFS ttl + ETag/If-Modified-Since), and
+# ticks skipped when station_status has not moved.
+from __future__ import annotations
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+VELIB_BASE = "https://velib-metropole-opendata.smovengo.cloud/opendata/Velib_Metropole"
+INFO_FEED, STATUS_FEED = "station_information.json", "station_status.json"
+
+SNAPSHOT_COLS = [
+    "station_id", "name", "lat", "lon", "capacity",
+    "is_installed", "is_renting", "is_returning", "last_reported",
+    "num_bikes_available", "num_docks_available",
+]
+
+
+def merge_snapshot(info_df: pd.DataFrame, status_df: pd.DataFrame,
+                   snapshot_ts: Optional[str] = None) -> pd.DataFrame:
+    """station_status ⋈ station_information → collector snapshot columns + snapshot_ts."""
+    status_df = status_df.copy()
+    # certains flux exposent les alias camelCase
+    if "numBikesAvailable" in status_df and "num_bikes_available" not in status_df:
+        status_df["num_bikes_available"] = status_df["numBikesAvailable"]
+    if "numDocksAvailable" in status_df and "num_docks_available" not in status_df:
+        status_df["num_docks_available"] = status_df["numDocksAvailable"]
+    df = pd.merge(status_df, info_df, on="station_id", suffixes=("_status", "_info"), how="inner")
+    df = df[[c for c in SNAPSHOT_COLS if c in df.columns]].copy()
+    df["snapshot_ts"] = snapshot_ts or datetime.now(timezone.utc).isoformat()
+    return df
+
+
+class _Feed:
+    """Validators and last payload of one GBFS feed."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.last_updated: Optional[int] = None
+        self.ttl = 0
+        self.expires_at = 0.0
+        self.df: Optional[pd.DataFrame] = None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        h = {}
+        if self.etag:
+            h["If-None-Match"] = self.etag
+        if self.last_modified:
+            h["If-Modified-Since"] = self.last_modified
+        return h
+
+
+class GBFSClient:
+    """Pooled, concurrent GBFS fetcher.
+
+    `fetch()` returns the merged snapshot, or None when station_status has not
+    advanced since the previous tick (same GBFS `last_updated`, or 304).
+    station_information is only re-requested once its `last_updated + ttl` has
+    passed (at least `info_min_interval_s` apart), always with the ETag /
+    Last-Modified validators of the cached copy. `base_url` can point at a
+    local stub serving GBFS fixtures.
+    """
+
+    def __init__(self, base_url: str = VELIB_BASE, timeout: float = 20,
+                 info_min_interval_s: float = 60, pool_size: int = 4,
+                 session: Optional[requests.Session] = None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.info_min_interval_s = float(info_min_interval_s)
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gbfs")
+        self.info, self.status = _Feed(INFO_FEED), _Feed(STATUS_FEED)
+        self.stats = {"requests": 0, "not_modified": 0, "bytes": 0,
+                      "info_refreshes": 0, "ticks": 0, "skipped": 0}
+
+    def __enter__(self) -> "GBFSClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+        self.session.close()
+
+    def _get(self, feed: _Feed) -> Optional[dict]:
+        """GET one feed with its validators; None on 304 Not Modified."""
+        r = self.session.get(f"{self.base_url}/{feed.name}", headers=feed.conditional_headers(),
+                             timeout=self.timeout)
+        self.stats["requests"] += 1
+        if r.status_code == 304:
+            self.stats["not_modified"] += 1
+            return None
+        r.raise_for_status()
+        self.stats["bytes"] += len(r.content)
+        feed.etag = r.headers.get("ETag") or feed.etag
+        feed.last_modified = r.headers.get("Last-Modified") or feed.last_modified
+        return r.json()
+
+    def _info_due(self, now: float) -> bool:
+        return self.info.df is None or now >= self.info.expires_at
+
+    def _update_info(self, payload: Optional[dict], now: float) -> None:
+        f = self.info
+        if payload is not None:
+            lu = payload.get("last_updated")
+            f.ttl = int(payload.get("ttl", 0) or 0)
+            if f.df is None or lu is None or lu != f.last_updated:
+                f.df = pd.DataFrame(payload["data"]["stations"])
+                self.stats["info_refreshes"] += 1
+            f.last_updated = lu
+        base = f.last_updated + f.ttl if f.last_updated is not None else now + f.ttl
+        f.expires_at = max(base, now + self.info_min_interval_s)
+
+    def fetch(self, force: bool = False) -> Optional[pd.DataFrame]:
+        now = time.time()
+        self.stats["ticks"] += 1
+        status_fut = self._pool.submit(self._get, self.status)
+        info_fut = self._pool.submit(self._get, self.info) if self._info_due(now) else None
+        status = status_fut.result()
+        if info_fut is not None:
+            self._update_info(info_fut.result(), now)
+
+        if status is None:
+            if not force or self.status.df is None:
+                self.stats["skipped"] += 1
+                return None
+        else:
+            lu = status.get("last_updated")
+            unchanged = lu is not None and lu == self.status.last_updated
+            self.status.last_updated = lu
+            if unchanged and not force and self.status.df is not None:
+                self.stats["skipped"] += 1
+                return None
+            self.status.df = pd.DataFrame(status["data"]["stations"])
+        return merge_snapshot(self.info.df, self.status.df)
@@ -1,7 +1,13 @@
-import json, numpy as np, lightgbm as lgb
+import json, numpy as np
 from pathlib import Path
 
+# one model for all horizons (train.py --multi-horizon): (row, horizon) examples,
+# the horizon in minutes appended as the last feature
+MULTI_FILE = "lgbm_delta_multi.txt"
+HORIZON_FEATURE = "horizon_min"
+
 def load_artifacts(dirpath):
+    import lightgbm as lgb      # serving (predict_bikes) must not pay for this import
     d = Path(dirpath)
     feat_cols = json.load(open(d/"feat_cols_delta.json"))
     cfg = json.load(open(d/"config.json"))
@@ -13,3 +19,29 @@ def predict_from_features(row_df, booster, feat_cols, gamma):
     delta = booster.predict(row_df[feat_cols])[0]
     occ_hat = float(np.clip(row_df["occ_now"].iloc[0] + gamma*delta, 0, 1))
     return occ_hat * float(row_df["capacity"].iloc[0]), occ_hat
+
+def _to_bikes(delta, bikes_now, capacity, target_kind):
+    delta_bikes = delta * capacity if target_kind == "delta_occ" else delta
+    return np.clip(bikes_now + delta_bikes, 0, capacity)
+
+def predict_bikes(booster, X, bikes_now, capacity, gamma=1.0, target_kind="delta_occ"):
+    # one predict call for the whole float32 matrix, then Δ → bikes as array ops
+    delta = np.asarray(booster.predict(X), dtype="float64") * float(gamma or 1.0)
+    return _to_bikes(delta, bikes_now, capacity, target_kind), delta
+
+def stack_horizons(X, horizons):
+    """X repeated once per horizon (horizon-major) with the horizon as an extra last column, float32."""
+    n, H = len(X), len(horizons)
+    out = np.empty((H * n, X.shape[1] + 1), dtype="float32")
+    out[:, :-1].reshape(H, n, -1)[:] = X
+    out[:, -1] = np.repeat(np.asarray(horizons, dtype="float32"), n)
+    return out
+
+def predict_bikes_multi(model, X, horizons, bikes_now, capacity, gammas=None, target_kind="delta_occ"):
+    """predict_bikes for all `horizons` of a multi-horizon model, one predict call: {h: (y_hat, delta)}."""
+    raw = np.asarray(model.predict(stack_horizons(X, horizons)), dtype="float64").reshape(len(horizons), len(X))
+    out = {}
+    for j, h in enumerate(horizons):
+        delta = raw[j] * float((gammas or {}).get(str(h), 1.0) or 1.0)
+        out[h] = (_to_bikes(delta, bikes_now, capacity, target_kind), delta)
+    return out
@@ -1,4 +1,4 @@
-import json, pandas as pd
+import json, shutil, pandas as pd
 from pathlib import Path
 
 def save_artifacts(models: dict, feat_cols: list, config: dict, metrics_df: pd.DataFrame, outdir: str):
@@ -9,3 +9,25 @@ def save_artifacts(models: dict, feat_cols: list, config: dict, metrics_df: pd.D
     with open(out/"feat_cols_delta.json","w") as f: json.dump(feat_cols, f)
     with open(out/"config.json","w") as f: json.dump(config, f, indent=2)
     metrics_df.to_csv(out/"metrics.csv", index=False)
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (MB)."""
+    import resource, sys
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10  # bytes on macOS, KB on Linux
+
+def staging_dir(outdir) -> Path:
+    """Empty hidden sibling of `outdir` to write a version into (the registry skips dot dirs)."""
+    out = Path(outdir)
+    tmp = out.with_name("." + out.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    return tmp
+
+def publish_dir(tmp, outdir) -> Path:
+    """Rename the complete `tmp` over `outdir`: a registry poll never sees a half-written version."""
+    out = Path(outdir)
+    if out.exists():
+        shutil.rmtree(out)
+    Path(tmp).rename(out)
+    return out
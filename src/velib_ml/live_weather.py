@@ -0,0 +1,120 @@
+# src/velib_ml/live_weather.py
+# Current weather for serving, refreshed off the request path.
+from __future__ import annotations
+import threading, time
+from typing import Callable, Optional
+
+LAT, LON = 48.8566, 2.3522   # Paris center
+CURRENT_URL = "https://api.open-meteo.com/v1/forecast"
+
+# neutral values served before the first refresh or once the snapshot is too old
+WEATHER_DEFAULT = {"temperature_2m": 0.0, "precipitation": 0.0, "wind_speed_10m": 0.0, "is_rain": 0}
+
+
+def normalize_current(j: dict) -> dict:
+    precip = float(j.get("precipitation", 0.0) or 0.0)
+    return {
+        "temperature_2m": float(j.get("temperature_2m", 0.0) or 0.0),
+        "precipitation": precip,
+        "wind_speed_10m": float(j.get("wind_speed_10m", 0.0) or 0.0),
+        "is_rain": 1 if precip > 0.1 else 0,
+    }
+
+
+def open_meteo_current(url: str = CURRENT_URL, timeout: float = 10) -> dict:
+    import requests
+    params = dict(latitude=LAT, longitude=LON, timezone="UTC",
+                  current="temperature_2m,precipitation,wind_speed_10m")
+    r = requests.get(url, params=params, timeout=timeout)
+    r.raise_for_status()
+    return normalize_current(r.json().get("current", {}))
+
+
+class WeatherRefresher:
+    """In-memory weather snapshot kept fresh by a background thread.
+
+    `provider` is any zero-argument callable returning the weather dict (tests
+    plug a local stub). Refreshes are single-flight: concurrent callers wait for
+    the fetch in progress instead of starting another one. Readers never block:
+    they get the last good snapshot (stale-while-revalidate, kicking a refresh
+    if the thread is not running) and WEATHER_DEFAULT once it is older than
+    `max_staleness_s`.
+    """
+
+    def __init__(self, provider: Callable[[], dict] = open_meteo_current,
+                 interval_s: float = 90, max_staleness_s: float = 900):
+        self.provider = provider
+        self.interval_s = float(interval_s)
+        self.max_staleness_s = float(max_staleness_s)
+        self.value: dict = {}
+        self.updated_at = 0.0         # time.time() of the last successful refresh
+        self.refreshes = 0
+        self.failures = 0
+        self.hits = 0                 # snapshot() served the cached value
+        self.misses = 0               # ... or WEATHER_DEFAULT (nothing cached yet, or too stale)
+        self.last_error: Optional[str] = None
+        self._flight = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self) -> bool:
+        if not self._flight.acquire(blocking=False):
+            with self._flight:        # someone is fetching: wait for their result
+                return self.last_error is None
+        try:
+            val = dict(self.provider())
+            self.value, self.updated_at = val, time.time()
+            self.refreshes += 1
+            self.last_error = None
+            return True
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            return False
+        finally:
+            self._flight.release()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval_s)
+
+    def start(self) -> "WeatherRefresher":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="weather-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        self._thread = None
+
+    def age_s(self) -> Optional[float]:
+        return time.time() - self.updated_at if self.value else None
+
+    def snapshot(self) -> dict:
+        age = self.age_s()
+        running = self._thread is not None and self._thread.is_alive()
+        if not running and (age is None or age > self.interval_s) and not self._flight.locked():
+            threading.Thread(target=self.refresh, daemon=True).start()
+        if age is None or age > self.max_staleness_s:
+            self.misses += 1
+            return dict(WEATHER_DEFAULT)
+        self.hits += 1
+        return self.value
+
+    def status(self) -> dict:
+        age = self.age_s()
+        return {
+            "weather_cached": bool(self.value),
+            "weather_age_s": None if age is None else round(age, 1),
+            "weather_stale": age is None or age > self.max_staleness_s,
+            "weather_refreshes": self.refreshes,
+            "weather_refresh_failures": self.failures,
+            "weather_cache_hits": self.hits,
+            "weather_cache_misses": self.misses,
+            "weather_last_error": self.last_error,
+        }
@@ -0,0 +1,175 @@
+# src/velib_ml/metrics.py
+# Latency histograms (NumPy only): fixed log-spaced buckets, so observing is one
+# bisect + increment from any thread and memory does not grow with traffic.
+# Quantiles are read from the cumulative counts (linear within a bucket).
+# `Metrics` groups labelled histograms and counters and renders them in the
+# Prometheus text exposition format.
+from __future__ import annotations
+import bisect, threading, time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+# 100 µs → 60 s, ~1.4x apart: a quantile is off by at most one bucket width
+DEFAULT_BOUNDS = tuple(float(b) for b in np.geomspace(1e-4, 60, 40).round(6))
+# coarser, for series scraped by Prometheus (one line per bucket and label set)
+REQUEST_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# rows per request
+SIZE_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+
+class LatencyHistogram:
+    """Counts of observed durations (seconds) per bucket `le` bound, + sum, count and max."""
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS):
+        self.bounds = [float(b) for b in bounds]
+        self.counts = [0] * (len(self.bounds) + 1)       # last bucket: > bounds[-1]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        i = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += seconds
+            self.max = max(self.max, seconds)
+
+    @contextmanager
+    def time(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            counts, n, top = list(self.counts), self.count, self.max
+        if not n:
+            return None
+        rank = q * n
+        cum = np.cumsum(counts)
+        i = int(np.searchsorted(cum, rank, side="left"))
+        lo = self.bounds[i - 1] if i > 0 else 0.0
+        hi = self.bounds[i] if i < len(self.bounds) else top
+        prev = cum[i - 1] if i > 0 else 0
+        frac = (rank - prev) / counts[i] if counts[i] else 1.0
+        return min(lo + (hi - lo) * frac, top)
+
+    def summary(self) -> dict:
+        """count, mean/p50/p95/p99/max in milliseconds."""
+        ms = lambda v: None if v is None else round(v * 1e3, 2)
+        return {"count": self.count,
+                "mean_ms": ms(self.sum / self.count) if self.count else None,
+                "p50_ms": ms(self.quantile(0.50)), "p95_ms": ms(self.quantile(0.95)),
+                "p99_ms": ms(self.quantile(0.99)), "max_ms": ms(self.max) if self.count else None}
+
+
+class Histograms:
+    """Named LatencyHistograms, created on first use."""
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.items: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> LatencyHistogram:
+        h = self.items.get(name)
+        if h is None:
+            with self._lock:
+                h = self.items.setdefault(name, LatencyHistogram(self.bounds))
+        return h
+
+    def observe(self, name: str, seconds: float) -> None:
+        self[name].observe(seconds)
+
+    def summary(self) -> Dict[str, dict]:
+        return {n: h.summary() for n, h in list(self.items.items())}
+
+
+# ==== Prometheus text format ====
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict) -> str:
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in labels.items()) + "}" if labels else ""
+
+
+def _num(v) -> str:
+    v = float(v)
+    if v != v:
+        return "NaN"
+    if v in (float("inf"), float("-inf")):
+        return "+Inf" if v > 0 else "-Inf"
+    return str(int(v)) if v.is_integer() and abs(v) < 1e15 else repr(v)
+
+
+def prometheus_lines(name: str, kind: str, help: str, series: Iterable[Tuple[dict, object]]) -> List[str]:
+    """One metric family; `series` = [(labels, number)] or [(labels, LatencyHistogram)] for kind="histogram"."""
+    out = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, v in series:
+        if kind != "histogram":
+            out.append(f"{name}{_labels(labels)} {_num(v)}")
+            continue
+        with v._lock:
+            counts, n, total = list(v.counts), v.count, v.sum
+        cum = 0
+        for b, c in zip(v.bounds + [float("inf")], counts):
+            cum += c
+            out.append(f"{name}_bucket{_labels({**labels, 'le': _num(b)})} {cum}")
+        out.append(f"{name}_sum{_labels(labels)} {_num(total)}")
+        out.append(f"{name}_count{_labels(labels)} {n}")
+    return out
+
+
+class Metrics:
+    """Labelled counters and histograms of one process.
+
+    Families are declared once (`counter` / `histogram`), series are created
+    on first use per label set: `observe("request_seconds", dt, endpoint=...)`,
+    `inc("requests_total", endpoint=..., status=...)`. Keep label values
+    low-cardinality (route templates, not raw paths).
+    """
+
+    def __init__(self, prefix: str = "velib_"):
+        self.prefix = prefix
+        self.families: Dict[str, tuple] = {}            # name -> (kind, help, bounds)
+        self.series: Dict[str, dict] = {}               # name -> {labels tuple: value | LatencyHistogram}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str) -> None:
+        self.families[name] = ("counter", help, None)
+        self.series.setdefault(name, {})
+
+    def histogram(self, name: str, help: str, bounds: Sequence[float] = DEFAULT_BOUNDS) -> None:
+        self.families[name] = ("histogram", help, tuple(bounds))
+        self.series.setdefault(name, {})
+
+    def get(self, name: str, **labels) -> LatencyHistogram:
+        key = tuple(labels.items())
+        fam = self.series[name]
+        h = fam.get(key)
+        if h is None:
+            with self._lock:
+                h = fam.setdefault(key, LatencyHistogram(self.families[name][2]))
+        return h
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        self.get(name, **labels).observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = tuple(labels.items())
+        with self._lock:
+            fam = self.series[name]
+            fam[key] = fam.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        out = []
+        for name, (kind, help, _) in self.families.items():
+            series = [(dict(k), v) for k, v in list(self.series[name].items())]
+            out += prometheus_lines(self.prefix + name, kind, help, series)
+        return out
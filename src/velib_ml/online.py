@@ -0,0 +1,212 @@
+# src/velib_ml/online.py
+# Serving-side feature state (NumPy only, no pandas): time features and a
+# per-station ring buffer of 5-min occupancy slots, updated in O(1) per observation.
+from __future__ import annotations
+import threading
+import numpy as np
+from .config import FREQ_MIN, LAG_STEPS, ROLL_STEPS, DELTA_STEPS, EMA_ALPHAS
+
+RING_SLOTS = max(ROLL_STEPS) + 2  # current slot + longest window + the slot leaving it
+
+
+def occupancy(bikes, capacity) -> np.ndarray:
+    # float32 like load_timeseries, so deltas/thresholds see the same values as in training
+    bikes, capacity = np.asarray(bikes, dtype="float64"), np.asarray(capacity, dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        occ = np.clip(bikes / capacity, 0.0, 1.0)
+    return np.where(capacity > 0, occ, 0.0).astype("float32")
+
+
+def time_features(epoch_s) -> dict:
+    """Same calendar features as make_features, from UTC epoch seconds."""
+    secs = np.floor(np.asarray(epoch_s, dtype="float64")).astype("int64")
+    h = (secs // 3600) % 24
+    d = (secs // 86400 + 3) % 7  # 1970-01-01 was a Thursday (dayofweek=3)
+    return {
+        "hour_sin":  np.sin(2*np.pi*h/24),
+        "hour_cos":  np.cos(2*np.pi*h/24),
+        "hour_sin2": np.sin(4*np.pi*h/24),
+        "hour_cos2": np.cos(4*np.pi*h/24),
+        "dow": d,
+        "hour": h,
+        "is_weekend": (d >= 5).astype("int64"),
+    }
+
+
+def feature_matrix(inputs: dict, feat_cols, weather: dict, encodings=None) -> np.ndarray:
+    """float32 (n, len(feat_cols)) matrix in model order from columnar inputs.
+
+    `inputs` holds station_id, occ_now, ts (epoch s) and the history features
+    (StationStateStore.features or client rows). sta_* come from the exported
+    `encodings` when given, else (and for unknown stations) occ_now; columns
+    found nowhere stay 0.0.
+    """
+    tf = time_features(inputs["ts"])
+    base = {**inputs, **tf, **weather}
+    occ_now = inputs["occ_now"]
+    if encodings is not None and "sta_hdh_occ" in feat_cols:
+        mean, hdh = encodings.lookup(inputs["station_id"], tf["dow"], tf["hour"])
+        base["sta_mean_occ"] = np.where(np.isnan(mean), occ_now, mean)
+        base["sta_hdh_occ"] = np.where(np.isnan(hdh), occ_now, hdh)
+    base.setdefault("sta_mean_occ", occ_now)
+    base.setdefault("sta_hdh_occ", occ_now)
+    X = np.zeros((len(occ_now), len(feat_cols)), dtype="float32")
+    for j, c in enumerate(feat_cols):
+        if c in base:
+            X[:, j] = base[c]
+    return X
+
+
+class StationStateStore:
+    """Rolling 5-min occupancy state per station.
+
+    Each station owns a row of a (n_stations, RING_SLOTS) float32 ring buffer.
+    Observations are bucketed into FREQ_MIN slots: a newer observation in the
+    current slot overwrites it, a later slot pushes (missing slots in between
+    carry the last value forward), an older one is ignored. Running sums of the
+    rolling windows and the EMAs only look at past slots, so each push updates
+    them in O(1) and reading features never rescans the history.
+    Features follow make_features: a lag/roll is NaN until the station has
+    enough past slots, like the first rows of each station in training.
+    """
+
+    def __init__(self, n_slots: int = RING_SLOTS, freq_min: int = FREQ_MIN, reserve: int = 2048):
+        self.n_slots = max(int(n_slots), RING_SLOTS)
+        self.slot_s = int(freq_min) * 60
+        self.index: dict[str, int] = {}
+        self.station_ids: list[str] = []
+        self._lock = threading.Lock()
+        self._alloc(reserve)
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    def _alloc(self, n: int) -> None:
+        specs = {  # name: (fill, dtype, trailing shape)
+            "buf":      (np.nan, "float32", (self.n_slots,)),
+            "pos":      (0, "int32", ()),
+            "slot":     (-1, "int64", ()),       # absolute slot of the current value, -1 = empty
+            "n_seen":   (0, "int32", ()),        # slots in history, current included
+            "bikes":    (np.nan, "float32", ()),
+            "capacity": (np.nan, "float32", ()),
+            "ts":       (np.nan, "float64", ()), # epoch seconds of the last observation
+            "sums":     (0.0, "float64", (len(ROLL_STEPS),)),
+            "ema":      (np.nan, "float64", (len(EMA_ALPHAS),)),
+        }
+        for name, (fill, dtype, shape) in specs.items():
+            arr = np.full((n, *shape), fill, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                arr[:len(old)] = old
+            setattr(self, name, arr)
+
+    def lookup(self, station_ids) -> np.ndarray:
+        """Row of each station in the store, -1 when unknown."""
+        return np.array([self.index.get(str(s), -1) for s in station_ids], dtype="int64")
+
+    def _rows(self, station_ids) -> np.ndarray:
+        idx = np.empty(len(station_ids), dtype="int64")
+        for i, s in enumerate(station_ids):
+            s = str(s)
+            j = self.index.get(s)
+            if j is None:
+                j = self.index[s] = len(self.station_ids)
+                self.station_ids.append(s)
+            idx[i] = j
+        if len(self.station_ids) > len(self.buf):
+            self._alloc(max(len(self.station_ids), 2 * len(self.buf)))
+        return idx
+
+    def update(self, station_ids, bikes, capacity, epoch_s) -> int:
+        """Ingest one observation per entry; returns how many were applied (not stale)."""
+        bikes = np.asarray(bikes, dtype="float64")
+        capacity = np.asarray(capacity, dtype="float64")
+        epoch_s = np.broadcast_to(np.asarray(epoch_s, dtype="float64"), bikes.shape)
+        ok = np.isfinite(bikes) & np.isfinite(capacity) & np.isfinite(epoch_s)
+        station_ids = [s for s, v in zip(station_ids, ok) if v]
+        bikes, capacity, epoch_s = bikes[ok], capacity[ok], epoch_s[ok]
+        with self._lock:
+            idx = self._rows(station_ids)
+            # repeated stations in one call are applied in time order, one round each
+            order = np.lexsort((epoch_s, idx))
+            first = np.r_[True, idx[order][1:] != idx[order][:-1]]
+            rank = np.empty(len(idx), dtype="int64")
+            rank[order] = np.arange(len(idx)) - np.maximum.accumulate(np.where(first, np.arange(len(idx)), 0))
+            applied = 0
+            for r in range(int(rank.max()) + 1 if len(idx) else 0):
+                m = rank == r
+                applied += self._apply(idx[m], bikes[m], capacity[m], epoch_s[m])
+            return applied
+
+    def update_from_snapshot(self, df) -> int:
+        """Ingest a collector snapshot (scripts/collect_velib_gbfs.py output)."""
+        import pandas as pd
+        ts = pd.to_datetime(df["snapshot_ts"], utc=True).to_numpy().astype("datetime64[ns]").astype("int64") / 1e9
+        return self.update(df["station_id"].astype(str).to_numpy(),
+                           df["num_bikes_available"].to_numpy(dtype="float64"),
+                           df["capacity"].to_numpy(dtype="float64"), ts)
+
+    def _apply(self, idx, bikes, capacity, epoch_s) -> int:
+        occ = occupancy(bikes, capacity)
+        new_slot = np.floor(epoch_s / self.slot_s).astype("int64")
+        cur = self.slot[idx]
+        steps = new_slot - cur
+        fresh = (cur < 0) | (steps >= self.n_slots)   # unknown, or history too old to keep
+        # same slot: only a newer observation replaces the current one (late / replayed rows are stale)
+        keep = fresh | (steps > 0) | ((steps == 0) & (epoch_s >= self.ts[idx]))
+
+        f = idx[fresh]
+        self.buf[f] = np.nan
+        self.pos[f] = 0
+        self.n_seen[f] = 1
+        self.sums[f] = 0.0
+        self.ema[f] = np.nan
+        self.slot[f] = new_slot[fresh]
+
+        push = ~fresh & (steps > 0)
+        for j in range(1, int(steps[push].max()) + 1 if push.any() else 1):
+            m = push & (steps >= j)
+            self._push(idx[m], np.where(steps[m] == j, occ[m], self.buf[idx[m], self.pos[idx[m]]]))
+
+        k = idx[keep]
+        self.buf[k, self.pos[k]] = occ[keep]
+        self.bikes[k] = bikes[keep]
+        self.capacity[k] = capacity[keep]
+        self.ts[k] = epoch_s[keep]
+        return int(keep.sum())
+
+    def _push(self, i, value) -> None:
+        R = self.n_slots
+        prev = self.buf[i, self.pos[i]].astype("float64")          # becomes lag 1
+        for w, n in enumerate(ROLL_STEPS):
+            leaving = self.buf[i, (self.pos[i] - n) % R].astype("float64")
+            self.sums[i, w] += prev - np.where(self.n_seen[i] > n, leaving, 0.0)
+        for e, a in enumerate(EMA_ALPHAS.values()):
+            old = self.ema[i, e]
+            self.ema[i, e] = np.where(np.isnan(old), prev, a * prev + (1 - a) * old)
+        self.pos[i] = (self.pos[i] + 1) % R
+        self.buf[i, self.pos[i]] = value
+        self.n_seen[i] += 1
+        self.slot[i] += 1
+
+    def features(self, idx, occ_now=None) -> dict:
+        """History features for store rows `idx`; `occ_now` overrides the stored current value."""
+        idx = np.asarray(idx, dtype="int64")
+        with self._lock:
+            pos, past = self.pos[idx], self.n_seen[idx] - 1
+            now = self.buf[idx, pos] if occ_now is None else np.asarray(occ_now, dtype="float32")
+            def lag(k): return np.where(past >= k, self.buf[idx, (pos - k) % self.n_slots], np.nan)
+            out = {"occ_now": now}
+            for k in LAG_STEPS:
+                out[f"occ_lag_{k*FREQ_MIN}"] = lag(k)
+            for w, n in enumerate(ROLL_STEPS):
+                out[f"occ_roll_{n*FREQ_MIN}"] = np.where(past >= n, self.sums[idx, w] / n, np.nan)
+            for k in DELTA_STEPS:
+                out[f"occ_delta_{k*FREQ_MIN}"] = now - lag(k)
+            for e, name in enumerate(EMA_ALPHAS):
+                out[name] = self.ema[idx, e].copy()
+            out["occ_momentum"] = out["occ_ema_fast"] - out["occ_ema_slow"]
+            out["bikes_available"] = self.bikes[idx].astype("float64")
+            out["capacity"] = self.capacity[idx].astype("float64")
+            out["ts"] = self.ts[idx].copy()
+        return out
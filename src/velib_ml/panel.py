@@ -0,0 +1,212 @@
+# src/velib_ml/panel.py
+# Dense station × time occupancy panel on the fixed FREQ_MIN grid. Lags, deltas and
+# targets are column-shifted views of one padded array, so "k steps back" always
+# means k * FREQ_MIN minutes back, gaps included.
+from __future__ import annotations
+import json
+from pathlib import Path
+from typing import Sequence
+import numpy as np
+import pandas as pd
+
+from .config import FREQ_MIN, HORIZONS, LAG_STEPS, ROLL_STEPS, DELTA_STEPS, EMA_ALPHAS
+from .features import _calendar, _seg_ema_past, _station_order
+
+PAD_PAST = max(LAG_STEPS + ROLL_STEPS + DELTA_STEPS)
+PAD_FUTURE = max(HORIZONS) // FREQ_MIN
+ROLL_BLOCK = 1 << 22  # cells per block in roll_mean (~100 MB of temporaries)
+
+
+class StationPanel:
+    """occ as float32 (n_stations, n_steps) + validity mask + per-station capacity.
+
+    The occupancy lives in `data`, padded with PAD_PAST NaN columns before the
+    grid and PAD_FUTURE after it; `occ`, `lag(k)` and `lead(k)` are views into
+    it (no copies). Rolling means run on cumulative sums of a block of stations
+    at a time, so a mapped panel is never copied whole.
+    `save()` writes plain .npy files, `load(mmap=True)` maps them read-only so
+    several processes share one copy through the page cache.
+    """
+
+    def __init__(self, data: np.ndarray, mask: np.ndarray, capacity: np.ndarray,
+                 station_ids: Sequence[str], t0: int, freq_min: int = FREQ_MIN,
+                 pad_past: int = PAD_PAST, pad_future: int = PAD_FUTURE):
+        self.data = data
+        self.mask = mask
+        self.capacity = capacity
+        self.station_ids = np.asarray([str(s) for s in station_ids], dtype=object)
+        self.t0 = int(t0)                     # epoch seconds of grid column 0
+        self.freq_min = int(freq_min)
+        self.pad_past, self.pad_future = int(pad_past), int(pad_future)
+        self.n_steps = data.shape[1] - self.pad_past - self.pad_future
+
+    # ---- construction ----
+    @classmethod
+    def from_timeseries(cls, df: pd.DataFrame, freq_min: int = FREQ_MIN) -> "StationPanel":
+        """From load_timeseries output (ts, station_id, capacity, occ); last row wins per slot."""
+        order, key, ids = _station_order(df)         # ids[key]: labels in the key's own order
+        if order is not None:
+            df, key = df.take(order), key[order]
+        step = freq_min * 60
+        secs = np.asarray(df["ts"].values).astype("datetime64[s]").astype("int64")
+        t0 = int(secs.min()) // step * step if len(secs) else 0
+        slot = (secs - t0) // step
+        n_t = int(slot.max()) + 1 if len(slot) else 0
+        # rows sorted by (station, ts): the last row of each (station, slot) run wins
+        cell = key.astype("int64") * n_t + slot
+        last = np.r_[cell[1:] != cell[:-1], True] if len(cell) else np.zeros(0, bool)
+        sta, slot = key[last], slot[last]
+
+        P, H = PAD_PAST, PAD_FUTURE
+        data = np.full((len(ids), P + n_t + H), np.nan, dtype="float32")
+        data[sta, P + slot] = df["occ"].to_numpy(dtype="float32")[last]
+        mask = np.zeros((len(ids), n_t), dtype=bool)
+        mask[sta, slot] = True
+        capacity = np.full(len(ids), np.nan, dtype="float32")
+        capacity[sta] = df["capacity"].to_numpy(dtype="float32")[last]      # latest capacity seen
+        keep = np.isfinite(capacity)
+        return cls(data[keep], mask[keep], capacity[keep], np.asarray(ids.astype(str))[keep], t0, freq_min)
+
+    @classmethod
+    def from_snapshot_store(cls, store, start, end, freq_min: int = FREQ_MIN) -> "StationPanel":
+        """From a SnapshotStore range, via the same 5-min alignment as read_timeseries."""
+        from .data import clean_timeseries
+        return cls.from_timeseries(clean_timeseries(store.read_timeseries(start, end, freq_min=freq_min)), freq_min)
+
+    # ---- persistence ----
+    def save(self, path) -> Path:
+        d = Path(path)
+        d.mkdir(parents=True, exist_ok=True)
+        np.save(d / "occ.npy", np.ascontiguousarray(self.data))
+        np.save(d / "mask.npy", np.ascontiguousarray(self.mask))
+        np.save(d / "capacity.npy", np.ascontiguousarray(self.capacity))
+        meta = {"station_ids": self.station_ids.tolist(), "t0": self.t0, "freq_min": self.freq_min,
+                "pad_past": self.pad_past, "pad_future": self.pad_future}
+        (d / "meta.json").write_text(json.dumps(meta))
+        return d
+
+    @classmethod
+    def load(cls, path, mmap: bool = True) -> "StationPanel":
+        d = Path(path)
+        mode = "r" if mmap else None
+        meta = json.loads((d / "meta.json").read_text())
+        return cls(np.load(d / "occ.npy", mmap_mode=mode), np.load(d / "mask.npy", mmap_mode=mode),
+                   np.load(d / "capacity.npy", mmap_mode=mode), meta["station_ids"], meta["t0"],
+                   meta["freq_min"], meta["pad_past"], meta["pad_future"])
+
+    # ---- grid ----
+    @property
+    def n_stations(self) -> int:
+        return self.data.shape[0]
+
+    @property
+    def step_s(self) -> int:
+        return self.freq_min * 60
+
+    @property
+    def times(self) -> pd.DatetimeIndex:
+        return pd.to_datetime(self.t0 + self.step_s * np.arange(self.n_steps), unit="s", utc=True)
+
+    def time_slice(self, start=None, end=None) -> slice:
+        """Grid columns with start <= t < end."""
+        t = lambda x: (pd.Timestamp(x).tz_localize("UTC") if pd.Timestamp(x).tzinfo is None
+                       else pd.Timestamp(x)).value // 10**9
+        i0 = 0 if start is None else int(np.clip(-(-(t(start) - self.t0) // self.step_s), 0, self.n_steps))
+        i1 = self.n_steps if end is None else int(np.clip(-(-(t(end) - self.t0) // self.step_s), 0, self.n_steps))
+        return slice(i0, i1)
+
+    # ---- views ----
+    @property
+    def occ(self) -> np.ndarray:
+        return self.data[:, self.pad_past:self.pad_past + self.n_steps]
+
+    def lag(self, k: int) -> np.ndarray:
+        """occ k steps earlier (view); NaN where that cell is missing or before the grid."""
+        if not 0 <= k <= self.pad_past:
+            raise ValueError(f"lag {k} outside the panel padding (0..{self.pad_past})")
+        return self.data[:, self.pad_past - k:self.pad_past - k + self.n_steps]
+
+    def lead(self, k: int) -> np.ndarray:
+        """occ k steps later (view): the target at horizon k * freq_min."""
+        if not 0 <= k <= self.pad_future:
+            raise ValueError(f"lead {k} outside the panel padding (0..{self.pad_future})")
+        return self.data[:, self.pad_past + k:self.pad_past + k + self.n_steps]
+
+    def target(self, h: int) -> np.ndarray:
+        return self.lead(h // self.freq_min)
+
+    def delta(self, k: int) -> np.ndarray:
+        return self.occ - self.lag(k)
+
+    def roll_mean(self, n: int) -> np.ndarray:
+        """Mean of the n previous cells (shift(1).rolling(n).mean()); NaN if any is missing."""
+        if not 1 <= n <= self.pad_past:
+            raise ValueError(f"window {n} outside the panel padding (1..{self.pad_past})")
+        P, T = self.pad_past, self.n_steps
+        out = np.empty((self.n_stations, T), dtype="float32")
+        # cumulative sums per block of stations: temporaries stay ~ROLL_BLOCK cells, not panel-sized
+        rows = max(1, ROLL_BLOCK // self.data.shape[1])
+        for i in range(0, self.n_stations, rows):
+            blk = np.asarray(self.data[i:i + rows])
+            nan = np.isnan(blk)
+            csum = np.zeros((len(blk), blk.shape[1] + 1))
+            np.cumsum(np.where(nan, 0.0, blk), axis=1, dtype="float64", out=csum[:, 1:])
+            cnan = np.zeros(csum.shape, dtype="int32")
+            np.cumsum(nan, axis=1, dtype="int32", out=cnan[:, 1:])
+            o = out[i:i + rows]
+            o[:] = (csum[:, P:P + T] - csum[:, P - n:P - n + T]) / n
+            o[cnan[:, P:P + T] != cnan[:, P - n:P - n + T]] = np.nan
+        return out
+
+    def ema(self, alpha: float) -> np.ndarray:
+        """shift(1).ewm(alpha, adjust=False).mean() along time; missing cells decay the weight."""
+        flat = np.ascontiguousarray(self.occ).reshape(-1)
+        T = self.n_steps
+        starts = np.arange(self.n_stations, dtype="int64") * T
+        lens = np.full(self.n_stations, T, dtype="int64")
+        return _seg_ema_past(flat, alpha, starts, lens).astype("float32").reshape(self.n_stations, T)
+
+    # ---- long format ----
+    def feature_frame(self, use_ema: bool = False, start=None, end=None) -> pd.DataFrame:
+        """make_features columns for every observed cell, sorted by (station_id, ts).
+
+        Same column set as features.make_features, computed on the grid: lags and
+        windows skip over missing snapshots by time, not by row. `capacity` is the
+        station's latest capacity.
+        """
+        cols = self.time_slice(start, end)
+        sta, t = np.nonzero(self.mask[:, cols])
+        t = t + cols.start
+        take = lambda a: np.asarray(a[sta, t], dtype="float32")
+        secs = self.t0 + self.step_s * t
+        ts = pd.Series(pd.to_datetime(secs, unit="s", utc=True))
+        cap = np.asarray(self.capacity, dtype="float32")[sta]
+        occ = take(self.occ)
+        feat = pd.DataFrame({
+            "ts": ts,
+            "station_id": pd.Categorical.from_codes(sta, categories=self.station_ids.astype(str)),
+            "capacity": cap,
+            "occ": occ,
+        })
+        hour, dow = _calendar(ts)
+        h24 = np.arange(24)
+        feat["hour"] = hour
+        feat["dow"] = dow
+        feat["is_weekend"] = (dow >= 5).astype("uint8")
+        feat["hour_sin"] = np.sin(2*np.pi*h24/24).astype("float32")[hour]
+        feat["hour_cos"] = np.cos(2*np.pi*h24/24).astype("float32")[hour]
+        feat["hour_sin2"] = np.sin(4*np.pi*h24/24).astype("float32")[hour]
+        feat["hour_cos2"] = np.cos(4*np.pi*h24/24).astype("float32")[hour]
+        for k in LAG_STEPS:
+            feat[f"occ_lag_{k*FREQ_MIN}"] = take(self.lag(k))
+        for n in ROLL_STEPS:
+            feat[f"occ_roll_{n*FREQ_MIN}"] = take(self.roll_mean(n))
+        for k in DELTA_STEPS:
+            feat[f"occ_delta_{k*FREQ_MIN}"] = occ - take(self.lag(k))
+        if use_ema:
+            for name, a in EMA_ALPHAS.items():
+                feat[name] = take(self.ema(a))
+            feat["occ_momentum"] = (feat["occ_ema_fast"] - feat["occ_ema_slow"]).astype("float32")
+        for h in HORIZONS:
+            feat[f"occ_{h}"] = take(self.target(h))
+        return feat
@@ -0,0 +1,98 @@
+# src/velib_ml/profiling.py
+# Opt-in sampling profiler for slow requests. While tracked requests are running, a
+# daemon thread reads their stacks (sys._current_frames) every `interval_s`; a request
+# that ends slower than `slow_s` gets its samples written in collapsed-stack format
+# ("root;caller;callee count" per line), ready for flamegraph.pl, inferno or speedscope.
+# With nothing tracked the thread just waits on an Event.
+from __future__ import annotations
+import random, re, sys, threading, time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def collapse(frame) -> str:
+    """'outer;...;inner' for one thread's current frame (function, file, first line)."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})".replace(";", ":"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of tracked requests; dumps those slower than `slow_s` to `out_dir`.
+
+    `sample_rate` is the fraction of requests tracked at all (the rest pay
+    nothing); at most `max_files` dumps are written per process.
+    """
+
+    def __init__(self, out_dir, slow_s: float = 0.25, interval_s: float = 0.005,
+                 sample_rate: float = 1.0, max_files: int = 200):
+        self.out_dir = Path(out_dir)
+        self.slow_s = float(slow_s)
+        self.interval_s = float(interval_s)
+        self.sample_rate = float(sample_rate)
+        self.max_files = int(max_files)
+        self.tracked = 0
+        self.dumped = 0
+        self._active: Dict[int, Counter] = {}          # thread ident -> stack counts
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="slow-request-profiler", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            self._wake.wait()
+            with self._lock:
+                active = list(self._active.items())
+            frames = sys._current_frames()
+            for tid, stacks in active:
+                f = frames.get(tid)
+                if f is not None:
+                    stacks[collapse(f)] += 1
+            del frames
+            time.sleep(self.interval_s)
+
+    @contextmanager
+    def track(self, name: str):
+        """Profile the calling thread for the duration of the block (if sampled)."""
+        if random.random() >= self.sample_rate or self.dumped >= self.max_files:
+            yield
+            return
+        tid, stacks = threading.get_ident(), Counter()
+        with self._lock:
+            self._active[tid] = stacks
+            self._wake.set()
+        self._ensure_thread()
+        self.tracked += 1
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:
+                self._active.pop(tid, None)
+                if not self._active:
+                    self._wake.clear()
+            if dt >= self.slow_s and stacks:
+                self.dump(name, dt, stacks)
+
+    def dump(self, name: str, seconds: float, stacks: Counter) -> Path:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_")
+        path = self.out_dir / f"{time.strftime('%Y%m%dT%H%M%S')}_{slug}_{seconds * 1e3:.0f}ms_{self.dumped:03d}.folded"
+        path.write_text("".join(f"{s} {n}\n" for s, n in stacks.most_common()))
+        self.dumped += 1
+        return path
+
+    def status(self) -> dict:
+        return {"profiler_dir": str(self.out_dir), "profiler_slow_ms": self.slow_s * 1e3,
+                "profiled_requests": self.tracked, "profiles_written": self.dumped}
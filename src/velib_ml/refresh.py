@@ -0,0 +1,187 @@
+# src/velib_ml/refresh.py
+# Incremental refresh of a saved artifact set: features only for the recent window
+# (plus the halo rows the windows need), then per horizon either continue boosting
+# from the saved booster (init_model) or refit its leaf values, re-calibrate gamma,
+# and write a new versioned artifact dir next to the source one.
+from __future__ import annotations
+import json, shutil, time
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+
+from .config import FREQ_MIN, HORIZONS, SPLIT_TRAINVAL
+from .training import EARLY_STOPPING, LGB_PARAMS, _calibrate_gamma
+
+MODES = ("continue", "refit")
+
+
+def _utc(t) -> Optional[pd.Timestamp]:
+    if t is None:
+        return None
+    t = pd.Timestamp(t)
+    return t.tz_localize("UTC") if t.tzinfo is None else t.tz_convert("UTC")
+
+
+def load_artifacts(path):
+    """(boosters by horizon, feat_cols, config) from a train.py / refresh artifact dir."""
+    d = Path(path)
+    cfg = json.loads((d / "config.json").read_text())
+    feat_cols = json.loads((d / "feat_cols_delta.json").read_text())
+    if cfg.get("multi_horizon"):
+        raise ValueError(f"{d}: multi-horizon model (train.py --multi-horizon), refresh only updates per-horizon models")
+    horizons = [int(h) for h in cfg.get("horizons", HORIZONS)]
+    models = {h: lgb.Booster(model_file=str(d / f"lgbm_delta_h{h}.txt")) for h in horizons}
+    return models, feat_cols, cfg
+
+
+def load_recent(src, start, end=None) -> pd.DataFrame:
+    """load_timeseries-like frame restricted to start <= ts < end.
+
+    `src` is a SnapshotStore root (only the overlapping days are opened), a
+    Parquet file/dir or a CSV (streamed in chunks, older rows dropped).
+    """
+    from .data import clean_timeseries
+    p = Path(src)
+    start, end = _utc(start), _utc(end)
+    if (p / "_staging").is_dir():
+        from .snapshot_store import SnapshotStore
+        return clean_timeseries(SnapshotStore(p).read_timeseries(start, end))
+    from .chunked import iter_raw_chunks
+    keep = []
+    for c in iter_raw_chunks(p):
+        c = c[(c["ts"] >= start) & ((c["ts"] < end) if end is not None else True)]
+        if len(c):
+            keep.append(c)
+    df = pd.concat(keep, ignore_index=True) if keep else pd.DataFrame(columns=["ts","station_id","bikes_available","capacity"])
+    df["station_id"] = df["station_id"].astype(str).astype("category")
+    return clean_timeseries(df)
+
+
+def recent_features(src, start, feat_cols, end=None, weather_5min: Optional[pd.DataFrame] = None,
+                    encodings=None) -> pd.DataFrame:
+    """make_features for rows with ts >= start, computed from start minus the halo.
+
+    Models using station encodings get the artifact's exported tables (kept as
+    they were fitted on the training history).
+    """
+    from .chunked import halo_past
+    from .features import attach_station_encodings, make_features
+    use_ema = "occ_ema_fast" in feat_cols
+    use_sta = any(c.startswith("sta_") for c in feat_cols)
+    if use_sta and encodings is None:
+        raise ValueError("artifacts use station encodings (sta_*) but have no station_encodings.npz: retrain instead")
+    start = _utc(start)
+    halo = pd.Timedelta(minutes=(halo_past(use_ema) + 1) * FREQ_MIN)
+    feat = make_features(load_recent(src, start - halo, end), use_ema=use_ema)
+    if weather_5min is not None:
+        from .weather import add_weather
+        feat = add_weather(feat, weather_5min)
+    feat = feat[feat["ts"] >= start].reset_index(drop=True)
+    if use_sta:
+        feat = attach_station_encodings(feat, encodings)
+    feat["occ_now"] = feat["occ"].astype("float32")
+    return feat
+
+
+def refresh_horizons(models: Dict[int, lgb.Booster], feat: pd.DataFrame, feat_cols: Sequence[str],
+                     gammas: Dict[str, float], mode: str = "continue", rounds: int = 100,
+                     decay_rate: float = 0.9, params: Optional[dict] = None, num_threads: int = 2,
+                     gamma_grid=(0.5, 0.7, 0.9, 1.0), keep_better: bool = True) -> dict:
+    """Refresh each horizon's booster on `feat` (recent rows with complete features).
+
+    The window is cut in time at SPLIT_TRAINVAL: the first part is boosted on
+    (`continue`: up to `rounds` new trees from the saved booster, early stopped
+    on the second part) or used to refit the leaf values (`refit`, blended
+    with `decay_rate` of the old ones); the second part calibrates gamma and
+    compares old vs new MAE in bikes. With `keep_better`, a horizon whose
+    refreshed model does worse on that part keeps its old booster and gamma.
+    Returns {h: dict(model, gamma, mae_old, mae_new, mae_naive, kept, n_fit, n_val, train_s, best_iter)}.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    feat_cols = list(feat_cols)
+    tr = feat.dropna(subset=list(dict.fromkeys(feat_cols + ["occ_now", "capacity"])))
+    X = tr[feat_cols].to_numpy(dtype="float32")
+    ts = tr["ts"]
+    occ_now, cap = tr["occ_now"].to_numpy(), tr["capacity"].to_numpy()
+    p = dict(LGB_PARAMS, num_threads=num_threads, **(params or {}))
+    out = {}
+    for h, old in models.items():
+        y_occ = tr[f"occ_{h}"].to_numpy(dtype="float32")
+        ok = np.isfinite(y_occ)
+        if ok.sum() < 2:
+            raise ValueError(f"no labelled rows for h={h} in the refresh window")
+        cut = ts[ok].quantile(SPLIT_TRAINVAL)
+        fit = np.flatnonzero(ok & (ts <= cut).to_numpy())
+        val = np.flatnonzero(ok & (ts > cut).to_numpy())
+        dy = (y_occ - occ_now).astype("float32")
+        t0 = time.time()
+        if mode == "continue":
+            dtrain = lgb.Dataset(X[fit], label=dy[fit], feature_name=feat_cols, params={"verbosity": -1})
+            dval = lgb.Dataset(X[val], label=dy[val], reference=dtrain)
+            model = lgb.train(p, dtrain, num_boost_round=rounds, init_model=old, valid_sets=[dval],
+                              valid_names=["val"], keep_training_booster=True,
+                              callbacks=[lgb.early_stopping(stopping_rounds=min(EARLY_STOPPING, rounds), verbose=False)])
+            best_iter = int(model.best_iteration or model.current_iteration())
+        else:
+            model = old.refit(X[fit], dy[fit], decay_rate=decay_rate, num_threads=num_threads)
+            best_iter = int(model.current_iteration())
+        secs = time.time() - t0
+
+        cv, y_true = cap[val], y_occ[val] * cap[val]
+        g_new, mae_new = _calibrate_gamma(model.predict(X[val], num_iteration=best_iter), occ_now[val], cv,
+                                          y_true, gamma_grid)
+        g_old = float(gammas.get(str(h), 1.0))
+        mae_old = float(np.abs(np.clip(occ_now[val] + g_old * old.predict(X[val]), 0, 1) * cv - y_true).mean())
+        kept = keep_better and mae_new > mae_old
+        out[h] = dict(model=old if kept else model, best_iter=None if kept else best_iter,
+                      gamma=g_old if kept else float(g_new), mae_old=mae_old, mae_new=float(mae_new),
+                      mae_naive=float(np.abs(occ_now[val] * cv - y_true).mean()), kept=bool(kept),
+                      n_fit=int(len(fit)), n_val=int(len(val)), train_s=float(secs))
+    return out
+
+
+def version_name(parent: str, data_end) -> str:
+    """<base>.r<YYYYmmddHHMM of the last data>; refreshing a refresh keeps the base name."""
+    return f"{parent.split('.r')[0]}.r{_utc(data_end):%Y%m%d%H%M}"
+
+
+def save_refreshed(src_dir, out_dir, results: dict, feat_cols: Sequence[str], cfg: dict,
+                   data_end, info: dict, sample: Optional[pd.DataFrame] = None) -> Path:
+    """Write a complete artifact set (models, feat_cols, config, metrics) into a new dir."""
+    src, out = Path(src_dir), Path(out_dir)
+    if out.resolve() == src.resolve():
+        raise ValueError("refusing to overwrite the source artifact dir")
+    tmp = out.with_name("." + out.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    horizons = sorted(results)
+    for h in horizons:
+        results[h]["model"].save_model(str(tmp / f"lgbm_delta_h{h}.txt"), num_iteration=results[h]["best_iter"])
+    (tmp / "feat_cols_delta.json").write_text(json.dumps(list(feat_cols)))
+    new_cfg = dict(cfg, horizons=horizons, gammas={str(h): results[h]["gamma"] for h in horizons},
+                   data_end_ts=_utc(data_end).isoformat(), parent=src.name,
+                   created_at=pd.Timestamp.now(tz="UTC").isoformat(), refresh=info)
+    (tmp / "config.json").write_text(json.dumps(new_cfg, indent=2))
+    pd.DataFrame({
+        "horizon_min": horizons,
+        "mae_naive": [results[h]["mae_naive"] for h in horizons],
+        "mae_before": [results[h]["mae_old"] for h in horizons],
+        "mae_model": [results[h]["mae_old" if results[h]["kept"] else "mae_new"] for h in horizons],
+        "kept_previous": [results[h]["kept"] for h in horizons],
+        "train_s": [results[h]["train_s"] for h in horizons],
+        "gamma": [results[h]["gamma"] for h in horizons],
+    }).to_csv(tmp / "metrics.csv", index=False)
+    from .encodings import ENCODINGS_NAME
+    if (src / ENCODINGS_NAME).exists():
+        shutil.copy2(src / ENCODINGS_NAME, tmp / ENCODINGS_NAME)
+    if sample is not None and len(sample):
+        sample.to_csv(tmp / "sample_features.csv", index=False)
+    elif (src / "sample_features.csv").exists():
+        shutil.copy2(src / "sample_features.csv", tmp / "sample_features.csv")
+    if out.exists():
+        shutil.rmtree(out)
+    tmp.rename(out)                       # a watcher never sees a half-written version
+    return out
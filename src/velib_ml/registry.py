@@ -0,0 +1,297 @@
+# src/velib_ml/registry.py
+# In-process model registry for the API: versions are artifact dirs under one root
+# (train.py / refresh.py outputs), loaded and warmed off the request path, then
+# swapped in with a single reference assignment. A few versions stay resident so
+# they can be queried side by side (?version=) or shadow-scored.
+from __future__ import annotations
+import json, os, threading, time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+
+from .encodings import ENCODINGS_NAME, StationEncodings
+from .inference import MULTI_FILE, predict_bikes, predict_bikes_multi
+
+HORIZON_FILES = "lgbm_delta_h*.txt"
+BUNDLE_NAME = "bundle.npz"                # velib_ml.bundle.BUNDLE_NAME, without importing it
+
+
+def _rss_mb() -> Optional[float]:
+    """Current resident set size (MB), None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def booster_loader(backend: str = "lightgbm") -> Callable[[Path], object]:
+    """Model file loader for a serving backend: lgb.Booster for "lightgbm", else CompiledTrees."""
+    if backend != "lightgbm":
+        from .trees import CompiledTrees
+        return CompiledTrees.from_file
+    def load(p: Path):
+        import lightgbm as lgb
+        return lgb.Booster(model_file=str(p))
+    return load
+
+
+def is_version_dir(p: Path) -> bool:
+    if p.name.startswith("."):
+        return False
+    return (p / BUNDLE_NAME).exists() or ((p / "feat_cols_delta.json").exists()
+                                          and ((p / MULTI_FILE).exists() or any(p.glob(HORIZON_FILES))))
+
+
+class ModelVersion:
+    """One artifact dir: boosters by horizon, feature order, gammas, load/warm stats.
+
+    With `prefer_bundle` (or when the dir only holds a bundle) everything comes
+    from `bundle.npz` (velib_ml.bundle): pre-compiled trees, hash-checked.
+    A multi-horizon dir (train.py --multi-horizon) has one model, `multi`,
+    shared by every horizon of its config; `predict_many` scores all of them
+    in one call.
+    """
+
+    def __init__(self, path, loader: Callable[[Path], object], prefer_bundle: bool = False):
+        t0, rss0 = time.perf_counter(), _rss_mb()
+        self.path = Path(path)
+        self.name = self.path.name
+        self.fingerprint = self._fingerprint(self.path)
+        self.models: Dict[int, object] = {}
+        self.multi = None
+        self.sha256: Optional[str] = None
+        bundle = self.path / BUNDLE_NAME
+        text = any(self.path.glob(HORIZON_FILES)) or (self.path / MULTI_FILE).exists()
+        if bundle.exists() and (prefer_bundle or not text):
+            from .bundle import Bundle
+            b = Bundle(bundle)
+            self.feat_cols, self.config, self.gammas = b.feat_cols, b.config, b.gammas
+            self.target_kind, self.models, self.sha256 = b.target_kind, b.models, b.sha256
+            self.multi = b.multi
+            self.encodings = StationEncodings.from_arrays(b.encodings)
+            files = [bundle]
+        else:
+            self.feat_cols: List[str] = json.loads((self.path / "feat_cols_delta.json").read_text())
+            cfg_path = self.path / "config.json"
+            self.config = json.loads(cfg_path.read_text()) if cfg_path.exists() else {}
+            self.target_kind = self.config.get("target_kind", "delta_occ")
+            # train.py writes "gammas"; "gamma" was read before and silently fell back to 1.0
+            self.gammas = {str(k): float(v) for k, v in
+                           self.config.get("gammas", self.config.get("gamma", {})).items()}
+            enc = self.path / ENCODINGS_NAME
+            self.encodings = StationEncodings.load(enc) if enc.exists() else None
+            files = sorted(self.path.glob(HORIZON_FILES))
+            for p in files:
+                self.models[int(p.stem.rsplit("_h", 1)[1])] = loader(p)
+            if (self.path / MULTI_FILE).exists():
+                files.append(self.path / MULTI_FILE)
+                self.multi = loader(files[-1])
+                self.models.update({int(h): self.multi for h in self.config["horizons"]})
+        self.source = "bundle" if self.sha256 else "text"
+        self.load_s = time.perf_counter() - t0
+        self.warm_s = self.warm()
+        rss1 = _rss_mb()
+        self.rss_delta_mb = None if rss0 is None or rss1 is None else max(0.0, rss1 - rss0)
+        self.files_mb = sum(p.stat().st_size for p in files) / 2**20
+        self.loaded_at = time.time()
+        self.requests = 0
+        self.shadow: Dict[int, list] = {}          # h -> [n, sum |Δ bikes| vs active]
+
+    @staticmethod
+    def _fingerprint(p: Path):
+        return tuple(sorted((q.name, q.stat().st_mtime_ns) for q in p.iterdir() if q.is_file()))
+
+    @property
+    def horizons(self) -> List[int]:
+        return sorted(self.models)
+
+    def warm(self) -> float:
+        """One dummy predict per horizon so the first real request pays no lazy init."""
+        t0 = time.perf_counter()
+        X = np.zeros((1, len(self.feat_cols)), dtype="float32")
+        if self.multi is not None:
+            self.multi.predict(np.zeros((1, len(self.feat_cols) + 1), dtype="float32"))
+        for m in self.models.values():
+            if m is not self.multi:
+                m.predict(X)
+        return time.perf_counter() - t0
+
+    def predict(self, h: int, X: np.ndarray, bikes_now: np.ndarray, capacity: np.ndarray):
+        if self.models[h] is self.multi:
+            return self.predict_many([h], X, bikes_now, capacity)[h]
+        return predict_bikes(self.models[h], X, bikes_now, capacity,
+                             gamma=self.gammas.get(str(h), 1.0), target_kind=self.target_kind)
+
+    def predict_many(self, horizons: Sequence[int], X: np.ndarray, bikes_now: np.ndarray, capacity: np.ndarray):
+        """{h: (y_hat, delta)}: one predict call for a multi-horizon model, else one per horizon."""
+        if self.multi is not None and all(self.models[h] is self.multi for h in horizons):
+            return predict_bikes_multi(self.multi, X, list(horizons), bikes_now, capacity,
+                                       self.gammas, self.target_kind)
+        return {h: self.predict(h, X, bikes_now, capacity) for h in horizons}
+
+    def record_shadow(self, h: int, abs_diff: np.ndarray) -> None:
+        acc = self.shadow.setdefault(h, [0, 0.0])
+        acc[0] += int(abs_diff.size)
+        acc[1] += float(abs_diff.sum())
+
+    def status(self) -> dict:
+        return {
+            "path": str(self.path),
+            "source": self.source,
+            "sha256": self.sha256,
+            "horizons": self.horizons,
+            "multi_horizon": self.multi is not None,
+            "n_features": len(self.feat_cols),
+            "station_encodings": len(self.encodings) if self.encodings is not None else None,
+            "gammas": self.gammas,
+            "data_end_ts": self.config.get("data_end_ts"),
+            "load_s": round(self.load_s, 3),
+            "warm_s": round(self.warm_s, 4),
+            "rss_delta_mb": None if self.rss_delta_mb is None else round(self.rss_delta_mb, 1),
+            "model_files_mb": round(self.files_mb, 2),
+            "loaded_at": self.loaded_at,
+            "requests": self.requests,
+            "shadow_mae_vs_active": {str(h): round(s / n, 4) for h, (n, s) in self.shadow.items() if n},
+        }
+
+
+class ModelRegistry:
+    """Versions found under `root`, at most `keep` resident, one active.
+
+    `root` is either a directory of artifact dirs (newest = latest config
+    `created_at`, else mtime) or a single artifact dir. A background thread
+    (`start()`) rescans every `poll_s`: a new or rewritten version is loaded
+    and warmed on that thread, then becomes active by rebinding `self.active`,
+    so in-flight requests finish on the version they started with. With `pin`
+    set, only that version is activated automatically.
+    """
+
+    def __init__(self, root, loader: Callable[[Path], object], keep: int = 2,
+                 poll_s: float = 30, pin: Optional[str] = None,
+                 on_swap: Optional[Callable[["ModelVersion"], None]] = None, prefer_bundle: bool = False):
+        self.root = Path(root)
+        self.loader = loader
+        self.prefer_bundle = prefer_bundle
+        self.keep = max(1, int(keep))
+        self.poll_s = float(poll_s)
+        self.pin = pin
+        self.on_swap = on_swap
+        self.resident: "OrderedDict[str, ModelVersion]" = OrderedDict()
+        self.active: Optional[ModelVersion] = None
+        self.swaps = 0
+        self.last_error: Optional[str] = None
+        self.last_scan = 0.0
+        self._lock = threading.Lock()                # loads/swaps only; readers never take it
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- discovery ----
+    def scan(self) -> List[Path]:
+        """Version dirs, oldest first."""
+        if is_version_dir(self.root):
+            return [self.root]
+        if not self.root.is_dir():
+            return []
+        dirs = [p for p in self.root.iterdir() if p.is_dir() and is_version_dir(p)]
+        def created(p: Path):
+            try:
+                c = json.loads((p / "config.json").read_text()).get("created_at")
+            except (OSError, ValueError):
+                c = None
+            return (c or "", p.stat().st_mtime)
+        return sorted(dirs, key=created)
+
+    def _target(self, dirs: Sequence[Path]) -> Optional[Path]:
+        if self.pin:
+            return next((p for p in dirs if p.name == self.pin), None)
+        return dirs[-1] if dirs else None
+
+    # ---- load / swap ----
+    def load(self, path, activate: bool = True) -> ModelVersion:
+        """Load + warm `path` (outside the lock), then register it and optionally activate it."""
+        mv = ModelVersion(path, self.loader, self.prefer_bundle)
+        if not mv.models:
+            raise FileNotFoundError(f"No LightGBM models found in {path}")
+        with self._lock:
+            self.resident.pop(mv.name, None)
+            self.resident[mv.name] = mv
+            if activate:
+                self._activate(mv)
+            self._evict()
+        return mv
+
+    def _activate(self, mv: ModelVersion) -> None:
+        prev, self.active = self.active, mv               # the swap: one reference rebind
+        if prev is not mv:
+            self.swaps += 1
+            if self.on_swap is not None:
+                self.on_swap(mv)
+
+    def activate(self, name: str) -> ModelVersion:
+        with self._lock:
+            mv = self.resident.get(name)
+            if mv is None:
+                raise KeyError(name)
+            self._activate(mv)
+            return mv
+
+    def _evict(self) -> None:
+        while len(self.resident) > self.keep:
+            old = next(n for n in self.resident if self.active is None or n != self.active.name)
+            del self.resident[old]
+
+    def refresh(self) -> Optional[ModelVersion]:
+        """Load the newest (or pinned) version if it is new or was rewritten."""
+        self.last_scan = time.time()
+        target = self._target(self.scan())
+        if target is None:
+            return None
+        cur = self.resident.get(target.name)
+        if cur is not None and cur.fingerprint == ModelVersion._fingerprint(target):
+            return None
+        return self.load(target)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.poll_s):
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:               # keep serving the current version
+                self.last_error = f"{type(e).__name__}: {e}"
+
+    def start(self) -> "ModelRegistry":
+        if self.poll_s > 0 and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="model-registry", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        self._thread = None
+
+    # ---- read side ----
+    def get(self, version: Optional[str] = None) -> ModelVersion:
+        """Active version, or a resident one by name (KeyError if not resident)."""
+        mv = self.active if version is None else self.resident.get(version)
+        if mv is None:
+            raise KeyError(version)
+        return mv
+
+    def others(self, mv: ModelVersion) -> List[ModelVersion]:
+        return [v for v in list(self.resident.values()) if v is not mv]
+
+    def status(self) -> dict:
+        return {
+            "artifacts_root": str(self.root),
+            "active_version": self.active.name if self.active is not None else None,
+            "pinned_version": self.pin,
+            "resident_versions": {n: v.status() for n, v in list(self.resident.items())},
+            "model_swaps": self.swaps,
+            "registry_last_scan_age_s": round(time.time() - self.last_scan, 1) if self.last_scan else None,
+            "registry_last_error": self.last_error,
+        }
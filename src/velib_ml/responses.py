@@ -0,0 +1,130 @@
+# src/velib_ml/responses.py
+# Columnar batch-forecast encodings, picked from the Accept header:
+#   application/x-ndjson                  orjson, one columnar JSON object per line
+#   application/msgpack                   MessagePack maps, concatenated
+#   application/vnd.apache.arrow.stream   Arrow IPC stream, one record batch per chunk
+# Every format is a sequence of chunks, so a large batch can be encoded and sent chunk
+# by chunk. A chunk holds the arrays station_id, horizon, predicted_bikes, delta_model,
+# horizon-major (all stations for the first horizon, then the next). Encoders are
+# imported on first use; a format whose library is missing is simply not offered.
+from __future__ import annotations
+import io, json
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+import numpy as np
+
+MEDIA_TYPES = {
+    "application/x-ndjson": "ndjson",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.apache.arrow.stream": "arrow",
+}
+_MODULES = {"ndjson": "orjson", "msgpack": "msgpack", "arrow": "pyarrow"}
+_available: Dict[str, bool] = {}
+
+
+def available(kind: str) -> bool:
+    if kind not in _available:
+        import importlib.util
+        _available[kind] = importlib.util.find_spec(_MODULES[kind]) is not None
+    return _available[kind]
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """Columnar media type to answer with, or None for the default (nested) JSON.
+
+    Types are tried by decreasing q; application/json or */* ranked first keeps
+    the default, unknown or unavailable types are skipped.
+    """
+    if not accept:
+        return None
+    prefs = []
+    for i, part in enumerate(accept.split(",")):
+        media, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for p in params:
+            if p.startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            prefs.append((-q, i, media.lower()))
+    for _, _, media in sorted(prefs):
+        if media in ("application/json", "*/*", "application/*"):
+            return None
+        kind = MEDIA_TYPES.get(media)
+        if kind is not None and available(kind):
+            return media
+    return None
+
+
+def forecast_columns(station_ids: Sequence[str], horizons: Sequence[int],
+                     bikes: Sequence[np.ndarray], delta: Sequence[np.ndarray]) -> dict:
+    """One chunk: per-horizon prediction arrays laid end to end (rounded like the JSON response)."""
+    n = len(station_ids)
+    return {
+        "station_id": list(station_ids) * len(horizons),
+        "horizon": np.repeat(np.asarray(horizons, dtype="int16"), n),
+        "predicted_bikes": np.round(np.concatenate(bikes), 3).astype("float32"),
+        "delta_model": np.round(np.concatenate(delta), 6).astype("float32"),
+    }
+
+
+def encode_chunks(media_type: str, chunks: Iterable[dict], meta: Optional[dict] = None) -> Iterator[bytes]:
+    """Encoded pieces of the response body; `meta` (e.g. model_version) goes with every chunk / the schema."""
+    kind = MEDIA_TYPES[media_type]
+    meta = meta or {}
+    if kind == "ndjson":
+        import orjson
+        for c in chunks:
+            yield orjson.dumps({**meta, **c}, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n"
+    elif kind == "msgpack":
+        import msgpack
+        pack = msgpack.Packer(use_bin_type=True, use_single_float=True).pack
+        for c in chunks:
+            yield pack({**meta, **{k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in c.items()}})
+    else:
+        yield from _arrow_stream(chunks, meta)
+
+
+def _arrow_stream(chunks: Iterable[dict], meta: dict) -> Iterator[bytes]:
+    import pyarrow as pa
+    schema = pa.schema([("station_id", pa.string()), ("horizon", pa.int16()),
+                        ("predicted_bikes", pa.float32()), ("delta_model", pa.float32())],
+                       metadata={k: json.dumps(v) for k, v in meta.items()})
+    sink = io.BytesIO()
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    writer = pa.ipc.new_stream(sink, schema)
+    for c in chunks:
+        writer.write_batch(pa.record_batch([pa.array(c[f.name], type=f.type) for f in schema], schema=schema))
+        yield drain()
+    writer.close()                                # end-of-stream marker
+    yield drain()
+
+
+def decode(media_type: str, body: bytes) -> Dict[str, List]:
+    """Client side / tests: all chunks of a body concatenated into one columnar dict."""
+    kind = MEDIA_TYPES[media_type]
+    if kind == "arrow":
+        import pyarrow as pa
+        return pa.ipc.open_stream(body).read_all().to_pydict()
+    if kind == "ndjson":
+        import orjson
+        parts = [orjson.loads(line) for line in body.splitlines() if line]
+    else:
+        import msgpack
+        parts = list(msgpack.Unpacker(io.BytesIO(body), raw=False))
+    out: Dict[str, List] = {}
+    for p in parts:
+        for k, v in p.items():
+            if isinstance(v, list):
+                out.setdefault(k, []).extend(v)
+            else:
+                out[k] = v
+    return out
@@ -0,0 +1,193 @@
+# src/velib_ml/search.py
+# Hyperparameter search for the Δ models: successive halving over sampled LightGBM
+# configs, per horizon, on the binned Dataset of training.shared_rows (built once,
+# saved as LightGBM binary; each worker process loads it and its horizon subsets
+# once and reuses them for every trial). A rung trains the surviving configs with a
+# boosting-round budget, scores them on the validation rows (MAE in bikes after the
+# gamma calibration) and keeps the best 1/eta for the next, eta times larger, budget.
+# Trials that early-stopped below the budget are not retrained: more rounds would
+# give the same model. Every trial also reports its inference cost (trees, total
+# leaves, measured predict µs/row) for the MAE / cost Pareto front.
+# Binning parameters (max_bin, min_data_in_bin, ...) are fixed by the shared Dataset
+# and are not searched.
+from __future__ import annotations
+import math, os, random, re, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+import lightgbm as lgb
+
+from .training import EARLY_STOPPING, LGB_PARAMS, NUM_BOOST_ROUND, _calibrate_gamma, shared_rows
+
+SEARCH_SPACE = {
+    "num_leaves": [7, 15, 31, 63, 127],
+    "learning_rate": [0.03, 0.05, 0.08, 0.12, 0.2],
+    "min_data_in_leaf": [16, 64, 256, 1024],
+    "feature_fraction": [0.6, 0.85, 1.0],
+    "bagging_fraction": [0.6, 0.8, 1.0],
+    "lambda_l2": [0.0, 1.0, 10.0],
+    "max_depth": [-1, 6, 10],
+}
+GAMMA_GRID = tuple(np.round(np.arange(0.4, 1.21, 0.05), 2))
+COST_BATCH = 1468            # rows per timed predict (one network-wide batch)
+
+
+def sample_configs(space: Dict[str, list], n: int, seed: int = 0) -> List[dict]:
+    """`n` distinct configs drawn from `space`; the first one is LGB_PARAMS (the current default)."""
+    rng = random.Random(seed)
+    out = [{k: LGB_PARAMS[k] for k in space if k in LGB_PARAMS}]
+    seen = {tuple(sorted(out[0].items()))}
+    total = math.prod(len(v) for v in space.values())
+    while len(out) < min(n, total):
+        c = {k: rng.choice(v) for k, v in space.items()}
+        key = tuple(sorted(c.items()))
+        if key not in seen:
+            seen.add(key)
+            out.append(c)
+    return out
+
+
+def rung_budgets(min_rounds: int, max_rounds: int, eta: int) -> List[int]:
+    """Boosting rounds per rung, growing by eta up to max_rounds (e.g. 89, 267, 800)."""
+    k = max(0, int(math.floor(math.log(max_rounds / max(min_rounds, 1), eta))))
+    return [int(round(max_rounds / eta ** i)) for i in range(k, -1, -1)]
+
+
+def pareto_front(mae: Sequence[float], cost: Sequence[float]) -> np.ndarray:
+    """Indices of the points no other point beats on both MAE and cost (sorted by cost)."""
+    order = np.lexsort((np.asarray(mae), np.asarray(cost)))
+    front, best = [], np.inf
+    for i in order:
+        if mae[i] < best:
+            front.append(i)
+            best = mae[i]
+    return np.asarray(front, dtype=int)
+
+
+def _total_leaves(model_str: str) -> int:
+    head = model_str.split("end of trees", 1)[0]
+    return sum(int(n) for n in re.findall(r"^num_leaves=(\d+)$", head, flags=re.M))
+
+
+# ---- worker side (a spawn process, or the calling process when workers == 1) ----
+_W: dict = {}
+
+
+def _init_worker(bin_path: str, jobs: dict, val: dict, num_threads: int) -> None:
+    base = lgb.Dataset(bin_path, params={"verbosity": -1, "feature_pre_filter": False}).construct()
+    _W.update(base=base, jobs=jobs, val=val, num_threads=num_threads, sets={})
+
+
+def _horizon_sets(h: int):
+    """(dtrain, dval) subsets of the shared Dataset for horizon h, constructed once per process."""
+    if h not in _W["sets"]:
+        idx_fit, y_fit, idx_val, y_val = _W["jobs"][h]
+        dtrain = _W["base"].subset(idx_fit).construct()
+        dtrain.set_label(y_fit)
+        dval = _W["base"].subset(idx_val).construct()
+        dval.set_label(y_val)
+        _W["sets"][h] = (dtrain, dval)
+    return _W["sets"][h]
+
+
+def _run_trial(h: int, config: dict, rounds: int, keep_model: bool = False) -> dict:
+    dtrain, dval = _horizon_sets(h)
+    v = _W["val"][h]
+    params = dict(LGB_PARAMS, **config, num_threads=_W["num_threads"])
+    t0 = time.perf_counter()
+    model = lgb.train(params, dtrain, num_boost_round=rounds, valid_sets=[dval], valid_names=["val"],
+                      callbacks=[lgb.early_stopping(stopping_rounds=EARLY_STOPPING, verbose=False)])
+    train_s = time.perf_counter() - t0
+    best_iter = int(model.best_iteration or rounds)
+    delta = model.predict(v["X"], num_iteration=best_iter)
+    gamma, mae = _calibrate_gamma(delta, v["occ_now"], v["cap"], v["y_true"], v["gamma_grid"])
+    Xc = v["X"][:COST_BATCH]
+    model.predict(Xc, num_iteration=best_iter, num_threads=1)          # warm-up
+    reps = []
+    for _ in range(5):
+        t = time.perf_counter()
+        model.predict(Xc, num_iteration=best_iter, num_threads=1)
+        reps.append(time.perf_counter() - t)
+    text = model.model_to_string(num_iteration=best_iter)
+    return {"horizon": h, "rounds": rounds, "best_iter": best_iter,
+            "stopped_early": best_iter + EARLY_STOPPING <= rounds,
+            "val_mae": float(mae), "gamma": float(gamma), "trees": best_iter,
+            "leaves": _total_leaves(text), "predict_us_row": float(np.median(reps) / len(Xc) * 1e6),
+            "train_s": train_s, "model": text if keep_model else None}
+
+
+# ---- driver ----
+def successive_halving(train_df, test_df, feat_cols, horizons, configs: List[dict], eta: int = 3,
+                       min_rounds: int = 50, max_rounds: int = NUM_BOOST_ROUND, workers: int = 1,
+                       num_threads: int = 2, gamma_grid=GAMMA_GRID,
+                       on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """Run the search; one dict per trial (config, trial id, rung, metrics, pruned).
+
+    Each horizon is searched independently; the rungs of all horizons are
+    submitted together so the pool stays busy. Final-rung trials carry the
+    model text (`model`). `on_result` sees every trial as it completes.
+    """
+    tr, _, Xtr, jobs = shared_rows(train_df, test_df, feat_cols, horizons)
+    val = {}
+    for h in horizons:
+        idx_val = jobs[h][2]
+        cap = tr["capacity"].to_numpy()[idx_val]
+        val[h] = {"X": Xtr[idx_val], "occ_now": tr["occ_now"].to_numpy()[idx_val], "cap": cap,
+                  "y_true": tr[f"occ_{h}"].to_numpy()[idx_val] * cap, "gamma_grid": tuple(gamma_grid)}
+    budgets = rung_budgets(min_rounds, max_rounds, eta)
+    workers = max(1, int(workers))
+    tpw = max(1, num_threads // workers)
+    trials: List[dict] = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bin_path = os.path.join(tmp, "train.bin")
+        lgb.Dataset(Xtr, label=np.zeros(len(Xtr), dtype="float32"), feature_name=list(feat_cols),
+                    params={"verbosity": -1, "num_threads": num_threads, "feature_pre_filter": False}
+                    ).construct().save_binary(bin_path)
+        del Xtr
+        pool = None
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                       initializer=_init_worker, initargs=(bin_path, jobs, val, tpw))
+        else:
+            _init_worker(bin_path, jobs, val, num_threads)
+        try:
+            alive = {h: list(range(len(configs))) for h in horizons}
+            last: Dict[tuple, dict] = {}
+            for rung, rounds in enumerate(budgets):
+                final = rung == len(budgets) - 1
+                todo, done = [], []
+                for h in horizons:
+                    for i in alive[h]:
+                        prev = last.get((h, i))
+                        if prev is not None and prev["stopped_early"] and not final:
+                            done.append(dict(prev, rounds=rounds, rung=rung, reused=True))
+                        else:
+                            todo.append((h, i))
+                if pool is not None:
+                    futs = {pool.submit(_run_trial, h, configs[i], rounds, final): (h, i) for h, i in todo}
+                    results = [(futs[f], f.result()) for f in futs]
+                else:
+                    results = [((h, i), _run_trial(h, configs[i], rounds, final)) for h, i in todo]
+                for (h, i), r in results:
+                    done.append(dict(r, trial=i, rung=rung, config=configs[i], reused=False))
+                for r in done:
+                    last[(r["horizon"], r["trial"])] = r
+                # prune: best ceil(n / eta) per horizon go on
+                for h in horizons:
+                    ranked = sorted((r for r in done if r["horizon"] == h), key=lambda r: r["val_mae"])
+                    keep = ranked if final else ranked[:max(1, math.ceil(len(ranked) / eta))]
+                    kept = {r["trial"] for r in keep}
+                    for r in ranked:
+                        r["pruned"] = r["trial"] not in kept
+                    alive[h] = [r["trial"] for r in keep]
+                for r in sorted(done, key=lambda r: (r["horizon"], r["trial"])):
+                    trials.append(r)
+                    if on_result is not None:
+                        on_result(r)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+            _W.clear()
+    return trials
@@ -0,0 +1,294 @@
+# src/velib_ml/snapshot_store.py
+# Append-only columnar store for collector snapshots:
+#   root/_staging/part-<ts>-<id>.parquet   one small file per appended snapshot
+#   root/date=YYYY-MM-DD/part-0.parquet    compacted day, sorted by ts, one row group per hour
+# Compact dtypes (dictionary station_id, uint16 counts, int32 epoch seconds). Readers
+# (refresh.load_recent, chunked.iter_raw_chunks) go through read_timeseries, which
+# aligns the raw snapshots to FREQ_MIN slots and includes the staging rows.
+from __future__ import annotations
+import os, threading, time, uuid
+from pathlib import Path
+from typing import List, Optional, Sequence
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .config import FREQ_MIN
+
+STAGING = "_staging"
+SCHEMA = pa.schema([
+    ("ts", pa.int32()),                                   # epoch seconds, UTC
+    ("station_id", pa.dictionary(pa.int32(), pa.string())),
+    ("bikes_available", pa.uint16()),
+    ("docks_available", pa.uint16()),
+    ("capacity", pa.uint16()),
+])
+U16_MAX = np.iinfo("uint16").max
+TS_VALUES = ["bikes_available", "capacity"]          # columns of read_timeseries
+
+
+def _epoch_s(t) -> Optional[int]:
+    if t is None:
+        return None
+    t = pd.Timestamp(t)
+    t = t.tz_localize("UTC") if t.tzinfo is None else t.tz_convert("UTC")
+    return int(t.value // 10**9)
+
+
+def _u16(s: pd.Series) -> pa.Array:
+    """uint16 counts; missing / unparsable values stay null (not 0 bikes)."""
+    v = pd.to_numeric(s, errors="coerce").astype("float64").to_numpy()
+    miss = ~np.isfinite(v)
+    return pa.array(np.clip(np.where(miss, 0, v), 0, U16_MAX).astype("uint16"), mask=miss, type=pa.uint16())
+
+
+def snapshot_to_table(df: pd.DataFrame) -> pa.Table:
+    """Collector snapshot (collect_velib_gbfs / gbfs.merge_snapshot columns) → store schema."""
+    ts = pd.to_datetime(df["snapshot_ts"], utc=True).to_numpy().astype("datetime64[s]").astype("int64")
+    docks = df["num_docks_available"] if "num_docks_available" in df else pd.Series(np.nan, index=df.index)
+    return pa.table({
+        "ts": pa.array(ts.astype("int32")),
+        "station_id": pa.array(df["station_id"].astype(str).to_numpy()).dictionary_encode(),
+        "bikes_available": _u16(df["num_bikes_available"]),
+        "docks_available": _u16(docks),
+        "capacity": _u16(df["capacity"]),
+    }, schema=SCHEMA)
+
+
+class SnapshotStore:
+    """Time-partitioned Parquet store of GBFS snapshots.
+
+    `append()` writes one staging file per call (a crash loses nothing);
+    `compact()` folds staging files into their day file (dedup on
+    station_id × ts, atomic replace) and can run on a background thread via
+    `start_compactor()`. Readers see compacted days plus not-yet-compacted
+    staging rows, and only open the days overlapping the requested range.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.staging = self.root / STAGING
+        self.staging.mkdir(parents=True, exist_ok=True)
+        self._compact_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_compaction: Optional[dict] = None
+
+    # ---- write side ----
+    def append(self, snapshot) -> Optional[Path]:
+        table = snapshot if isinstance(snapshot, pa.Table) else snapshot_to_table(snapshot)
+        if not table.num_rows:
+            return None
+        t0 = int(pc.min(table["ts"]).as_py())
+        path = self.staging / f"part-{t0:010d}-{uuid.uuid4().hex[:8]}.parquet"
+        tmp = path.with_name("." + path.name)
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)                 # readers never see half-written files
+        return path
+
+    def staging_files(self) -> List[Path]:
+        return sorted(self.staging.glob("part-*.parquet"))
+
+    def day_path(self, day: str) -> Path:
+        return self.root / f"date={day}" / "part-0.parquet"
+
+    def days(self) -> List[str]:
+        return sorted(e.name[5:] for e in os.scandir(self.root) if e.is_dir() and e.name.startswith("date="))
+
+    def compact(self, min_age_s: float = 0) -> dict:
+        """Merge staging files (older than `min_age_s`) into their day files."""
+        with self._compact_lock:
+            now = time.time()
+            files = [p for p in self.staging_files() if now - p.stat().st_mtime >= min_age_s]
+            if not files:
+                return {"files": 0, "days": 0, "rows": 0}
+            staged = pa.concat_tables([pq.read_table(p, schema=SCHEMA) for p in files]).unify_dictionaries()
+            day_of = pd.to_datetime(staged["ts"].to_numpy().astype("int64"), unit="s").strftime("%Y-%m-%d")
+            rows = 0
+            for day in np.unique(day_of):
+                part = staged.filter(pa.array(day_of == day))
+                dp = self.day_path(day)
+                if dp.exists():
+                    part = pa.concat_tables([pq.read_table(dp, schema=SCHEMA), part])
+                rows += self._write_day(dp, part)
+            for p in files:
+                p.unlink(missing_ok=True)
+            self.last_compaction = {"files": len(files), "days": len(np.unique(day_of)), "rows": rows,
+                                    "at": time.time(), "seconds": round(time.time() - now, 3)}
+            return self.last_compaction
+
+    @staticmethod
+    def _write_day(path: Path, table: pa.Table) -> int:
+        df = table.to_pandas()
+        df = (df.sort_values(["ts", "station_id"], kind="stable")
+                .drop_duplicates(["station_id", "ts"], keep="last"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(".part-0.parquet.tmp")
+        hour = df["ts"].to_numpy() // 3600
+        cuts = np.flatnonzero(np.diff(hour)) + 1
+        with pq.ParquetWriter(tmp, SCHEMA, compression="zstd") as w:
+            for chunk in np.split(np.arange(len(df)), cuts):      # one row group per hour
+                sub = df.iloc[chunk]
+                t = pa.Table.from_pandas(sub, schema=SCHEMA, preserve_index=False)
+                w.write_table(t, row_group_size=len(sub) or 1)
+        os.replace(tmp, path)
+        return len(df)
+
+    def _loop(self, interval_s: float, min_age_s: float) -> None:
+        while not self._stop.wait(interval_s):
+            try:
+                self.compact(min_age_s=min_age_s)
+            except Exception as e:          # keep compacting on the next tick
+                self.last_compaction = {"error": f"{type(e).__name__}: {e}", "at": time.time()}
+
+    def start_compactor(self, interval_s: float = 600, min_age_s: float = 0) -> "SnapshotStore":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, args=(interval_s, min_age_s),
+                                            name="snapshot-compactor", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop_compactor(self, final: bool = True) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+        if final:
+            self.compact()
+
+    # ---- read side ----
+    @staticmethod
+    def _filter(t0: Optional[int], t1: Optional[int], stations: Optional[Sequence[str]] = None):
+        filt = None
+        if t0 is not None:
+            filt = pc.field("ts") >= t0
+        if t1 is not None:
+            f = pc.field("ts") < t1
+            filt = f if filt is None else filt & f
+        if stations is not None:
+            f = pc.field("station_id").isin([str(s) for s in stations])
+            filt = f if filt is None else filt & f
+        return filt
+
+    def _read_staging(self, cols, filt) -> List[pa.Table]:
+        staged = []
+        for p in self.staging_files():
+            try:
+                staged.append(ds.dataset(str(p), schema=SCHEMA, format="parquet").to_table(columns=cols, filter=filt))
+            except FileNotFoundError:     # compacted meanwhile: its rows are in a day file now
+                pass
+        return staged
+
+    def _read_days(self, t0: Optional[int], t1: Optional[int], cols, filt) -> List[pa.Table]:
+        d0 = None if t0 is None else pd.Timestamp(t0, unit="s").strftime("%Y-%m-%d")
+        d1 = None if t1 is None else pd.Timestamp(t1 - 1, unit="s").strftime("%Y-%m-%d")
+        days = [d for d in self.days() if (d0 is None or d >= d0) and (d1 is None or d <= d1)]
+        if not days:
+            return []
+        dset = ds.dataset([str(self.day_path(d)) for d in days], schema=SCHEMA, format="parquet")
+        return [dset.to_table(columns=cols, filter=filt)]
+
+    @staticmethod
+    def _concat(parts: List[pa.Table], cols) -> pa.Table:
+        if not parts:
+            return SCHEMA.empty_table() if cols is None else SCHEMA.empty_table().select(cols)
+        return pa.concat_tables(parts).unify_dictionaries()
+
+    def read_table(self, start=None, end=None, stations: Optional[Sequence[str]] = None,
+                   columns: Optional[Sequence[str]] = None) -> pa.Table:
+        """Raw store rows with start <= ts < end (UTC): day files, then staging rows."""
+        t0, t1 = _epoch_s(start), _epoch_s(end)
+        cols = None if columns is None else list(dict.fromkeys(["ts", "station_id", *columns]))
+        filt = self._filter(t0, t1, stations)
+        # staging first: once a staging file is gone its rows are already in a day file
+        staged = self._read_staging(cols, filt)
+        return self._concat(self._read_days(t0, t1, cols, filt) + staged, cols)
+
+    @staticmethod
+    def _aligned(table: pa.Table, start, end, freq_min: int, values: Sequence[str]):
+        """Dense (n_stations, n_slots) float32 panels, last snapshot of each slot; NaN = none."""
+        step = int(freq_min) * 60
+        table = table.combine_chunks()
+        sid = table["station_id"]
+        if isinstance(sid, pa.ChunkedArray):
+            sid = sid.combine_chunks() if sid.num_chunks else pa.array([], SCHEMA.field("station_id").type)
+        ts = table["ts"].to_numpy().astype("int64")
+        t0 = _epoch_s(start) if start is not None else (int(ts.min()) if len(ts) else 0)
+        t1 = _epoch_s(end) if end is not None else (int(ts.max()) + 1 if len(ts) else t0)
+        t0 = t0 // step * step
+        n_t = max(0, -(-(t1 - t0) // step))
+        # order stations by id, not by dictionary order of the first file read
+        ids = np.asarray(sid.dictionary.to_pylist(), dtype=object)
+        used = np.unique(sid.indices.to_numpy(zero_copy_only=False))
+        ids = ids[used]
+        rank = np.argsort(ids.astype(str))
+        remap = np.full(len(sid.dictionary), -1, dtype="int64")
+        remap[used[rank]] = np.arange(len(used))
+        sta = remap[sid.indices.to_numpy(zero_copy_only=False)]
+        key = sta * n_t + (ts - t0) // step
+        panels = {}
+        for v in values:
+            # last non-null snapshot per (station, slot): max ts wins, ties resolved to the later row
+            val = table[v].to_numpy().astype("float32")
+            ok = ~np.isnan(val)
+            last_ts = np.full(len(used) * n_t, -1, dtype="int64")
+            np.maximum.at(last_ts, key[ok], ts[ok])
+            win = ok & (ts == last_ts[key])
+            a = np.full(len(used) * n_t, np.nan, dtype="float32")
+            a[key[win]] = val[win]
+            panels[v] = a.reshape(len(used), n_t)
+        return ids[rank].astype(str), t0, step, panels
+
+    @classmethod
+    def _timeseries(cls, table: pa.Table, start, end, freq_min: int) -> pd.DataFrame:
+        ids, t0, step, p = cls._aligned(table, start, end, freq_min, TS_VALUES)
+        sta, slot = np.nonzero(~np.isnan(p["bikes_available"]))
+        return pd.DataFrame({
+            "ts": pd.to_datetime(t0 + step * slot, unit="s", utc=True),
+            "station_id": pd.Categorical.from_codes(sta, categories=ids),
+            "bikes_available": p["bikes_available"][sta, slot],
+            "capacity": p["capacity"][sta, slot],
+        })
+
+    def read_timeseries(self, start=None, end=None, stations: Optional[Sequence[str]] = None,
+                        freq_min: int = FREQ_MIN) -> pd.DataFrame:
+        """Long (ts, station_id, bikes_available, capacity) frame sorted by station, ts — the
+        `freq_min` series load_timeseries / train.py consume (last snapshot of each slot)."""
+        return self._timeseries(self.read_table(start, end, stations, columns=TS_VALUES), start, end, freq_min)
+
+    def iter_timeseries(self, chunksize: int = 2_000_000, freq_min: int = FREQ_MIN):
+        """read_timeseries day by day, whole days grouped into chunks of ~`chunksize` rows.
+
+        Staging files are read once up front and sliced per day in memory;
+        each compacted day file is opened once.
+        """
+        cols = ["ts", "station_id", *TS_VALUES]
+        staged = self._concat(self._read_staging(cols, None), cols)
+        sts = staged["ts"].to_numpy().astype("int64")
+        days = set(self.days()) | set(pd.to_datetime(np.unique(sts // 86400) * 86400, unit="s").strftime("%Y-%m-%d"))
+        buf, n = [], 0
+        for day in sorted(days):
+            d = pd.Timestamp(day, tz="UTC")
+            t0 = _epoch_s(d)
+            part = staged.filter(pa.array((sts >= t0) & (sts < t0 + 86400)))
+            table = self._concat(self._read_days(t0, t0 + 86400, cols, self._filter(t0, t0 + 86400)) + [part], cols)
+            df = self._timeseries(table, d, d + pd.Timedelta(days=1), freq_min)
+            buf.append(df.astype({"station_id": "str"}))
+            n += len(df)
+            if n >= chunksize:
+                yield pd.concat(buf, ignore_index=True)
+                buf, n = [], 0
+        if n:
+            yield pd.concat(buf, ignore_index=True)
+
+    def read_panel(self, start, end, value: str = "bikes_available", freq_min: int = FREQ_MIN,
+                   stations: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Station × time float32 panel on the full `freq_min` grid of [start, end); NaN = no snapshot."""
+        table = self.read_table(start, end, stations, columns=[value])
+        ids, t0, step, p = self._aligned(table, start, end, freq_min, [value])
+        grid = pd.to_datetime(t0 + step * np.arange(p[value].shape[1]), unit="s", utc=True)
+        return pd.DataFrame(p[value], index=pd.Index(ids, name="station_id"), columns=grid)
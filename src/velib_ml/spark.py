@@ -0,0 +1,221 @@
+# src/velib_ml/spark.py
+# PySpark version of the feature pipeline for multi-year histories: clean_timeseries,
+# make_features, add_weather, split_train_test, station encodings and make_delta_targets,
+# with the columns, column order and dtypes of the pandas path (scripts/spark_parity.py
+# checks it on sample data). In local[*] mode one box uses all its cores and spills to
+# spark.local.dir past RAM. Lags, leads and past windows are window functions partitioned
+# by station_id and ordered by ts; the EMAs (a recursion) run features._seg_ema_past per
+# station and the weather as-of join runs weather.add_weather per partition.
+# write_features → Parquet partitioned by month, read by train.py --features-dir.
+from __future__ import annotations
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+import numpy as np
+import pandas as pd
+from pyspark.sql import DataFrame, SparkSession, Window, functions as F, types as T
+
+from .chunked import restore_dtypes
+from .config import DELTA_STEPS, EMA_ALPHAS, FREQ_MIN, HORIZONS, LAG_STEPS, ROLL_STEPS
+from .encodings import StationEncodings
+from .features import _seg_ema_past
+from .weather import WEATHER_COLS, add_weather as _add_weather_pandas
+
+
+def session(master: str = "local[*]", driver_memory: str = "8g", local_dir: Optional[str] = None,
+            app_name: str = "velib-features") -> SparkSession:
+    """SparkSession with UTC timestamps, Arrow transfers, 2 shuffle partitions per core."""
+    b = (SparkSession.builder.master(master).appName(app_name)
+         .config("spark.driver.memory", driver_memory)
+         .config("spark.sql.session.timeZone", "UTC")
+         .config("spark.sql.execution.arrow.pyspark.enabled", "true")
+         .config("spark.sql.shuffle.partitions", str(2 * (os.cpu_count() or 1)))
+         .config("spark.sql.parquet.outputTimestampType", "TIMESTAMP_MICROS"))
+    if local_dir:
+        b = b.config("spark.local.dir", local_dir)          # shuffle / sort spill
+    return b.getOrCreate()
+
+
+def _by_station(lo=None, hi=None):
+    w = Window.partitionBy("station_id").orderBy("ts")
+    return w if lo is None else w.rowsBetween(lo, hi)
+
+
+def _null_nan(c):
+    return F.when(F.isnan(c), F.lit(None)).otherwise(c)
+
+
+def _dow(ts="ts"):
+    return (F.dayofweek(ts) + 5) % 7                 # Spark: Sunday = 1, pandas: Monday = 0
+
+
+# ---- data ----
+def _read_store(spark: SparkSession, root: Path, freq_min: int = FREQ_MIN) -> DataFrame:
+    """SnapshotStore.read_timeseries: compacted days + staging files, last non-null snapshot
+    of each (station, freq_min slot), slots without bikes dropped."""
+    files = [str(root / "date=*" / "part-0.parquet")] if any(root.glob("date=*/part-0.parquet")) else []
+    files += [str(f) for f in sorted((root / "_staging").glob("part-*.parquet"))]   # Spark skips _dirs
+    raw = spark.read.parquet(*files).select("ts", F.col("station_id").cast("string"),
+                                            "bikes_available", "capacity")
+    step = int(freq_min) * 60
+    raw = raw.withColumn("slot", F.floor(F.col("ts") / step) * step)
+    last = [F.max_by(c, F.when(F.col(c).isNotNull(), F.col("ts"))).cast("float").alias(c)
+            for c in ("bikes_available", "capacity")]
+    return (raw.groupBy("station_id", "slot").agg(*last)
+               .filter(F.col("bikes_available").isNotNull())
+               .select(F.timestamp_seconds("slot").alias("ts"), "station_id", "bikes_available", "capacity"))
+
+
+def read_timeseries(spark: SparkSession, path) -> DataFrame:
+    """data.load_timeseries: raw CSV, Parquet (file or dir, hive partitions ok) or a
+    SnapshotStore root (aligned like SnapshotStore.read_timeseries) → cleaned, with occ."""
+    p = str(path)
+    if (Path(p) / "_staging").is_dir():
+        return clean_timeseries(_read_store(spark, Path(p)))
+    raw = spark.read.option("header", True).csv(p) if p.endswith(".csv") else spark.read.parquet(p)
+    sdf = raw.select(F.col("ts").cast("timestamp").alias("ts"), F.col("station_id").cast("string"),
+                     *[_null_nan(F.col(c).cast("float")).alias(c) for c in ("bikes_available", "capacity")])
+    return clean_timeseries(sdf)
+
+
+def clean_timeseries(sdf: DataFrame) -> DataFrame:
+    """data.clean_timeseries: capacity ffilled / bfilled per station, capacity > 0, occ = bikes / capacity in [0, 1]."""
+    cap = F.coalesce(F.last("capacity", ignorenulls=True).over(_by_station(Window.unboundedPreceding, 0)),
+                     F.first("capacity", ignorenulls=True).over(_by_station(0, Window.unboundedFollowing)))
+    sdf = sdf.withColumn("capacity", cap.cast("float")).filter(F.col("capacity") > 0)
+    occ = F.col("bikes_available") / F.col("capacity")     # double, then float: same as float32 division
+    occ = F.when(occ.isNull(), F.lit(None)).otherwise(F.least(F.greatest(occ, F.lit(0.0)), F.lit(1.0)))
+    return sdf.withColumn("occ", occ.cast("float"))
+
+
+# ---- features ----
+def _ema_station(pdf: pd.DataFrame) -> pd.DataFrame:
+    pdf = pdf.sort_values("ts")
+    occ = pdf["occ"].to_numpy(dtype="float32")
+    starts, lens = np.zeros(1, dtype="int64"), np.array([len(pdf)])
+    for name, a in EMA_ALPHAS.items():
+        pdf[name] = _seg_ema_past(occ, a, starts, lens).astype("float32")
+    return pdf
+
+
+def make_features(sdf: DataFrame, use_ema: bool = False) -> DataFrame:
+    """features.make_features on a cleaned frame (hour / dow / is_weekend come out as int8)."""
+    w, occ = _by_station(), F.col("occ")
+    hour, dow = F.hour("ts"), _dow()
+    h24 = np.arange(24)
+    cols = [F.col(c) for c in sdf.columns]
+    cols += [hour.cast("tinyint").alias("hour"), dow.cast("tinyint").alias("dow"),
+             (dow >= 5).cast("tinyint").alias("is_weekend")]
+    # same float32 tables as the pandas path, looked up by hour
+    for name, vals in (("hour_sin", np.sin(2*np.pi*h24/24)), ("hour_cos", np.cos(2*np.pi*h24/24)),
+                       ("hour_sin2", np.sin(4*np.pi*h24/24)), ("hour_cos2", np.cos(4*np.pi*h24/24))):
+        table = F.array(*[F.lit(float(v)) for v in vals.astype("float32")])
+        cols.append(F.element_at(table, hour + 1).cast("float").alias(name))
+
+    lags = {k: F.lag(occ, k).over(w) for k in sorted(set(LAG_STEPS) | set(DELTA_STEPS))}
+    cols += [lags[k].alias(f"occ_lag_{k*FREQ_MIN}") for k in LAG_STEPS]
+    for n in ROLL_STEPS:
+        # mean of the n previous rows, null unless all n exist and are not null
+        wn = w.rowsBetween(-n, -1)
+        full = (F.count(F.lit(1)).over(wn) == n) & (F.count(occ).over(wn) == n)
+        cols.append(F.when(full, F.sum(occ).over(wn) / n).cast("float").alias(f"occ_roll_{n*FREQ_MIN}"))
+    cols += [(occ - lags[k]).alias(f"occ_delta_{k*FREQ_MIN}") for k in DELTA_STEPS]
+    targets = [F.lead(occ, h // FREQ_MIN).over(w).alias(f"occ_{h}") for h in HORIZONS]
+    feat = sdf.select(*cols, *targets)
+    if not use_ema:
+        return feat
+
+    # EMAs go between the deltas and the targets, as in the pandas frame
+    schema = T.StructType(feat.schema.fields + [T.StructField(c, T.FloatType()) for c in EMA_ALPHAS])
+    feat = feat.groupBy("station_id").applyInPandas(_ema_station, schema=schema)
+    head = [c for c in feat.columns if c not in EMA_ALPHAS and c not in {f"occ_{h}" for h in HORIZONS}]
+    return feat.select(*head, *EMA_ALPHAS,
+                       (F.col("occ_ema_fast") - F.col("occ_ema_slow")).alias("occ_momentum"),
+                       *[f"occ_{h}" for h in HORIZONS])
+
+
+def add_weather(sdf: DataFrame, weather: pd.DataFrame, cols: Iterable[str] = WEATHER_COLS) -> DataFrame:
+    """weather.add_weather on every partition; the hourly weather frame is small and shipped to each task."""
+    cols = list(cols)
+    w = weather[["ts", *cols]].copy()
+    schema = T.StructType(sdf.schema.fields + [T.StructField(c, T.DoubleType()) for c in cols]
+                          + [T.StructField("is_rain", T.ByteType())])
+
+    def run(frames):
+        for pdf in frames:
+            yield _add_weather_pandas(pdf, w, cols).astype({"is_rain": "int8"})
+    return sdf.mapInPandas(run, schema)
+
+
+# ---- training frames ----
+def split_train_test(sdf: DataFrame, q: float) -> Tuple[DataFrame, DataFrame]:
+    """splits.split_train_test: exact ts quantile (linear interpolation, as pandas), ts <= cut / ts > cut."""
+    us = F.expr("unix_micros(ts)")
+    cut = sdf.select(F.expr(f"percentile(unix_micros(ts), {float(q)})")).first()[0]
+    return sdf.filter(us <= cut), sdf.filter(us > cut)
+
+
+def fit_station_encodings(train: DataFrame, dtype: str = "float32") -> StationEncodings:
+    """features.fit_station_encodings: mean per station and exact median per (station, dow, hour),
+    aggregated by Spark; the station × 7 × 24 tables are built on the driver."""
+    ok = train.filter(F.col("occ").isNotNull()).select(
+        "station_id", _dow().alias("dow"), F.hour("ts").alias("hour"), F.col("occ").cast("double").alias("occ"))
+    means = ok.groupBy("station_id").agg(F.avg("occ").alias("mean")).toPandas()
+    cells = ok.groupBy("station_id", "dow", "hour").agg(F.expr("percentile(occ, 0.5)").alias("med")).toPandas()
+    ids = np.sort(means["station_id"].astype(str).to_numpy())
+    row = {s: i for i, s in enumerate(ids.tolist())}
+    mean = np.full(len(ids), np.nan)
+    mean[means["station_id"].map(row).to_numpy()] = means["mean"].to_numpy()
+    hdh = np.repeat(mean, 168)
+    hdh[cells["station_id"].map(row).to_numpy() * 168 + cells["dow"].to_numpy() * 24 + cells["hour"].to_numpy()] = \
+        cells["med"].to_numpy()
+    return StationEncodings(ids, mean.astype(dtype), hdh.reshape(len(ids), 7, 24).astype(dtype))
+
+
+def attach_station_encodings(sdf: DataFrame, enc: StationEncodings) -> DataFrame:
+    """features.attach_station_encodings: broadcast joins on station and (station, dow, hour)."""
+    spark, ids, n = sdf.sparkSession, enc.station_ids.tolist(), len(enc)
+    mean = spark.createDataFrame(pd.DataFrame({"station_id": ids, "sta_mean_occ": enc.mean.astype("float32")}))
+    hdh = spark.createDataFrame(pd.DataFrame({
+        "station_id": np.repeat(ids, 168),
+        "_dow": np.tile(np.repeat(np.arange(7, dtype="int32"), 24), n),
+        "_hour": np.tile(np.arange(24, dtype="int32"), 7 * n),
+        "sta_hdh_occ": enc.hdh.reshape(-1).astype("float32")}))
+    out = (sdf.withColumn("_dow", _dow()).withColumn("_hour", F.hour("ts"))
+           .join(F.broadcast(mean), "station_id", "left")
+           .join(F.broadcast(hdh), ["station_id", "_dow", "_hour"], "left"))
+    return out.select(*sdf.columns, "sta_mean_occ", "sta_hdh_occ")
+
+
+def make_delta_targets(sdf: DataFrame, freq_min: int = FREQ_MIN, horizons=HORIZONS) -> DataFrame:
+    """features.make_delta_targets for one split: occ h minutes later in the same split − occ."""
+    w = _by_station()
+    return sdf.select("*", *[(F.lead("occ", h // freq_min).over(w) - F.col("occ")).alias(f"occ_delta_target_{h}")
+                             for h in horizons])
+
+
+def training_frames(feat: DataFrame, split_q: float, use_sta: bool = False, sta_dtype: str = "float32"):
+    """train.py's build_frames after the features: (train, test, station encodings or None)."""
+    train, test = split_train_test(feat, split_q)
+    enc = None
+    if use_sta:
+        enc = fit_station_encodings(train, dtype=sta_dtype)
+        train, test = attach_station_encodings(train, enc), attach_station_encodings(test, enc)
+    train, test = (d.withColumn("occ_now", F.col("occ")) for d in (train, test))
+    return make_delta_targets(train), make_delta_targets(test), enc
+
+
+# ---- output ----
+def write_features(sdf: DataFrame, out, mode: str = "overwrite") -> None:
+    """Parquet partitioned by month (month=YYYY-MM/part-*.parquet), rows sorted by station and ts."""
+    (sdf.withColumn("month", F.date_format("ts", "yyyy-MM"))
+        .repartition("month", "station_id")
+        .sortWithinPartitions("station_id", "ts")
+        .write.mode(mode).partitionBy("month").parquet(str(out)))
+
+
+def to_pandas(sdf: DataFrame) -> pd.DataFrame:
+    """Collect (sample-sized frames) with the pandas path's dtypes, sorted by station and ts."""
+    df = sdf.toPandas()
+    df["ts"] = pd.to_datetime(df["ts"], utc=True).astype("datetime64[ns, UTC]")   # naive, session tz (UTC)
+    return restore_dtypes(df).sort_values(["station_id", "ts"], ignore_index=True)
@@ -0,0 +1,396 @@
+# src/velib_ml/streaming.py
+# Live GBFS snapshots → forecasts for every station, as one asyncio pipeline:
+#   poll → normalize → update (StationStateStore) → predict (ForecastTable) → publish (sinks)
+# Stages are coroutines joined by bounded queues, so a slow stage makes the ones
+# before it wait instead of buffering without limit; blocking work (HTTP, pandas,
+# numpy) runs in worker threads and the loop only moves snapshots around. Every
+# snapshot is applied to the station state, but predict only scores the newest
+# state: snapshots landing while it is busy are coalesced. Per-stage latency
+# histograms (velib_ml.metrics) are in `status()`.
+from __future__ import annotations
+import asyncio, os, sqlite3, threading, time
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+import numpy as np
+
+from .forecast_table import ForecastTable, build_forecast_table
+from .live_weather import WEATHER_DEFAULT
+from .metrics import Histograms
+from .online import StationStateStore
+
+SNAPSHOT_GLOBS = ("velib_snapshot_*.csv", "velib_snapshot_*.parquet")
+_STOP = object()
+
+
+def normalize_snapshot(df):
+    """(station_ids, bikes, capacity, epoch_s) arrays from a collector snapshot or store rows."""
+    import pandas as pd
+    bikes = df["num_bikes_available"] if "num_bikes_available" in df else df["bikes_available"]
+    ts = df["snapshot_ts"] if "snapshot_ts" in df else df["ts"]
+    if pd.api.types.is_numeric_dtype(ts):
+        epoch = ts.to_numpy(dtype="float64")
+    else:
+        # a snapshot has one snapshot_ts: parse the distinct values only
+        uniq, inv = np.unique(ts.astype(str).to_numpy(), return_inverse=True)
+        epoch = (pd.to_datetime(uniq, utc=True).to_numpy().astype("datetime64[ns]").astype("int64") / 1e9)[inv]
+    return (df["station_id"].astype(str).to_numpy(),
+            pd.to_numeric(bikes, errors="coerce").to_numpy(dtype="float64"),
+            pd.to_numeric(df["capacity"], errors="coerce").to_numpy(dtype="float64"),
+            epoch)
+
+
+class Snapshot:
+    """One snapshot on its way through the pipeline; `landed` is when the source produced it."""
+
+    __slots__ = ("seq", "frame", "columns", "landed")
+
+    def __init__(self, seq: int, frame):
+        self.seq, self.frame, self.columns = seq, frame, None
+        self.landed = time.perf_counter()
+
+
+# ==== Sources: async iterables of snapshot DataFrames, `last_fetch_s` = time to get the last one ====
+# A source hands a failed fetch / read to `on_error` (set by StreamingPipeline) and goes on
+# with the next one; without `on_error` the exception ends the iteration.
+def _source_error(source, e: Exception) -> None:
+    if source.on_error is None:
+        raise e
+    source.on_error(e)
+
+
+class GBFSSource:
+    """Live feed: one GBFSClient.fetch every `interval_s`; ticks where station_status did not
+    move yield nothing, failed ticks (HTTP error, timeout…) go to `on_error`."""
+
+    def __init__(self, client=None, interval_s: float = 30.0):
+        self.client = client
+        self.interval_s = float(interval_s)
+        self.last_fetch_s: Optional[float] = None
+        self.on_error: Optional[Callable[[Exception], None]] = None
+
+    async def __aiter__(self):
+        from .gbfs import GBFSClient
+        client = self.client or GBFSClient()
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    df = await asyncio.to_thread(client.fetch)
+                except Exception as e:
+                    _source_error(self, e)
+                    df = None                     # retry on the next tick
+                else:
+                    self.last_fetch_s = time.perf_counter() - t0
+                if df is not None and len(df):
+                    yield df
+                await asyncio.sleep(max(0.0, self.interval_s - (time.perf_counter() - t0)))
+        finally:
+            if self.client is None:
+                client.close()
+
+
+class ReplaySource:
+    """Recorded snapshots: a collector output dir (one file per snapshot) or a SnapshotStore root.
+
+    Paced by `interval_s` between snapshots, else by the recorded gaps divided
+    by `speed`; with neither, as fast as the pipeline takes them. Unreadable
+    files go to `on_error` and are skipped.
+    """
+
+    def __init__(self, path, interval_s: Optional[float] = None, speed: float = 0.0,
+                 start=None, end=None):
+        self.path = Path(path)
+        self.interval_s = interval_s
+        self.speed = float(speed)
+        self.start, self.end = start, end
+        self.last_fetch_s: Optional[float] = None
+        self.on_error: Optional[Callable[[Exception], None]] = None
+
+    def files(self) -> List[Path]:
+        return sorted(p for g in SNAPSHOT_GLOBS for p in self.path.glob(g))
+
+    def _frames(self):
+        import pandas as pd
+        if (self.path / "_staging").is_dir():
+            from .snapshot_store import SnapshotStore
+            df = SnapshotStore(self.path).read_table(self.start, self.end).to_pandas()
+            for _, g in df.sort_values("ts").groupby("ts", sort=False, observed=True):
+                yield lambda g=g: g
+            return
+        for p in self.files():
+            yield lambda p=p: pd.read_parquet(p) if p.suffix == ".parquet" else pd.read_csv(p, dtype={"station_id": str})
+
+    async def __aiter__(self):
+        prev_ts = None
+        for read in self._frames():
+            t0 = time.perf_counter()
+            try:
+                df = await asyncio.to_thread(read)
+            except Exception as e:
+                _source_error(self, e)
+                continue
+            self.last_fetch_s = time.perf_counter() - t0
+            ts = normalize_snapshot(df.head(1))[3][0] if len(df) else None
+            if prev_ts is not None:
+                wait = self.interval_s if self.interval_s is not None else \
+                    ((ts - prev_ts) / self.speed if self.speed > 0 and ts is not None else 0.0)
+                await asyncio.sleep(max(0.0, wait - self.last_fetch_s))
+            prev_ts = ts
+            yield df
+
+
+# ==== Sinks: `async publish(table, snap)`, `close()` ====
+def _put_latest(q: asyncio.Queue, item) -> bool:
+    """Non-blocking put on a bounded queue, dropping the oldest item if full; True if one was dropped."""
+    dropped = False
+    if q.full():
+        try:
+            q.get_nowait()
+            dropped = True
+        except asyncio.QueueEmpty:
+            pass
+    q.put_nowait(item)
+    return dropped
+
+
+class MemorySink:
+    """Latest table in memory, handed to `callback`s (e.g. the API) and in-process subscribers.
+
+    `subscribe()` (on the pipeline's loop) returns a queue holding at most the
+    newest table: slow readers skip tables, they never hold the pipeline back.
+    """
+
+    def __init__(self, callback: Optional[Callable[[ForecastTable], None]] = None):
+        self.latest: Optional[ForecastTable] = None
+        self.callbacks = [callback] if callback is not None else []
+        self._subs: List[asyncio.Queue] = []
+
+    def subscribe(self) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subs.append(q)
+        return q
+
+    async def publish(self, table: ForecastTable, snap: Snapshot) -> None:
+        self.latest = table
+        for cb in self.callbacks:
+            cb(table)
+        for q in self._subs:
+            _put_latest(q, table)
+
+    def close(self) -> None:
+        pass
+
+
+class FileSink:
+    """The table's JSON body (same as GET /forecast), atomically replaced at `path`."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def write(self, table: ForecastTable) -> None:
+        tmp = self.path.with_name("." + self.path.name)
+        tmp.write_bytes(table.body)
+        os.replace(tmp, self.path)
+
+    async def publish(self, table: ForecastTable, snap: Snapshot) -> None:
+        await asyncio.to_thread(self.write, table)
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteSink:
+    """Rows (station_id, horizon, ts, predicted_bikes, delta_model, model_version, generated_at).
+
+    Keeps the latest forecast per station × horizon, or every one with
+    `history`. WAL mode, so readers in other processes never block the writer.
+    """
+
+    def __init__(self, path, history: bool = False):
+        self.path = Path(path)
+        self.history = history
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(self.path), check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        key = "station_id, horizon, ts" if self.history else "station_id, horizon"
+        db.execute("CREATE TABLE IF NOT EXISTS forecast (station_id TEXT, horizon INTEGER, ts REAL, "
+                   "predicted_bikes REAL, delta_model REAL, model_version TEXT, generated_at REAL, "
+                   f"PRIMARY KEY ({key}))")
+        return db
+
+    def write(self, table: ForecastTable) -> None:
+        if self._db is None:
+            self._db = self._connect()
+        H = len(table.horizons)
+        rows = zip(np.repeat(table.station_ids, H).tolist(), np.tile(table.horizons, len(table)).tolist(),
+                   np.repeat(table.ts, H).tolist(), table.predicted_bikes.ravel().tolist(),
+                   table.delta.ravel().tolist(), [table.source] * (H * len(table)),
+                   [table.built_at] * (H * len(table)))
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO forecast VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    async def publish(self, table: ForecastTable, snap: Snapshot) -> None:
+        await asyncio.to_thread(self.write, table)
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+# ==== Pipeline ====
+class StreamingPipeline:
+    """poll → normalize → update → predict → publish over bounded queues.
+
+    `registry` is anything with `.get()` returning the ModelVersion to serve
+    (ModelRegistry: hot swaps apply from the next prediction). `state` may be
+    shared with the API (its /ingest and the pipeline feed the same store).
+    A failing snapshot is counted in `errors` and skipped; the pipeline goes on.
+    Latencies: one histogram per stage (service time) and `end_to_end`, from
+    the snapshot landing to its forecasts being published.
+    """
+
+    def __init__(self, source, registry, sinks: Sequence = (), state: Optional[StationStateStore] = None,
+                 weather: Optional[Callable[[], dict]] = None, queue_size: int = 4):
+        self.source = source
+        self.registry = registry
+        self.sinks = list(sinks)
+        self.state = state if state is not None else StationStateStore()
+        self.weather = weather or (lambda: dict(WEATHER_DEFAULT))
+        self.queue_size = max(1, int(queue_size))
+        self.latency = Histograms()
+        self.counts = {"snapshots": 0, "rows": 0, "applied": 0, "coalesced": 0, "published": 0, "errors": 0}
+        self.last_error: Optional[str] = None
+        self.last_published_at: Optional[float] = None
+        self.table: Optional[ForecastTable] = None
+        self._queues: dict = {}
+        self._poll_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- stages ----
+    def _error(self, stage: str, e: Exception) -> None:
+        self.counts["errors"] += 1
+        self.last_error = f"{stage}: {type(e).__name__}: {e}"
+
+    async def _poll(self, out: asyncio.Queue, max_snapshots: Optional[int]) -> None:
+        if hasattr(self.source, "on_error"):
+            self.source.on_error = lambda e: self._error("poll", e)
+        frames = self.source.__aiter__()
+        try:
+            async for frame in frames:
+                snap = Snapshot(self.counts["snapshots"], frame)
+                if getattr(self.source, "last_fetch_s", None) is not None:
+                    self.latency.observe("poll", self.source.last_fetch_s)
+                self.counts["snapshots"] += 1
+                await out.put(snap)                       # blocks while the pipeline is behind
+                if max_snapshots and self.counts["snapshots"] >= max_snapshots:
+                    break
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:                            # a source without on_error: record it, drain, stop
+            self._error("poll", e)
+        finally:
+            if hasattr(frames, "aclose"):
+                await frames.aclose()                     # runs the source's cleanup (closes its client)
+            await out.put(_STOP)
+
+    async def _stage(self, name: str, fn: Callable, inp: asyncio.Queue, out: asyncio.Queue,
+                     latest: bool = False) -> None:
+        """Run `fn(snap)` in a worker thread for each snapshot; `latest`: coalesce into `out`."""
+        while (item := await inp.get()) is not _STOP:
+            t0 = time.perf_counter()
+            try:
+                res = await asyncio.to_thread(fn, item)
+            except Exception as e:
+                self._error(name, e)
+                continue
+            self.latency.observe(name, time.perf_counter() - t0)
+            if latest:
+                self.counts["coalesced"] += _put_latest(out, res)
+            else:
+                await out.put(res)
+        await out.put(_STOP)
+
+    def _normalize(self, snap: Snapshot) -> Snapshot:
+        snap.columns, snap.frame = normalize_snapshot(snap.frame), None
+        return snap
+
+    def _update(self, snap: Snapshot) -> Snapshot:
+        self.counts["rows"] += len(snap.columns[0])
+        self.counts["applied"] += self.state.update(*snap.columns)
+        return snap
+
+    def _predict(self, snap: Snapshot):
+        return snap, build_forecast_table(self.state, self.registry.get(), self.weather())
+
+    async def _publish(self, inp: asyncio.Queue) -> None:
+        while (item := await inp.get()) is not _STOP:
+            snap, table = item
+            if table is None:
+                continue
+            t0 = time.perf_counter()
+            for sink in self.sinks:
+                try:
+                    await sink.publish(table, snap)
+                except Exception as e:
+                    self._error(f"publish[{type(sink).__name__}]", e)
+            now = time.perf_counter()
+            self.latency.observe("publish", now - t0)
+            self.latency.observe("end_to_end", now - snap.landed)
+            self.table, self.last_published_at = table, time.time()
+            self.counts["published"] += 1
+
+    async def run(self, max_snapshots: Optional[int] = None) -> dict:
+        """Run until the source is exhausted, `max_snapshots` were read, or `stop()`."""
+        self._loop = asyncio.get_running_loop()
+        q = self._queues = {"normalize": asyncio.Queue(self.queue_size), "update": asyncio.Queue(self.queue_size),
+                            "predict": asyncio.Queue(1), "publish": asyncio.Queue(self.queue_size)}
+        self._poll_task = asyncio.create_task(self._poll(q["normalize"], max_snapshots))
+        stages = [
+            self._stage("normalize", self._normalize, q["normalize"], q["update"]),
+            self._stage("update", self._update, q["update"], q["predict"], latest=True),
+            self._stage("predict", self._predict, q["predict"], q["publish"]),
+            self._publish(q["publish"]),
+        ]
+        try:
+            await asyncio.gather(self._poll_task, *stages)
+        finally:
+            for sink in self.sinks:
+                sink.close()
+            self._loop = None
+        return self.status()
+
+    # ---- background thread (e.g. inside the API process) ----
+    def start(self, max_snapshots: Optional[int] = None) -> "StreamingPipeline":
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=lambda: asyncio.run(self.run(max_snapshots)),
+                                            name="streaming-pipeline", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5) -> None:
+        """Stop polling; snapshots already in the queues are still published."""
+        loop, task = self._loop, self._poll_task
+        if loop is not None and task is not None:
+            loop.call_soon_threadsafe(task.cancel)
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def status(self) -> dict:
+        return {
+            "running": self._loop is not None,
+            **self.counts,
+            "stations": len(self.state),
+            "last_error": self.last_error,
+            "last_published_age_s": None if self.last_published_at is None
+                                    else round(time.time() - self.last_published_at, 1),
+            "queue_depth": {k: v.qsize() for k, v in self._queues.items()},
+            "latency": self.latency.summary(),
+        }
@@ -1,6 +1,20 @@
+import os, sys, tempfile, time
 import numpy as np, lightgbm as lgb
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from sklearn.metrics import mean_absolute_error
-from .config import SPLIT_TRAINVAL
+from .config import FREQ_MIN, SPLIT_TRAINVAL
+from .inference import HORIZON_FEATURE
+from .io_utils import peak_rss_mb
+
+LGB_PARAMS = dict(objective="regression_l1", metric="l1",
+                  learning_rate=0.08, num_leaves=63, max_depth=-1,
+                  min_data_in_leaf=64, feature_fraction=0.85,
+                  bagging_fraction=0.8, bagging_freq=1,
+                  lambda_l1=0.0, lambda_l2=0.0,
+                  seed=42, verbosity=-1)
+NUM_BOOST_ROUND = 800
+EARLY_STOPPING  = 50
 
 def _clean_for_horizon(df, feat_cols, h):
     # keep only rows fully defined for this horizon
@@ -11,6 +25,16 @@ def _time_val_split(df):
     cut = df["ts"].quantile(SPLIT_TRAINVAL)
     return df[df["ts"] <= cut].copy(), df[df["ts"] > cut].copy()
 
+def _calibrate_gamma(delta, occ_now, cap, y_true, gamma_grid):
+    # gamma calibration on val (MAE in bikes)
+    best_g, best_mae = 1.0, 1e9
+    for g in gamma_grid:
+        y_hat = np.clip(occ_now + g*delta, 0, 1) * cap
+        mae   = mean_absolute_error(y_true, y_hat)
+        if mae < best_mae:
+            best_mae, best_g = mae, g
+    return best_g, best_mae
+
 def train_delta_gamma(train_df, test_df, feat_cols, horizon, num_threads=2, gamma_grid=(0.5, 0.7, 0.9, 1.0)):
     y_col = f"occ_delta_target_{horizon}"
 
@@ -24,31 +48,18 @@ def train_delta_gamma(train_df, test_df, feat_cols, horizon, num_threads=2, gamm
     Xval, yval = tr_val[feat_cols], tr_val[y_col]
     Xte        = te[feat_cols]
 
-    params = dict(objective="regression_l1", metric="l1",
-                  learning_rate=0.08, num_leaves=63, max_depth=-1,
-                  min_data_in_leaf=64, feature_fraction=0.85,
-                  bagging_fraction=0.8, bagging_freq=1,
-                  lambda_l1=0.0, lambda_l2=0.0,
-                  seed=42, verbosity=-1, num_threads=num_threads)
+    params = dict(LGB_PARAMS, num_threads=num_threads)
 
     dtrain = lgb.Dataset(Xtr, label=ytr)
     dval   = lgb.Dataset(Xval, label=yval, reference=dtrain)
-    model = lgb.train(params, dtrain, num_boost_round=800,
+    model = lgb.train(params, dtrain, num_boost_round=NUM_BOOST_ROUND,
                       valid_sets=[dtrain, dval], valid_names=["train","val"],
-                      callbacks=[lgb.early_stopping(stopping_rounds=50)])
+                      callbacks=[lgb.early_stopping(stopping_rounds=EARLY_STOPPING)])
 
-    # gamma calibration on val (MAE in bikes)
     delta_val = model.predict(Xval, num_iteration=model.best_iteration)
     cap_val   = Xval["capacity"].to_numpy()
-    occ_now_v = tr_val["occ_now"].to_numpy()
-    y_true_v  = (tr_val[f"occ_{horizon}"] * cap_val).to_numpy()
-
-    best_g, best_mae = 1.0, 1e9
-    for g in gamma_grid:
-        y_hat_v = np.clip(occ_now_v + g*delta_val, 0, 1) * cap_val
-        mae_v   = mean_absolute_error(y_true_v, y_hat_v)
-        if mae_v < best_mae:
-            best_mae, best_g = mae_v, g
+    best_g, _ = _calibrate_gamma(delta_val, tr_val["occ_now"].to_numpy(), cap_val,
+                                 (tr_val[f"occ_{horizon}"] * cap_val).to_numpy(), gamma_grid)
 
     # test
     delta_te = model.predict(Xte, num_iteration=model.best_iteration)
@@ -59,3 +70,174 @@ def train_delta_gamma(train_df, test_df, feat_cols, horizon, num_threads=2, gamm
     mae_t    = mean_absolute_error(y_true_t, y_hat_t)
 
     return dict(mae=mae_t, model=model, best_iter=int(model.best_iteration or 0), gamma=float(best_g))
+
+# ---- multi-horizon: features binned once, one subset (rows + label) per horizon ----
+def _fit_on_shared(base, idx_tr, y_tr, idx_val, y_val, params, num_boost_round=None):
+    """Train one horizon on subsets of an already constructed (binned) Dataset."""
+    t0 = time.time()
+    dtrain = base.subset(idx_tr).construct()
+    dtrain.set_label(y_tr)
+    dval = base.subset(idx_val).construct()
+    dval.set_label(y_val)
+    model = lgb.train(params, dtrain, num_boost_round=num_boost_round or NUM_BOOST_ROUND,
+                      valid_sets=[dtrain, dval], valid_names=["train","val"],
+                      callbacks=[lgb.early_stopping(stopping_rounds=EARLY_STOPPING, verbose=False)])
+    return model, time.time() - t0
+
+def _fit_worker(bin_path, idx_tr, y_tr, idx_val, y_val, params, ds_params):
+    # process-pool entry point: reload the binned Dataset (same Dataset params), return the model as text
+    base = lgb.Dataset(bin_path, params=ds_params).construct()
+    model, secs = _fit_on_shared(base, idx_tr, y_tr, idx_val, y_val, params)
+    return model.model_to_string(num_iteration=model.best_iteration), int(model.best_iteration or 0), secs, peak_rss_mb()
+
+def shared_rows(train_df, test_df, feat_cols, horizons):
+    """(tr, te, Xtr, jobs) for training on one binned Dataset.
+
+    tr / te: rows with complete features, sorted by station and time; Xtr:
+    tr's feature matrix (float32); jobs: {h: (idx_fit, y_fit, idx_val, y_val)},
+    each horizon's rows with a defined label split at its own SPLIT_TRAINVAL cut.
+    """
+    base_need = list(dict.fromkeys(feat_cols + ["occ_now", "capacity"]))
+    tr = train_df.dropna(subset=base_need).sort_values(["station_id","ts"]).reset_index(drop=True)
+    te = test_df.dropna(subset=base_need).sort_values(["station_id","ts"]).reset_index(drop=True)
+    Xtr = tr[feat_cols].to_numpy(dtype="float32")
+    ts  = tr["ts"]
+
+    jobs = {}
+    for h in horizons:
+        ok = tr[[f"occ_{h}", f"occ_delta_target_{h}"]].notna().all(axis=1).to_numpy()
+        cut = ts[ok].quantile(SPLIT_TRAINVAL)
+        fit, val = ok & (ts <= cut).to_numpy(), ok & (ts > cut).to_numpy()
+        y = tr[f"occ_delta_target_{h}"].to_numpy(dtype="float32")
+        jobs[h] = (np.flatnonzero(fit), y[fit], np.flatnonzero(val), y[val])
+    return tr, te, Xtr, jobs
+
+def train_horizons_shared(train_df, test_df, feat_cols, horizons, num_threads=2, workers=1,
+                          threads_per_worker=None, gamma_grid=(0.5, 0.7, 0.9, 1.0), params=None):
+    """train_delta_gamma for several horizons on one binned Dataset.
+
+    Rows with complete features are binned once; each horizon only picks its
+    rows (label defined) and its own SPLIT_TRAINVAL cut, as train_delta_gamma
+    does, so the train/val/test rows are unchanged. Bin boundaries come from
+    all train rows instead of each horizon's fit rows. With workers > 1 the
+    binned Dataset is saved once and horizons train in a spawn process pool,
+    `threads_per_worker` threads each (default: num_threads // workers).
+    `params`: {h: LightGBM overrides} on top of LGB_PARAMS (e.g. from search.py).
+    Returns {h: dict(mae, model, best_iter, gamma, train_s, peak_rss_mb)}.
+    """
+    tr, te, Xtr, jobs = shared_rows(train_df, test_df, feat_cols, horizons)
+
+    workers = max(1, min(int(workers), len(horizons)))
+    tpw = threads_per_worker or max(1, num_threads // workers)
+    hparams = {h: dict(LGB_PARAMS, **(params or {}).get(h, {}), num_threads=tpw if workers > 1 else num_threads)
+               for h in horizons}
+    # overrides may lower min_data_in_leaf
+    ds_params = {"verbosity": -1, **({"feature_pre_filter": False} if params else {})}
+    base = lgb.Dataset(Xtr, label=np.zeros(len(Xtr), dtype="float32"), feature_name=list(feat_cols),
+                       free_raw_data=False, params={**ds_params, "num_threads": num_threads}).construct()
+
+    fitted = {}
+    if workers == 1:
+        for h in horizons:
+            model, secs = _fit_on_shared(base, *jobs[h], hparams[h])
+            fitted[h] = (model, int(model.best_iteration or 0), secs, peak_rss_mb())
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            bin_path = os.path.join(tmp, "train.bin")
+            base.save_binary(bin_path)
+            kw = {"max_tasks_per_child": 1} if sys.version_info >= (3, 11) else {}  # per-horizon peak RSS
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), **kw) as ex:
+                futs = {h: ex.submit(_fit_worker, bin_path, *jobs[h], hparams[h], ds_params) for h in horizons}
+                for h, f in futs.items():
+                    txt, best_iter, secs, rss = f.result()
+                    fitted[h] = (lgb.Booster(model_str=txt), best_iter, secs, rss)
+
+    results = {}
+    for h in horizons:
+        model, best_iter, secs, rss = fitted[h]
+        num_it = best_iter or None
+        idx_val = jobs[h][2]
+        delta_val = model.predict(Xtr[idx_val], num_iteration=num_it)
+        cap_val = tr["capacity"].to_numpy()[idx_val]
+        best_g, _ = _calibrate_gamma(delta_val, tr["occ_now"].to_numpy()[idx_val], cap_val,
+                                     tr[f"occ_{h}"].to_numpy()[idx_val] * cap_val, gamma_grid)
+        te_h = te[te[[f"occ_{h}", f"occ_delta_target_{h}"]].notna().all(axis=1)]
+        cap_te = te_h["capacity"].to_numpy()
+        delta_te = model.predict(te_h[feat_cols].to_numpy(dtype="float32"), num_iteration=num_it)
+        y_hat_t = np.clip(te_h["occ_now"].to_numpy() + best_g*delta_te, 0, 1) * cap_te
+        mae_t = mean_absolute_error(te_h[f"occ_{h}"].to_numpy() * cap_te, y_hat_t)
+        results[h] = dict(mae=mae_t, model=model, best_iter=best_iter, gamma=float(best_g),
+                          train_s=float(secs), peak_rss_mb=float(rss))
+    return results
+
+# ---- one model for all horizons: (row, horizon) examples, horizon as the last feature ----
+def with_horizon_targets(df, horizons, freq_min=FREQ_MIN):
+    """df plus occ_{h} / occ_delta_target_{h} for the horizons it lacks (same shift as make_delta_targets)."""
+    add, occ = {}, df["occ"]
+    for h in horizons:
+        if f"occ_{h}" in df.columns and f"occ_delta_target_{h}" in df.columns:
+            continue
+        occ_h = df.groupby("station_id", observed=True)["occ"].shift(-(h // freq_min)).astype("float32")
+        add[f"occ_{h}"] = occ_h
+        add[f"occ_delta_target_{h}"] = (occ_h - occ).astype("float32")
+    return df.assign(**add) if add else df
+
+def _stack(X, idx_by_h, horizons):
+    rows = np.concatenate([idx_by_h[h] for h in horizons])
+    hcol = np.repeat(np.asarray(horizons, dtype="float32"), [len(idx_by_h[h]) for h in horizons])
+    return np.column_stack([X[rows], hcol])
+
+def train_multi_horizon(train_df, test_df, feat_cols, horizons, num_threads=2,
+                        gamma_grid=(0.5, 0.7, 0.9, 1.0), params=None, num_boost_round=None):
+    """One Δ model for all `horizons`, trained on stacked (row, horizon) examples.
+
+    Each horizon contributes the rows (and train/val cut) train_horizons_shared
+    would use for it, with HORIZON_FEATURE = h appended as the last column, so
+    any grid (e.g. 5..90 every 5 min) is one model; targets of horizons not in
+    the frames are computed from "occ". Gamma is still calibrated per horizon.
+    `params`: LightGBM overrides on top of LGB_PARAMS.
+    Returns dict(model, best_iter, train_s, peak_rss_mb, n_train,
+    per_h={h: dict(mae, gamma, n_test)}).
+    """
+    horizons = sorted(int(h) for h in horizons)
+    if any(h <= 0 or h % FREQ_MIN for h in horizons):
+        raise ValueError(f"horizons must be positive multiples of {FREQ_MIN} min, got {horizons}")
+    tr, te, Xtr, jobs = shared_rows(with_horizon_targets(train_df, horizons),
+                                    with_horizon_targets(test_df, horizons), feat_cols, horizons)
+    Xfit = _stack(Xtr, {h: jobs[h][0] for h in horizons}, horizons)
+    Xval = _stack(Xtr, {h: jobs[h][2] for h in horizons}, horizons)
+    yfit = np.concatenate([jobs[h][1] for h in horizons])
+    yval = np.concatenate([jobs[h][3] for h in horizons])
+
+    t0 = time.time()
+    names = list(feat_cols) + [HORIZON_FEATURE]
+    ds_params = {"verbosity": -1, "num_threads": num_threads, **({"feature_pre_filter": False} if params else {})}
+    dtrain = lgb.Dataset(Xfit, label=yfit, feature_name=names, params=ds_params)
+    dval = lgb.Dataset(Xval, label=yval, reference=dtrain)
+    model = lgb.train(dict(LGB_PARAMS, **(params or {}), num_threads=num_threads), dtrain,
+                      num_boost_round=num_boost_round or NUM_BOOST_ROUND,
+                      valid_sets=[dtrain, dval], valid_names=["train","val"],
+                      callbacks=[lgb.early_stopping(stopping_rounds=EARLY_STOPPING, verbose=False)])
+    secs = time.time() - t0
+    best_iter = int(model.best_iteration or 0)
+    num_it = best_iter or None
+    del Xfit, dtrain
+
+    per_h, start = {}, 0
+    occ_now, cap = tr["occ_now"].to_numpy(), tr["capacity"].to_numpy()
+    delta_val_all = model.predict(Xval, num_iteration=num_it)
+    for h in horizons:
+        idx_val = jobs[h][2]
+        delta_val = delta_val_all[start:start + len(idx_val)]
+        start += len(idx_val)
+        best_g, _ = _calibrate_gamma(delta_val, occ_now[idx_val], cap[idx_val],
+                                     tr[f"occ_{h}"].to_numpy()[idx_val] * cap[idx_val], gamma_grid)
+        te_h = te[te[[f"occ_{h}", f"occ_delta_target_{h}"]].notna().all(axis=1)]
+        cap_te = te_h["capacity"].to_numpy()
+        Xte = np.column_stack([te_h[feat_cols].to_numpy(dtype="float32"), np.full(len(te_h), h, dtype="float32")])
+        delta_te = model.predict(Xte, num_iteration=num_it)
+        y_hat_t = np.clip(te_h["occ_now"].to_numpy() + best_g*delta_te, 0, 1) * cap_te
+        per_h[h] = dict(mae=mean_absolute_error(te_h[f"occ_{h}"].to_numpy() * cap_te, y_hat_t),
+                        gamma=float(best_g), n_test=len(te_h))
+    return dict(model=model, best_iter=best_iter, train_s=float(secs), peak_rss_mb=peak_rss_mb(),
+                n_train=len(yfit), per_h=per_h)
@@ -0,0 +1,195 @@
+# src/velib_ml/trees.py
+# LightGBM text models compiled to flat node arrays and evaluated with numpy only
+# (no lightgbm import): every (row, tree) cursor walks down in lock-step.
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+
+K_ZERO = 1e-35               # LightGBM kZeroThreshold
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+COMPACT_EVERY = 4            # drop cursors that reached a leaf every k steps
+ARRAYS = ("feature", "threshold", "default_left", "missing_type", "children", "value", "roots")
+_IDENTITY = ("regression", "regression_l1", "huber", "fair", "quantile", "mape")
+_EXP = ("poisson", "gamma", "tweedie")
+
+
+def _parse(text: str):
+    """LightGBM model text → (header dict, list of per-tree dicts)."""
+    header: Dict[str, str] = {}
+    trees: List[Dict[str, str]] = []
+    cur = header
+    for line in text.splitlines():
+        if line.startswith("Tree="):
+            cur = {}
+            trees.append(cur)
+        elif line.startswith("end of trees"):
+            break
+        elif "=" in line:
+            k, v = line.split("=", 1)
+            cur[k] = v
+    return header, trees
+
+
+def _arr(tree, key, dtype):
+    return np.array(tree[key].split(), dtype=dtype) if tree.get(key) else np.zeros(0, dtype)
+
+
+def _depth(lc: np.ndarray, rc: np.ndarray) -> int:
+    """Max number of splits on a root → leaf path."""
+    d, stack = 0, [(0, 1)]
+    while stack:
+        i, k = stack.pop()
+        d = max(d, k)
+        stack.extend((c, k + 1) for c in (lc[i], rc[i]) if c >= 0)
+    return d
+
+
+class CompiledTrees:
+    """A LightGBM regression forest as flat arrays over all trees' nodes.
+
+    Internal nodes of every tree come first (0 .. n_internal-1), leaves after,
+    so "cursor is on a leaf" is `node >= n_internal`. Children are interleaved
+    as children[2*node + go_left]; a leaf is its own child, so cursors can keep
+    stepping between compactions. Only numerical splits are supported (the Δocc
+    models have no categorical features); NaN/zero handling follows LightGBM's
+    NumericalDecision. `predict(X)` matches Booster.predict(X) up to float
+    summation order.
+    """
+
+    def __init__(self, text: str, num_iteration: Optional[int] = None):
+        header, trees = _parse(text)
+        if int(header.get("num_tree_per_iteration", 1)) != 1:
+            raise ValueError("only single-output models are supported")
+        obj = header.get("objective", "regression").split()
+        if obj[0] in _IDENTITY and "sqrt" not in obj:
+            self.link = "identity"
+        elif obj[0] in _EXP:
+            self.link = "exp"
+        else:
+            raise ValueError(f"unsupported objective for compiled inference: {' '.join(obj)}")
+        self.feature_names = header.get("feature_names", "").split()
+        self.average_output = "average_output" in header
+        if num_iteration is not None and num_iteration > 0:
+            trees = trees[:num_iteration]
+
+        n_int = sum(int(t["num_leaves"]) - 1 for t in trees)
+        n_leaf = sum(int(t["num_leaves"]) for t in trees)
+        self.n_internal = n_int
+        n_all = n_int + n_leaf
+        self.feature = np.zeros(n_all, dtype="intp")
+        self.threshold = np.zeros(n_all, dtype="float64")
+        self.default_left = np.zeros(n_all, dtype=bool)
+        self.missing_type = np.zeros(n_all, dtype="uint8")
+        self.children = np.repeat(np.arange(n_all, dtype="intp"), 2)   # [2i] right, [2i+1] left
+        self.value = np.zeros(n_all, dtype="float64")
+        self.roots = np.zeros(len(trees), dtype="intp")
+        self.depth = 0
+
+        i0, l0 = 0, n_int
+        for k, t in enumerate(trees):
+            nl = int(t["num_leaves"])
+            self.value[l0:l0 + nl] = _arr(t, "leaf_value", "float64")[:nl]
+            ni = nl - 1
+            if ni == 0:               # single-leaf tree: the root is the leaf
+                self.roots[k] = l0
+                l0 += 1
+                continue
+            dt = _arr(t, "decision_type", "int64")
+            if (dt & 1).any():
+                raise ValueError("categorical splits are not supported")
+            lc, rc = _arr(t, "left_child", "int64"), _arr(t, "right_child", "int64")
+            glob = lambda c: np.where(c >= 0, i0 + c, l0 + ~c)   # leaf ~c → its global slot
+            sl = slice(i0, i0 + ni)
+            self.feature[sl] = _arr(t, "split_feature", "int64")
+            self.threshold[sl] = _arr(t, "threshold", "float64")
+            self.default_left[sl] = (dt & 2) > 0
+            self.missing_type[sl] = (dt >> 2) & 3
+            self.children[2 * i0:2 * (i0 + ni):2] = glob(rc)
+            self.children[2 * i0 + 1:2 * (i0 + ni):2] = glob(lc)
+            self.roots[k] = i0
+            self.depth = max(self.depth, _depth(lc, rc))
+            i0, l0 = i0 + ni, l0 + nl
+        self.has_zero_missing = bool((self.missing_type == MISSING_ZERO).any())
+
+    @classmethod
+    def from_file(cls, path, num_iteration: Optional[int] = None) -> "CompiledTrees":
+        return cls(Path(path).read_text(), num_iteration=num_iteration)
+
+    @classmethod
+    def from_booster(cls, booster, num_iteration: Optional[int] = None) -> "CompiledTrees":
+        return cls(booster.model_to_string(), num_iteration=num_iteration)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Node arrays + scalars (as 0-d arrays): what `from_arrays` needs, no text parsing."""
+        out = {k: getattr(self, k) for k in ARRAYS}
+        out["scalars"] = np.array([self.n_internal, self.depth, int(self.has_zero_missing),
+                                   int(self.average_output), int(self.link == "exp")], dtype="int64")
+        return out
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], feature_names: List[str] = ()) -> "CompiledTrees":
+        self = cls.__new__(cls)
+        for k in ARRAYS:
+            setattr(self, k, arrays[k])
+        n_int, depth, zero_missing, avg, exp = (int(v) for v in arrays["scalars"])
+        self.n_internal, self.depth = n_int, depth
+        self.has_zero_missing, self.average_output = bool(zero_missing), bool(avg)
+        self.link = "exp" if exp else "identity"
+        self.feature_names = list(feature_names)
+        return self
+
+    @property
+    def num_trees(self) -> int:
+        return len(self.roots)
+
+    def num_feature(self) -> int:
+        return len(self.feature_names)
+
+    def _go_left(self, x, node):
+        thr = self.threshold.take(node)
+        mt = self.missing_type.take(node)
+        nan = np.isnan(x)
+        x = np.where(nan & (mt != MISSING_NAN), 0.0, x)
+        to_default = ((mt == MISSING_ZERO) & (np.abs(x) <= K_ZERO)) | ((mt == MISSING_NAN) & nan)
+        return np.where(to_default, self.default_left.take(node), x <= thr)
+
+    def predict_raw(self, X) -> np.ndarray:
+        """Sum of leaf values per row. X: (n, n_features) buffer, float32 or float64."""
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X[None, :]
+        n, F = X.shape
+        flat = X.reshape(-1)
+        T = self.num_trees
+        node = np.tile(self.roots, n)                              # one cursor per (row, tree)
+        base = np.repeat(np.arange(n, dtype="intp") * F, T)
+        row = np.repeat(np.arange(n, dtype="intp"), T)
+        out = np.zeros(n)
+        check_missing = self.has_zero_missing or bool(np.isnan(flat).any())
+
+        def collect(mask):
+            if n == 1:
+                out[0] += self.value.take(node[mask]).sum()
+            else:
+                out[:] += np.bincount(row[mask], self.value.take(node[mask]), minlength=n)
+
+        for d in range(self.depth + 1):
+            if d % COMPACT_EVERY == 0 or d == self.depth:
+                done = node >= self.n_internal
+                if done.any():
+                    collect(done)
+                    keep = ~done
+                    node, base, row = node[keep], base[keep], row[keep]
+                if not len(node):
+                    break
+            x = flat.take(self.feature.take(node) + base)
+            go = self._go_left(x, node) if check_missing else x <= self.threshold.take(node)
+            node = self.children.take((node << 1) | go)
+        if self.average_output and T:
+            out /= T
+        return out
+
+    def predict(self, X) -> np.ndarray:
+        raw = self.predict_raw(X)
+        return np.exp(raw) if self.link == "exp" else raw
@@ -1,8 +1,17 @@
+import numpy as np
 import pandas as pd
+from pathlib import Path
 from typing import Iterable
 
 WEATHER_COLS = ["temperature_2m","precipitation","wind_speed_10m"]
 
+def load_weather(path) -> pd.DataFrame:
+    """Hourly weather: CSV from fetch_weather.py --out, or a WeatherStore dir."""
+    if Path(path).is_dir():
+        from .weather_store import WeatherStore
+        return WeatherStore(path).read()
+    return pd.read_csv(path, parse_dates=["ts"])
+
 def resample_weather_to_5min(weather_hourly: pd.DataFrame) -> pd.DataFrame:
     w = weather_hourly.copy()
     w = w.set_index("ts").sort_index()
@@ -13,13 +22,30 @@ def resample_weather_to_5min(weather_hourly: pd.DataFrame) -> pd.DataFrame:
     w5.index.name = "ts"
     return w5.reset_index()
 
-def add_weather(feat_5min: pd.DataFrame, weather_5min: pd.DataFrame,
+def _epoch_ns(ts) -> np.ndarray:
+    return pd.DatetimeIndex(pd.to_datetime(ts, utc=True)).as_unit("ns").asi8
+
+def add_weather(feat: pd.DataFrame, weather: pd.DataFrame,
                 cols: Iterable[str] = WEATHER_COLS) -> pd.DataFrame:
-    w = weather_5min[["ts", *cols]].copy()
-    out = feat_5min.merge(w, on="ts", how="left")
-    # safety fill (rare gaps at edges)
-    for c in cols:
-        out[c] = out[c].fillna(method="ffill").fillna(method="bfill")
+    """Weather as of each row's ts: last observation at or before it (hourly or 5-min frame).
+
+    One searchsorted over the sorted weather timestamps, no merge; rows before
+    the first / after the last observation get the edge values.
+    """
+    cols = list(cols)
+    w_ts = _epoch_ns(weather["ts"])
+    order = np.argsort(w_ts, kind="stable")
+    w_ts = w_ts[order]
+    out = feat.copy(deep=False)
+    if not len(w_ts):
+        for c in cols:
+            out[c] = np.nan
+    else:
+        vals = weather[cols].iloc[order].ffill().bfill()   # gaps inside the weather series
+        idx = np.searchsorted(w_ts, _epoch_ns(feat["ts"]), side="right") - 1
+        np.clip(idx, 0, len(w_ts) - 1, out=idx)
+        for c in cols:
+            out[c] = vals[c].to_numpy()[idx]
     # a few simple transformations
     out["is_rain"] = (out.get("precipitation", 0) > 0.1).astype("uint8")
-    return out
\ No newline at end of file
+    return out
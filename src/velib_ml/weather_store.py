@@ -0,0 +1,214 @@
+# src/velib_ml/weather_store.py
+# Local hourly weather history: one Parquet file per month (YYYY-MM.parquet) and a
+# manifest.json of the day ranges already covered. `update(start, end)` fetches only
+# what is missing, one request per month piece, several in parallel, retrying with
+# jittered exponential backoff. Days with missing values (the archive lags a few days
+# behind) are stored but not marked covered, so the next update asks for them again.
+from __future__ import annotations
+import datetime as dt, json, os, random, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+import pandas as pd
+import requests
+
+from .live_weather import LAT, LON
+from .weather import WEATHER_COLS
+
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/era5"
+HISTFORECAST_URL = "https://historical-forecast-api.open-meteo.com/v1/forecast"   # fallback
+MANIFEST = "manifest.json"
+
+Range = Tuple[dt.date, dt.date]        # inclusive days
+
+
+def _day(d) -> dt.date:
+    return d if isinstance(d, dt.date) and not isinstance(d, dt.datetime) else pd.Timestamp(d).date()
+
+
+def merge_ranges(ranges: List[Range]) -> List[Range]:
+    """Sorted, non-overlapping ranges (adjacent days joined)."""
+    out: List[Range] = []
+    for a, b in sorted(ranges):
+        if out and a <= out[-1][1] + dt.timedelta(days=1):
+            out[-1] = (out[-1][0], max(out[-1][1], b))
+        else:
+            out.append((a, b))
+    return out
+
+
+def subtract_ranges(a: dt.date, b: dt.date, covered: List[Range]) -> List[Range]:
+    """Parts of [a, b] not in `covered` (merged)."""
+    out, cur = [], a
+    for c0, c1 in covered:
+        if c1 < cur or c0 > b:
+            continue
+        if c0 > cur:
+            out.append((cur, c0 - dt.timedelta(days=1)))
+        cur = max(cur, c1 + dt.timedelta(days=1))
+    if cur <= b:
+        out.append((cur, b))
+    return out
+
+
+def split_months(ranges: List[Range]) -> List[Range]:
+    """Ranges cut at month boundaries (one request → one month file)."""
+    out = []
+    for a, b in ranges:
+        while a <= b:
+            nxt = (a.replace(day=28) + dt.timedelta(days=4)).replace(day=1)
+            out.append((a, min(b, nxt - dt.timedelta(days=1))))
+            a = nxt
+    return out
+
+
+class OpenMeteoArchive:
+    """Hourly history from Open-Meteo (ERA5 archive, historical forecast as fallback).
+
+    Retries connection errors, 429 and 5xx with full-jitter exponential
+    backoff (sleep uniform(0, min(max_backoff_s, backoff_s * 2**k))); other
+    4xx fail at once. `base_url` / `fallback_url` can point at a local stub.
+    """
+
+    def __init__(self, base_url: str = ARCHIVE_URL, fallback_url: Optional[str] = HISTFORECAST_URL,
+                 attempts: int = 5, backoff_s: float = 1.0, max_backoff_s: float = 30.0,
+                 timeout: float = 30, session: Optional[requests.Session] = None):
+        self.base_url, self.fallback_url = base_url, fallback_url
+        self.attempts, self.backoff_s, self.max_backoff_s = attempts, backoff_s, max_backoff_s
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.stats = {"requests": 0, "retries": 0, "fallbacks": 0}
+
+    def _call(self, url: str, params: dict) -> dict:
+        for k in range(self.attempts):
+            self.stats["requests"] += 1
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout)
+                if r.ok:
+                    j = r.json()
+                    if isinstance(j, dict) and j.get("error"):
+                        raise ValueError(f"{url} → {j.get('reason')}")
+                    return j
+                if r.status_code != 429 and r.status_code < 500:
+                    raise ValueError(f"{url} [{r.status_code}] → {r.text[:200]}")
+                err = RuntimeError(f"{url} [{r.status_code}]")
+            except requests.RequestException as e:
+                err = e
+            if k == self.attempts - 1:
+                raise err
+            self.stats["retries"] += 1
+            time.sleep(random.uniform(0, min(self.max_backoff_s, self.backoff_s * 2 ** k)))
+
+    def __call__(self, start: dt.date, end: dt.date) -> pd.DataFrame:
+        params = dict(latitude=LAT, longitude=LON, timezone="UTC", hourly=",".join(WEATHER_COLS),
+                      start_date=start.isoformat(), end_date=end.isoformat())
+        try:
+            j = self._call(self.base_url, params)
+        except Exception:
+            if not self.fallback_url:
+                raise
+            self.stats["fallbacks"] += 1
+            j = self._call(self.fallback_url, params)
+        hourly = j.get("hourly") or {}
+        if "time" not in hourly:
+            raise RuntimeError("No 'hourly.time' in response")
+        df = pd.DataFrame(hourly)
+        df["ts"] = pd.to_datetime(df.pop("time"), utc=True)
+        for c in WEATHER_COLS:
+            if c not in df.columns:
+                df[c] = float("nan")
+        return df[["ts", *WEATHER_COLS]].astype({c: "float64" for c in WEATHER_COLS})
+
+
+class WeatherStore:
+    """Month-partitioned hourly weather + manifest of covered days, filled on demand."""
+
+    def __init__(self, root, fetcher: Optional[Callable[[dt.date, dt.date], pd.DataFrame]] = None,
+                 workers: int = 4):
+        self.root = Path(root)
+        self.fetcher = fetcher or OpenMeteoArchive()
+        self.workers = workers
+        self._lock = threading.Lock()
+
+    # ---- manifest ----
+    def covered(self) -> List[Range]:
+        try:
+            m = json.loads((self.root / MANIFEST).read_text())
+        except (OSError, ValueError):
+            return []
+        return [(_day(a), _day(b)) for a, b in m.get("covered", [])]
+
+    def _write_manifest(self, covered: List[Range]) -> None:
+        tmp = self.root / f".{MANIFEST}.{os.getpid()}"
+        tmp.write_text(json.dumps({"covered": [[a.isoformat(), b.isoformat()] for a, b in covered],
+                                   "updated_at": pd.Timestamp.now(tz="UTC").isoformat()}, indent=1))
+        os.replace(tmp, self.root / MANIFEST)
+
+    def missing(self, start, end) -> List[Range]:
+        return split_months(subtract_ranges(_day(start), _day(end), self.covered()))
+
+    # ---- fetch ----
+    def month_path(self, month: str) -> Path:
+        return self.root / f"{month}.parquet"
+
+    def _store(self, a: dt.date, b: dt.date, df: pd.DataFrame) -> Optional[Range]:
+        """Merge one month piece into its file; the range to mark covered (complete days only)."""
+        path = self.month_path(a.strftime("%Y-%m"))
+        with self._lock:
+            if path.exists():
+                df = pd.concat([pd.read_parquet(path), df], ignore_index=True)
+            df = df.drop_duplicates("ts", keep="last").sort_values("ts").reset_index(drop=True)
+            tmp = path.with_suffix(f".tmp{os.getpid()}")
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        days = pd.Series(df["ts"].dt.date)
+        inside = (days >= a) & (days <= b)
+        bad = set(days[inside & df[WEATHER_COLS].isna().any(axis=1)])
+        bad |= {d for d, n in days[inside].value_counts().items() if n < 24}
+        bad |= {a + dt.timedelta(days=k) for k in range((b - a).days + 1)} - set(days[inside])
+        if not bad:
+            return a, b
+        first_bad = min(bad)
+        return (a, first_bad - dt.timedelta(days=1)) if first_bad > a else None
+
+    def update(self, start, end) -> dict:
+        """Fetch the days of [start, end] not covered yet (in parallel); summary dict."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        todo = self.missing(start, end)
+        t0 = time.time()
+        done, errors = [], []
+        if todo:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(todo))),
+                                    thread_name_prefix="weather") as pool:
+                futs = {pool.submit(self.fetcher, a, b): (a, b) for a, b in todo}
+                for fut, (a, b) in futs.items():
+                    try:
+                        got = self._store(a, b, fut.result())
+                    except Exception as e:           # other months still land; this one is retried next time
+                        errors.append(f"{a}..{b}: {e}")
+                        continue
+                    if got is not None:
+                        done.append(got)
+            with self._lock:
+                self._write_manifest(merge_ranges(self.covered() + done))
+        return {"requested": [str(_day(start)), str(_day(end))], "fetched": len(todo),
+                "covered_new": [[str(a), str(b)] for a, b in done], "errors": errors,
+                "seconds": round(time.time() - t0, 2)}
+
+    # ---- read ----
+    def read(self, start=None, end=None) -> pd.DataFrame:
+        """Hourly (ts, WEATHER_COLS) between start and end (days, inclusive), sorted."""
+        months = sorted(self.root.glob("[0-9][0-9][0-9][0-9]-[0-9][0-9].parquet"))
+        if start is not None:
+            months = [p for p in months if p.stem >= _day(start).strftime("%Y-%m")]
+        if end is not None:
+            months = [p for p in months if p.stem <= _day(end).strftime("%Y-%m")]
+        if not months:
+            return pd.DataFrame({"ts": pd.Series(dtype="datetime64[ns, UTC]"),
+                                 **{c: pd.Series(dtype="float64") for c in WEATHER_COLS}})
+        df = pd.concat([pd.read_parquet(p) for p in months], ignore_index=True).sort_values("ts")
+        if start is not None:
+            df = df[df["ts"] >= pd.Timestamp(_day(start), tz="UTC")]
+        if end is not None:
+            df = df[df["ts"] < pd.Timestamp(_day(end) + dt.timedelta(days=1), tz="UTC")]
+        return df.reset_index(drop=True)